@@ -0,0 +1,364 @@
+# bench/run_bench.py - 離線效能測試
+#!/usr/bin/env python3
+"""離線效能測試：以本機替身伺服器取代所有上游與 Telegram，量測主要路徑的延遲與吞吐
+
+用法：
+    python bench/run_bench.py --subscribers 500 --requests 300 --latency-ms 80 --error-rate 0.05
+
+輸出每個情境的 p50 / p95 / p99 延遲、吞吐量，以及整個程序的峰值 RSS。
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from standins import PENDLE_CHAINS, StandinConfig, StandinServer, pendle_market_address  # noqa: E402
+
+SCENARIOS = ["refresh", "dashboard", "dashboard_304", "api_yields", "check", "webhook", "broadcast", "cold_start"]
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def summarize(name, samples, wall_time, **extra):
+    """整理單一情境的統計（延遲單位 ms）"""
+    return dict({
+        "scenario": name,
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p95_ms": round(percentile(samples, 95) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        "max_ms": round(max(samples) * 1000, 2) if samples else 0.0,
+        "throughput": round(len(samples) / wall_time, 1) if wall_time > 0 else 0.0,
+    }, **extra)
+
+def peak_rss_mb():
+    # Linux 的 ru_maxrss 單位為 KB，macOS 為 bytes
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def wire_app(main, base_url, market_count):
+    """將 main 模組的所有上游位址指向替身伺服器，並追蹤 market_count 個合成 Pendle 市場"""
+    magpie = urlsplit(main.MAGPIE_API_URL)
+    main.MAGPIE_API_URL = f"{base_url}/magpie{magpie.path}?{magpie.query}"
+    main.PENDLE_API_URL = f"{base_url}/pendle"
+    main.market_registry = main.MarketRegistry(os.path.join(os.getcwd(), "markets.json"))
+    for i in range(market_count):
+        chain_id = PENDLE_CHAINS[i % len(PENDLE_CHAINS)]
+        index = i // len(PENDLE_CHAINS)
+        main.market_registry.add(main.PendleMarket(f"M{chain_id}-{index}", chain_id, pendle_market_address(chain_id, index)))
+    merkl = urlsplit(main.MERKL_API_URL)
+    main.MERKL_API_URL = f"{base_url}/merkl{merkl.path}?{merkl.query}"
+    main.HYPERLIQUID_API_URL = f"{base_url}/hyperliquid/info"
+    main.GITHUB_API_URL = f"{base_url}/github"
+    main.TELEGRAM_API_URL = f"{base_url}/telegram"
+    main.BOT_TOKEN = "123456:BENCH"
+    main.GITHUB_TOKEN = "bench-token"
+    main.GIST_ID = "benchgist"
+    main.disk_history = main.DiskHistory("")
+
+def bench_refresh(main, iterations):
+    """快照刷新（所有上游並行擷取 + 解析 + 格式化）"""
+    samples = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        main.snapshot_cache.refresh()
+        samples.append(time.perf_counter() - t0)
+    return summarize("refresh", samples, time.perf_counter() - started)
+
+def bench_http(main, name, path, requests, concurrency, conditional=False):
+    """以多執行緒對 Flask app 發送請求"""
+    headers = {"Accept-Encoding": "gzip, br"}
+    if conditional:
+        etag = main.app.test_client().get(path, headers=headers).headers.get("ETag")
+        headers["If-None-Match"] = etag
+
+    per_worker = max(requests // concurrency, 1)
+    statuses = {}
+    lock = threading.Lock()
+
+    def worker():
+        client = main.app.test_client()
+        local = []
+        for _ in range(per_worker):
+            t0 = time.perf_counter()
+            response = client.get(path, headers=headers)
+            local.append(time.perf_counter() - t0)
+            with lock:
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        return local
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: worker(), range(concurrency)))
+    wall = time.perf_counter() - started
+    samples = [sample for local in results for sample in local]
+    return summarize(name, samples, wall, statuses=statuses)
+
+def check_update(update_id, chat_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+            "text": "/check",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    }
+
+async def bench_check(main, requests, concurrency):
+    """經由 Telegram Application 處理 /check（含回覆送到替身 Telegram）"""
+    from telegram import Update
+
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def one(i):
+        async with semaphore:
+            update = Update.de_json(check_update(i + 1, 500000 + i), main.telegram_app.bot)
+            t0 = time.perf_counter()
+            await main.telegram_app.process_update(update)
+            samples.append(time.perf_counter() - t0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return summarize("check", samples, time.perf_counter() - started)
+
+def post_updates(main, updates, concurrency):
+    """以多執行緒將更新 POST 到 /webhook，回傳 (延遲, 狀態碼統計, 總時間)"""
+    statuses = {}
+    lock = threading.Lock()
+    chunks = [updates[i::concurrency] for i in range(concurrency)]
+
+    def worker(chunk):
+        client = main.app.test_client()
+        local = []
+        for update in chunk:
+            t0 = time.perf_counter()
+            response = client.post(main.WEBHOOK_PATH, json=update)
+            local.append(time.perf_counter() - t0)
+            with lock:
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        return local
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, chunks))
+    return [sample for local in results for sample in local], statuses, time.perf_counter() - started
+
+async def bench_webhook(main, requests, concurrency):
+    """/check 更新經 /webhook 進入接收佇列（約 10% 為 Telegram 重送），量測接收延遲與處理延遲"""
+    main.webhook_queue.start(asyncio.get_running_loop())
+    main.bot_ready.set()
+    updates = [check_update(i + 1, 600000 + i) for i in range(requests)]
+    updates += updates[: requests // 10]  # 重送
+    samples, statuses, wall = await asyncio.get_running_loop().run_in_executor(
+        None, post_updates, main, updates, concurrency
+    )
+    while main.webhook_queue.depth() or main.webhook_queue.stats()["in_flight"]:
+        await asyncio.sleep(0.01)
+    stats = main.webhook_queue.stats()
+    return summarize("webhook", samples, wall, statuses=statuses, **{
+        key: stats[key] for key in ("handled", "duplicate", "overloaded", "max_depth", "handler_p50_ms", "handler_p95_ms")
+    })
+
+async def bench_broadcast(main, subscriber_count):
+    """對 N 個模擬訂閱者推播"""
+    main.subscribers = set(range(1_000_000, 1_000_000 + subscriber_count))
+    main.state_store.import_subscribers(main.subscribers)
+    started = time.perf_counter()
+    await main.send_to_all_subscribers("Benchmark broadcast message")
+    wall = time.perf_counter() - started
+    report = main.last_broadcast_report or {}
+    return {
+        "scenario": "broadcast",
+        "count": report.get("total", 0),
+        "p50_ms": round(report.get("latency_p50", 0) * 1000, 2),
+        "p95_ms": round(report.get("latency_p95", 0) * 1000, 2),
+        "p99_ms": None,
+        "max_ms": round(report.get("latency_max", 0) * 1000, 2),
+        "throughput": round(report.get("sent", 0) / wall, 1) if wall > 0 else 0.0,
+        "sent": report.get("sent", 0),
+        "failed": report.get("failed", 0),
+        "evicted": len(report.get("evicted", [])),
+    }
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def bench_cold_start(base_url, runs, target):
+    """以子程序啟動 main.py，量測程序啟動到 /health 與 / 第一個回應的時間（TTFB）"""
+    health, dashboard = [], []
+    for _ in range(runs):
+        workdir = tempfile.mkdtemp(prefix="defi-cold-")
+        port = free_port()
+        env = dict(
+            os.environ,
+            PORT=str(port),
+            BOT_TOKEN="123456:BENCH",
+            TELEGRAM_API_URL=f"{base_url}/telegram",
+            GITHUB_API_URL=f"{base_url}/github",
+            GITHUB_TOKEN="bench-token",
+            GIST_ID="benchgist",
+            PENDLE_API_URL=f"{base_url}/pendle",
+            MAGPIE_API_URL=f"{base_url}/magpie/poolsnapshot/get?chainId=42161",
+            MERKL_API_URL=f"{base_url}/merkl/v4/opportunities?items=10",
+            HYPERLIQUID_API_URL=f"{base_url}/hyperliquid/info",
+            RENDER_EXTERNAL_URL=f"http://127.0.0.1:{port}",
+            MARKETS_FILE=os.path.join(REPO_DIR, "markets.json"),
+        )
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "main.py")], cwd=workdir, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            for path, samples in (("/health", health), ("/", dashboard)):
+                deadline = started + 30
+                while True:
+                    try:
+                        with urlopen(f"http://127.0.0.1:{port}{path}", timeout=30) as response:
+                            response.read(1)
+                        break
+                    except OSError:
+                        if time.perf_counter() > deadline or process.poll() is not None:
+                            raise RuntimeError(f"main.py did not answer {path} during cold start")
+                        time.sleep(0.01)
+                samples.append(time.perf_counter() - started)
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+    return summarize("cold_start", health, sum(health),
+                     dashboard_p50_ms=round(percentile(dashboard, 50) * 1000, 2),
+                     target_ms=round(target * 1000), target_met=percentile(health, 95) <= target)
+
+async def run_async_scenarios(main, args, selected):
+    results = []
+    if not await main.setup_telegram():
+        raise RuntimeError("Telegram application failed to initialize against the stand-in")
+    try:
+        if "check" in selected:
+            results.append(await bench_check(main, args.requests, args.concurrency))
+        if "webhook" in selected:
+            results.append(await bench_webhook(main, args.requests, args.concurrency))
+        if "broadcast" in selected:
+            results.append(await bench_broadcast(main, args.subscribers))
+    finally:
+        await main.telegram_app.stop()
+        await main.telegram_app.shutdown()
+    return results
+
+def print_table(results):
+    columns = ["scenario", "count", "p50_ms", "p95_ms", "p99_ms", "max_ms", "throughput"]
+    print("  ".join(f"{column:>12}" for column in columns))
+    for result in results:
+        print("  ".join(f"{'-' if result.get(column) is None else result.get(column):>12}" for column in columns))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the DeFi dashboard")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--markets", type=int, default=40, help="tracked Pendle markets, spread over 4 chains")
+    parser.add_argument("--subscribers", type=int, default=200, help="simulated subscribers for the broadcast scenario")
+    parser.add_argument("--requests", type=int, default=200, help="requests per HTTP / check scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--refresh-iterations", type=int, default=5)
+    parser.add_argument("--cold-start-runs", type=int, default=3, help="process launches for the cold_start scenario")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="mean upstream latency")
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls answered with HTTP 500")
+    parser.add_argument("--tg-latency-ms", type=float, default=30.0)
+    parser.add_argument("--tg-retry-after-rate", type=float, default=0.0)
+    parser.add_argument("--tg-forbidden-rate", type=float, default=0.0)
+    parser.add_argument("--broadcast-rate", type=float, default=None, help="override BROADCAST_RATE (msg/s)")
+    parser.add_argument("--json", dest="json_path", help="also write results to this JSON file")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args()
+
+def main_bench():
+    args = parse_args()
+    selected = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(selected) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    json_path = os.path.abspath(args.json_path) if args.json_path else None
+    os.chdir(tempfile.mkdtemp(prefix="defi-bench-"))  # 訂閱者與偏好設定檔寫到暫存目錄
+
+    config = StandinConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        telegram_latency_ms=args.tg_latency_ms,
+        telegram_retry_after_rate=args.tg_retry_after_rate,
+        telegram_forbidden_rate=args.tg_forbidden_rate,
+    )
+    standins = StandinServer(config).start()
+
+    import main
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    wire_app(main, standins.base_url, args.markets)
+    if args.broadcast_rate:
+        main.broadcast_engine = main.BroadcastEngine(rate=args.broadcast_rate, burst=int(args.broadcast_rate))
+
+    results = []
+    if "refresh" in selected:
+        results.append(bench_refresh(main, args.refresh_iterations))
+    main.snapshot_cache.get()  # HTTP 情境使用已建立的快照
+    if "dashboard" in selected:
+        results.append(bench_http(main, "dashboard", "/", args.requests, args.concurrency))
+    if "dashboard_304" in selected:
+        results.append(bench_http(main, "dashboard_304", "/", args.requests, args.concurrency, conditional=True))
+    if "api_yields" in selected:
+        results.append(bench_http(main, "api_yields", "/api/yields", args.requests, args.concurrency))
+    if {"check", "webhook", "broadcast"} & set(selected):
+        results.extend(asyncio.run(run_async_scenarios(main, args, selected)))
+
+    if "cold_start" in selected:
+        results.append(bench_cold_start(standins.base_url, args.cold_start_runs, main.COLD_START_TTFB_TARGET))
+
+    main.subscriber_persistence.flush()
+    summary = {
+        "results": results,
+        "peak_rss_mb": peak_rss_mb(),
+        "standin_requests": dict(sorted(config.counters.items())),
+        "config": vars(args),
+    }
+
+    print_table(results)
+    print(f"\nPeak RSS: {summary['peak_rss_mb']} MB")
+    print(f"Stand-in requests: {summary['standin_requests']}")
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        print(f"Results written to {json_path}")
+
+    standins.stop()
+
+if __name__ == "__main__":
+    main_bench()
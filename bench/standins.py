@@ -0,0 +1,228 @@
+# bench/standins.py - 本機替身伺服器（上游 API + Telegram Bot API）
+"""本機替身伺服器：以錄製的回應內容模擬所有上游與 Telegram Bot API
+
+單一 ThreadingHTTPServer 依路徑前綴分派：
+
+    /magpie/...       Magpie pool snapshot           (fixtures/magpie.json)
+    /pendle/...       Pendle markets：每鏈分頁列表 /core/v1/{chain}/markets 與單一市場
+                      /core/v2/{chain}/markets/{address}/data（以 fixtures/pendle_market.json 合成）
+    /merkl/...        Merkl opportunities            (fixtures/merkl.json)
+    /hyperliquid/...  Hyperliquid metaAndAssetCtxs   (fixtures/hyperliquid.json)
+    /github/...       GitHub Gist API                (fixtures/gist.json)
+    /telegram/...     Telegram Bot API（getMe、sendMessage、setWebhook 等）
+
+延遲與錯誤注入由 StandinConfig 設定。
+"""
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+UPSTREAM_FIXTURES = {
+    "magpie": "magpie.json",
+    "pendle": "pendle_market.json",
+    "merkl": "merkl.json",
+    "hyperliquid": "hyperliquid.json",
+    "github": "gist.json",
+}
+
+@dataclass
+class StandinConfig:
+    """替身伺服器的延遲與錯誤注入設定"""
+    latency_ms: float = 50.0  # 上游平均延遲
+    jitter_ms: float = 20.0
+    error_rate: float = 0.0  # 上游回傳 HTTP 500 的比例
+    telegram_latency_ms: float = 30.0
+    telegram_retry_after_rate: float = 0.0  # sendMessage 回傳 429 RetryAfter 的比例
+    telegram_forbidden_rate: float = 0.0  # sendMessage 回傳 403（封鎖 Bot）的比例
+    pendle_markets_per_chain: int = 250  # 每鏈列表端點回傳的合成市場數
+    seed: int = 1
+    counters: dict = field(default_factory=dict)
+
+PENDLE_CHAINS = (1, 42161, 56, 146)
+
+def pendle_market_address(chain_id, index):
+    """合成市場的固定地址（run_bench 以同一規則建立追蹤清單）"""
+    return f"0x{chain_id:08x}{index:032x}"
+
+def load_fixtures():
+    fixtures = {}
+    for group, filename in UPSTREAM_FIXTURES.items():
+        with open(os.path.join(FIXTURES_DIR, filename), "rb") as f:
+            fixtures[group] = f.read()
+    return fixtures
+
+class StandinServer:
+    """在背景執行緒啟動替身伺服器"""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or StandinConfig()
+        self.fixtures = load_fixtures()
+        self.random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._message_id = 0
+        handler = type("StandinHandler", (StandinHandler,), {"server_ref": self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="standins", daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, key):
+        with self._lock:
+            self.config.counters[key] = self.config.counters.get(key, 0) + 1
+
+    def roll(self, rate):
+        with self._lock:
+            return self.random.random() < rate
+
+    def delay(self, mean_ms, jitter_ms):
+        with self._lock:
+            ms = max(mean_ms + self.random.uniform(-jitter_ms, jitter_ms), 0.0)
+        time.sleep(ms / 1000)
+
+    def next_message_id(self):
+        with self._lock:
+            self._message_id += 1
+            return self._message_id
+
+class StandinHandler(BaseHTTPRequestHandler):
+    server_ref = None
+    protocol_version = "HTTP/1.1"  # 支援 keep-alive
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionResetError:
+            pass  # cold_start 情境結束子程序時的連線中斷
+
+    def _send_json(self, status, body, headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        content_type = self.headers.get("Content-Type", "")
+        if not raw:
+            return {}
+        if "json" in content_type:
+            return json.loads(raw)
+        return {key: values[0] for key, values in parse_qs(raw.decode("utf-8")).items()}
+
+    def _handle(self, method):
+        server = self.server_ref
+        config = server.config
+        path = urlsplit(self.path).path
+        group = path.strip("/").split("/", 1)[0]
+        body = self._read_body() if method in ("POST", "PATCH") else {}
+        server.count(group)
+
+        if group == "telegram":
+            return self._handle_telegram(path, body)
+
+        if group not in server.fixtures:
+            return self._send_json(404, {"error": "unknown route"})
+
+        server.delay(config.latency_ms, config.jitter_ms)
+        if server.roll(config.error_rate):
+            server.count(f"{group}:error")
+            return self._send_json(500, {"error": "injected failure"})
+        if group == "pendle":
+            return self._handle_pendle(path)
+        if group == "github" and method == "POST":
+            return self._send_json(201, server.fixtures[group])
+        if group == "github":
+            etag = f'"{hashlib.sha1(server.fixtures[group]).hexdigest()}"'
+            if self.headers.get("If-None-Match") == etag:
+                server.count("github:not_modified")
+                return self._send_json(304, b"", {"ETag": etag})
+            return self._send_json(200, server.fixtures[group], {"ETag": etag})
+        return self._send_json(200, server.fixtures[group])
+
+    def _handle_pendle(self, path):
+        server = self.server_ref
+        market = json.loads(server.fixtures["pendle"])
+        parts = path.strip("/").split("/")  # pendle core v1 {chain} markets
+        if len(parts) == 5 and parts[2] == "v1" and parts[4] == "markets":
+            chain_id = int(parts[3])
+            query = parse_qs(urlsplit(self.path).query)
+            skip = int(query.get("skip", ["0"])[0])
+            limit = int(query.get("limit", ["100"])[0])
+            total = server.config.pendle_markets_per_chain
+            results = [
+                dict(market, address=pendle_market_address(chain_id, index), chainId=chain_id)
+                for index in range(skip, min(skip + limit, total))
+            ]
+            return self._send_json(200, {"total": total, "limit": limit, "skip": skip, "results": results})
+        return self._send_json(200, market)
+
+    def _handle_telegram(self, path, body):
+        server = self.server_ref
+        config = server.config
+        api_method = path.rsplit("/", 1)[-1]
+        server.delay(config.telegram_latency_ms, config.telegram_latency_ms / 3)
+
+        if api_method == "getMe":
+            return self._send_json(200, {"ok": True, "result": {
+                "id": 1000001, "is_bot": True, "first_name": "Bench", "username": "bench_bot",
+            }})
+        if api_method in ("sendMessage", "editMessageText"):
+            if server.roll(config.telegram_retry_after_rate):
+                server.count("telegram:retry_after")
+                return self._send_json(429, {
+                    "ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1},
+                })
+            if server.roll(config.telegram_forbidden_rate):
+                server.count("telegram:forbidden")
+                return self._send_json(403, {
+                    "ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user",
+                })
+            chat_id = int(body.get("chat_id", 0))
+            return self._send_json(200, {"ok": True, "result": {
+                "message_id": server.next_message_id(),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": body.get("text", ""),
+            }})
+        # setWebhook / deleteWebhook / 其他方法一律成功
+        return self._send_json(200, {"ok": True, "result": True})
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
@@ -0,0 +1,21 @@
+# gunicorn.conf.py - 多 worker 部署設定
+"""啟動方式：gunicorn -c gunicorn.conf.py main:app
+
+每個 worker 都提供網頁服務，其中一個以檔案鎖選出的 leader 負責刷新快照、
+Telegram Bot 與推播（見 main.py「多 worker 模式」）。
+"""
+
+import multiprocessing
+import os
+
+os.environ.setdefault("WORKER_MODE", "multi")  # 在 fork worker 前設定，所有 worker 皆繼承
+
+bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+timeout = 60
+graceful_timeout = 30
+
+def post_worker_init(worker):
+    import main
+    main.start_worker()
@@ -1,20 +1,88 @@
 # main.py - Render 雲端版本 (整合 GitHub Gist 自動備份)
 #!/usr/bin/env python3
+from __future__ import annotations  # 型別註記不在定義時求值（numpy / telegram 為延遲載入）
+
+import time
+STARTED_AT = time.monotonic()  # 冷啟動計時起點，需在其他 import 之前
 
 import datetime
+import importlib
 import json
 import os
 import logging
 import requests
 import asyncio
 import threading
-import time
 import signal
 import sys
+import atexit
+import gzip
+import base64
+import hashlib
+import mmap
+import re
+import struct
+import bisect
+import sqlite3
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait as wait_futures
+from dataclasses import dataclass, fields, is_dataclass, replace
 from datetime import timedelta
-from flask import Flask, request, jsonify, render_template_string
-from telegram import Update, Bot
-from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes
+from urllib.parse import urlsplit
+from flask import Flask, Response, g, request, jsonify, render_template_string
+from requests.adapters import HTTPAdapter
+from typing import TYPE_CHECKING
+from urllib3.util.retry import Retry
+from werkzeug.serving import make_server
+
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import ContextTypes
+
+try:
+    import brotli  # 選用：安裝後額外提供 br 壓縮
+except ImportError:
+    brotli = None
+
+class LazyModule:
+    """延遲載入的模組代理：第一次存取屬性時才真正 import（縮短冷啟動到綁定埠的時間）
+
+    不使用 importlib.util.LazyLoader：它在 3.11 並非執行緒安全，多個執行緒同時第一次存取時
+    可能拿到尚未初始化完成的模組。這裡以鎖保護唯一一次的 import_module，且不預先放入 sys.modules。
+    """
+
+    def __init__(self, name):
+        self._lazy_name = name
+        self._lazy_module = None
+        self._lazy_lock = threading.Lock()
+
+    def _lazy_resolve(self):
+        if self._lazy_module is None:
+            with self._lazy_lock:
+                if self._lazy_module is None:
+                    self._lazy_module = importlib.import_module(self._lazy_name)
+        return self._lazy_module
+
+    def __getattr__(self, attr):
+        return getattr(self._lazy_resolve(), attr)
+
+def lazy_import(name):
+    """已載入的模組直接回傳，否則回傳 LazyModule"""
+    return sys.modules.get(name) or LazyModule(name)
+
+def warm_lazy_imports():
+    """在背景啟動執行緒上完成延遲載入，之後的請求與背景工作不必再付 import 的成本"""
+    for module in (np, telegram):
+        if isinstance(module, LazyModule):
+            module._lazy_resolve()
+
+np = lazy_import("numpy")
+telegram = lazy_import("telegram")
+
+try:
+    import fcntl  # 多 worker 模式的 leader 選舉（Unix 檔案鎖）
+except ImportError:
+    fcntl = None
 
 # === 設定日誌 ===
 logging.basicConfig(
@@ -25,34 +93,122 @@ logger = logging.getLogger(__name__)
 
 # === 配置常數 ===
 BOT_TOKEN = os.getenv("BOT_TOKEN")  # 從環境變數讀取
-SUB_FILE = "subscribers.json"
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+SUB_FILE = "subscribers.json"  # 舊版訂閱者檔案，僅供匯入
+STATE_DB = os.getenv("STATE_DB", "state.db")  # 訂閱者、偏好設定與推播狀態（SQLite WAL）
+SUBSCRIBER_FLUSH_DELAY = float(os.getenv("SUBSCRIBER_FLUSH_DELAY", 5))  # 最後一次變更後延遲寫入（秒）
+SUBSCRIBER_FLUSH_MAX_DELAY = float(os.getenv("SUBSCRIBER_FLUSH_MAX_DELAY", 30))  # 持續變更時最長延遲（秒）
 PORT = int(os.getenv("PORT", 10000))  # Render 預設端口
 WEBHOOK_PATH = "/webhook"
+WEBHOOK_READY_TIMEOUT = float(os.getenv("WEBHOOK_READY_TIMEOUT", 5))  # Bot 尚未就緒時 webhook 最多等待秒數，逾時回 503 讓 Telegram 重送
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 256))  # 等待處理的更新上限，超過回 503 讓 Telegram 稍後重送
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", 8))  # 同時執行的指令處理數
+WEBHOOK_DEDUPE_SIZE = int(os.getenv("WEBHOOK_DEDUPE_SIZE", 4096))  # 記住最近多少個 update_id 以略過重送
+COLD_START_TTFB_TARGET = float(os.getenv("COLD_START_TTFB_TARGET", 2.0))  # 從程序啟動到第一個回應的目標秒數
 REQUEST_TIMEOUT = 10
 
+# === 並行擷取設定 ===
+FETCH_DEADLINE = float(os.getenv("FETCH_DEADLINE", 15))  # 整批擷取的總期限（秒）
+FETCH_MAX_WORKERS = int(os.getenv("FETCH_MAX_WORKERS", 16))
+SOURCE_TIMEOUTS = {  # 個別來源逾時（秒），未列出者使用 REQUEST_TIMEOUT
+    "magpie": 8,
+    "merkl": 8,
+}
+
+# === 斷路器與自適應逾時設定 ===
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 3))  # 連續失敗幾次後斷路
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", 60))  # 斷路後多久進行半開探測（秒）
+BREAKER_STALE_MAX_AGE = float(os.getenv("BREAKER_STALE_MAX_AGE", 6 * 3600))  # 最後成功資料可沿用的最長時間（秒）
+ADAPTIVE_TIMEOUT_MIN = float(os.getenv("ADAPTIVE_TIMEOUT_MIN", 2))  # 自適應逾時下限（秒），上限為來源設定的逾時
+ADAPTIVE_TIMEOUT_FACTOR = float(os.getenv("ADAPTIVE_TIMEOUT_FACTOR", 3))  # 逾時 = p99 延遲 × 此倍數
+ADAPTIVE_TIMEOUT_MIN_SAMPLES = 10
+ADAPTIVE_TIMEOUT_WINDOW = 100  # 每個來源保留的延遲樣本數
+
+# === HTTP 連線池設定 ===
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", 10))  # 每個主機最多保留的 keep-alive 連線
+HTTP_RETRY_TOTAL = int(os.getenv("HTTP_RETRY_TOTAL", 2))
+HTTP_RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", 0.3))
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+HTTP_HOST_POLICIES = {  # 個別主機的重試策略
+    "api.hyperliquid.xyz": {"retry_post": True},  # info 查詢為唯讀，POST 可安全重試
+    "api.github.com": {"retries": 1},
+    "api.telegram.org": {"retries": 1},
+}
+
+# === Event loop 設定 ===
+LOOP_IO_WORKERS = int(os.getenv("LOOP_IO_WORKERS", 8))  # app_loop 上阻塞工作的執行緒數
+LOOP_LAG_INTERVAL = 0.5  # loop 延遲取樣間隔（秒）
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", 0.25))  # 超過即記錄為停頓（秒）
+
+# === 多 worker 設定 ===
+WORKER_MODE = os.getenv("WORKER_MODE", "single")  # single：單一程序；multi：gunicorn 多 worker（見 gunicorn.conf.py）
+LEADER_LOCK_FILE = os.getenv("LEADER_LOCK_FILE", "leader.lock")
+LEADER_POLL_INTERVAL = float(os.getenv("LEADER_POLL_INTERVAL", 2))  # follower 嘗試接手 leader 的間隔（秒）
+SHARED_SNAPSHOT_FILE = os.getenv("SHARED_SNAPSHOT_FILE", "snapshot.shared")  # 亦作為重啟後的暖啟動快照
+SHARED_SNAPSHOT_POLL = 1.0  # follower 檢查共享快照是否更新的最短間隔（秒）
+WEBHOOK_SPOOL_DIR = os.getenv("WEBHOOK_SPOOL_DIR", "webhook-spool")  # follower 收到的 webhook 更新暫存目錄
+WEBHOOK_SPOOL_POLL = 0.5
+
+# === 共享快照設定 ===
+SNAPSHOT_TTL = int(os.getenv("SNAPSHOT_TTL", 60))  # 快照新鮮期（秒），超過後先回傳舊快照再背景更新
+SNAPSHOT_REFRESH_INTERVAL = int(os.getenv("SNAPSHOT_REFRESH_INTERVAL", 60))  # 背景刷新週期（秒）
+
+# === 推播速率設定 ===
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 20))  # 同時進行的發送數
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 25))  # 全域每秒訊息數（Telegram 上限約 30/s）
+BROADCAST_BURST = int(os.getenv("BROADCAST_BURST", 25))
+BROADCAST_MAX_ATTEMPTS = int(os.getenv("BROADCAST_MAX_ATTEMPTS", 3))
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", 500))  # 推播時每次從資料庫讀取的訂閱者數
+PERMANENT_SEND_ERRORS = (  # 視為永久失效、需取消訂閱的 BadRequest 訊息
+    "chat not found",
+    "user is deactivated",
+    "bot was kicked",
+    "bot was blocked",
+    "peer_id_invalid",
+)
+
+# === 歷史資料設定 ===
+HISTORY_SAMPLE_INTERVAL = int(os.getenv("HISTORY_SAMPLE_INTERVAL", 300))  # 每個指標的取樣間隔（秒）
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", 90))
+HISTORY_CAPACITY = HISTORY_RETENTION_DAYS * 86400 // HISTORY_SAMPLE_INTERVAL  # 每個指標的環狀緩衝長度
+HISTORY_MAX_BUCKETS = 2000
+HISTORY_DIR = os.getenv("HISTORY_DIR", "history")  # 磁碟歷史資料目錄，設為空字串可停用
+HISTORY_COMPACT_INTERVAL = int(os.getenv("HISTORY_COMPACT_INTERVAL", 6 * 3600))  # 壓縮週期（秒）
+
+# === 滾動統計設定（每次歷史取樣更新一次） ===
+ANALYTICS_WINDOW = int(os.getenv("ANALYTICS_WINDOW", 288))  # 滾動平均 / 標準差的樣本數（預設 288 × 5 分鐘 = 24 小時）
+ANALYTICS_EMA_SPAN = int(os.getenv("ANALYTICS_EMA_SPAN", 12))  # EMA 跨度（樣本數），alpha = 2 / (span + 1)
+ANALYTICS_MIN_SAMPLES = int(os.getenv("ANALYTICS_MIN_SAMPLES", 12))  # 樣本數不足時不顯示 z-score 與百分位
+SPREAD_HISTOGRAM_BINS = int(os.getenv("SPREAD_HISTOGRAM_BINS", 200))
+SPREAD_HISTOGRAM_RANGE = float(os.getenv("SPREAD_HISTOGRAM_RANGE", 20))  # 價差直方圖範圍（± 百分點），超出者計入兩端
+
 # === GitHub Gist 設定 ===
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
 GIST_ID = os.getenv("GIST_ID")
+GIST_FILENAME = "subscribers.gz.b64"  # 訂閱者清單（緊湊 JSON → gzip → base64）
+LEGACY_GIST_FILENAME = "subscribers.json"  # 舊版格式，僅供還原
+GIST_CACHE_FILE = os.getenv("GIST_CACHE_FILE", "gist_cache.json")  # 最近一次同步的 Gist 內容與 ETag
+GIST_MIN_INTERVAL = float(os.getenv("GIST_MIN_INTERVAL", 300))  # 兩次上傳之間的最短間隔（秒）
 
 # === Hyperliquid 設定 ===
-HYPERLIQUID_API_URL = "https://api.hyperliquid.xyz/info"
+HYPERLIQUID_API_URL = os.getenv("HYPERLIQUID_API_URL", "https://api.hyperliquid.xyz/info")
 HYPERLIQUID_ASSETS = ["BTC", "ETH", "HYPE", "BNB", "SOL", "AAVE", "SUI", "ENA", "DOGE", "PENDLE"]
+FUNDING_SCREENER_SIZE = int(os.getenv("FUNDING_SCREENER_SIZE", 10))  # 資金費率排行榜前後各幾名
 
 # === PENDLE API URLs ===
-MAGPIE_API_URL = "https://dev.api.magpiexyz.io/poolsnapshot/get?chainId=42161&domain=www.pendle.magpiexyz.io"
+MAGPIE_API_URL = os.getenv("MAGPIE_API_URL", "https://dev.api.magpiexyz.io/poolsnapshot/get?chainId=42161&domain=www.pendle.magpiexyz.io")
 TARGET_POOL_ID = 6
 
-PENDLE_URLS = {
-    "mPendle": "https://api-v2.pendle.finance/core/v2/42161/markets/0x4e77520688601ceb5d4bbd217763640a689956cd/data",
-    "fGHO": "https://api-v2.pendle.finance/core/v2/1/markets/0xc64d59eb11c869012c686349d24e1d7c91c86ee2/data",
-    "USDS-SPK": "https://api-v2.pendle.finance/core/v2/1/markets/0xff43e751f2f07bbf84da1fc1fa12ce116bf447e5/data",
-    "X33": "https://api-v2.pendle.finance/core/v2/146/markets/0x6d3ecf7a9fc726387bb6a91fffb4f90d1f38139c/data",
-    "ClisBNB": "https://api-v2.pendle.finance/core/v2/56/markets/0xbd577ddabb5a1672d3c786726b87a175de652b96/data",
-    "fxSAVE": "https://api-v2.pendle.finance/core/v2/1/markets/0x9bc2fb257e00468fe921635fe5a73271f385d0eb/data",
-    "RLP": "https://api-v2.pendle.finance/core/v2/1/markets/0x55f06992e4c3ed17df830da37644885c0c34edda/data"
-}
+PENDLE_API_URL = os.getenv("PENDLE_API_URL", "https://api-v2.pendle.finance")
+# 追蹤的 Pendle 市場清單（可用 /addmarket、/removemarket 修改）；相對路徑以程式所在目錄為準，不受工作目錄影響
+MARKETS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.getenv("MARKETS_FILE", "markets.json"))
+PENDLE_PAGE_SIZE = 100  # 每鏈批次查詢的分頁大小
+PENDLE_MAX_PAGES = int(os.getenv("PENDLE_MAX_PAGES", 10))  # 每鏈最多查詢的頁數
+PENDLE_FALLBACK_CONCURRENCY = int(os.getenv("PENDLE_FALLBACK_CONCURRENCY", 4))  # 批次查詢缺漏時逐一查詢的並行數
+ADMIN_CHAT_IDS = {int(chat_id) for chat_id in os.getenv("ADMIN_CHAT_IDS", "").split(",") if chat_id.strip()}
 
-MERKL_API_URL = "https://api.merkl.xyz/v4/opportunities?sort=apr&items=10&page=0&tags=puffer&excludeSubCampaigns=true&order=desc"
+MERKL_API_URL = os.getenv("MERKL_API_URL", "https://api.merkl.xyz/v4/opportunities?sort=apr&items=10&page=0&tags=puffer&excludeSubCampaigns=true&order=desc")
 MERKL_IDENTIFIERS = {
     "0xf00032d0F95e8f43E750C51d0188DCa33cC5a8eA": "CARROT-USDC LP",
     "0xb1dd1A6f9A9f09867C7A128d99E4C1f9510d8466": "PufETH YT ",
@@ -66,25 +222,339 @@ app_loop = None
 subscribers = set()
 auto_push_enabled = True
 push_interval = 300  # 5 分鐘
+PUSH_MODE = os.getenv("PUSH_MODE", "delta")  # delta：只推播超過門檻的變化；full：每次推播完整訊息
+PUSH_ABS_THRESHOLD = float(os.getenv("PUSH_ABS_THRESHOLD", 2.0))  # 絕對變化門檻（百分點）
+PUSH_REL_THRESHOLD = float(os.getenv("PUSH_REL_THRESHOLD", 0.25))  # 相對變化門檻（比例）
+PREFERENCES_FILE = "preferences.json"  # 舊版觀察清單與警示規則檔案，僅供匯入
+MAX_WATCHLIST_SIZE = 20
+MAX_ALERTS_PER_CHAT = 20
+DATA_LOADING_MESSAGE = "Data is loading, please try again shortly"  # 第一個快照建立前的指令回覆
 
 # === 简化的任务状态跟踪 ===
 last_push_time = 0
 push_task_active = False
+bot_ready = threading.Event()  # Telegram Application 初始化完成
+bot_startup_done = threading.Event()  # Telegram 初始化已結束（成功或失敗），失敗時 webhook 不再等待
+
+# === 監控指標（Prometheus 文字格式） ===
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ""
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+class Counter:
+    """只增不減的計數器"""
+    type_name = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self, extra=None):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key, extra)} {value}" for key, value in items]
+
+class Gauge(Counter):
+    """可設定任意值的量測值"""
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram:
+    """固定 bucket 的直方圖（bucket 計數在輸出時才累加）"""
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self, extra=None):
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        lines = []
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, dict(extra or {}, le=le))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key, extra)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key, extra)} {count}")
+        return lines
+
+class CallbackGauge:
+    """輸出時才呼叫函數取值的量測值（熱路徑零成本）"""
+
+    def __init__(self, name, help_text, fn, labelnames=(), type_name="gauge"):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+        self.type_name = type_name
+
+    def collect(self, extra=None):
+        value = self.fn()
+        if isinstance(value, dict):
+            return [f"{self.name}{_format_labels(self.labelnames, key, extra)} {v}" for key, v in value.items()]
+        return [f"{self.name}{_format_labels((), (), extra)} {value}"]
+
+class MetricsRegistry:
+    """所有監控指標；多 worker 模式下每個 worker 各自計數，輸出時加上 worker（pid）標籤區分"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self.register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def callback(self, name, help_text, fn, labelnames=(), type_name="gauge"):
+        return self.register(CallbackGauge(name, help_text, fn, labelnames, type_name))
+
+    def render(self):
+        lines = []
+        extra = {"worker": str(os.getpid())} if WORKER_MODE == "multi" else None
+        for metric in self._metrics:
+            try:
+                samples = metric.collect(extra)
+            except Exception as e:
+                logger.error(f"Metric {metric.name} collection failed: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+metrics_registry = MetricsRegistry()
+UPSTREAM_LATENCY = metrics_registry.histogram(
+    "defi_upstream_request_duration_seconds", "Upstream request latency", ["source"])
+UPSTREAM_ERRORS = metrics_registry.counter(
+    "defi_upstream_errors_total", "Failed upstream requests", ["source"])
+UPSTREAM_DEADLINE_MISSES = metrics_registry.counter(
+    "defi_upstream_deadline_misses_total", "Upstream fetches abandoned at the fetch deadline", ["source"])
+ROUTE_LATENCY = metrics_registry.histogram(
+    "defi_http_request_duration_seconds", "Flask route render time", ["route"])
+ROUTE_RESPONSES = metrics_registry.counter(
+    "defi_http_responses_total", "Flask responses by route and status", ["route", "status"])
+BROADCAST_DURATION = metrics_registry.histogram(
+    "defi_broadcast_duration_seconds", "Telegram broadcast duration",
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0))
+BROADCAST_MESSAGES = metrics_registry.counter(
+    "defi_broadcast_messages_total", "Broadcast deliveries by result", ["result"])
+BROADCAST_RATE_GAUGE = metrics_registry.gauge(
+    "defi_broadcast_send_rate", "Messages per second achieved by the last broadcast")
+LOOP_LAG = metrics_registry.histogram(
+    "defi_event_loop_lag_seconds", "Event loop scheduling delay",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+SUBSCRIBER_FLUSH_DURATION = metrics_registry.histogram(
+    "defi_subscriber_flush_duration_seconds", "Subscriber store flush time")
+WEBHOOK_UPDATES = metrics_registry.counter(
+    "defi_webhook_updates_total", "Webhook updates by ingestion result", ["result"])
+WEBHOOK_HANDLER_LATENCY = metrics_registry.histogram(
+    "defi_webhook_handler_duration_seconds", "Telegram update handler time")
+WEBHOOK_QUEUE_WAIT = metrics_registry.histogram(
+    "defi_webhook_queue_wait_seconds", "Time an accepted update waits in the ingestion queue")
+UPSTREAM_UNCHANGED = metrics_registry.counter(
+    "defi_upstream_unchanged_total", "Upstream responses identical to the previous fetch", ["source", "method"])
+
+class StartupTimer:
+    """冷啟動各階段距程序啟動（STARTED_AT）的秒數"""
+
+    def __init__(self, ttfb_target=COLD_START_TTFB_TARGET):
+        self.ttfb_target = ttfb_target
+        self.marks = {}
+        self._lock = threading.Lock()
+
+    def mark(self, phase):
+        """記錄階段第一次發生的時間，回傳秒數（已記錄過則回傳 None）"""
+        with self._lock:
+            if phase in self.marks:
+                return None
+            elapsed = self.marks[phase] = round(time.monotonic() - STARTED_AT, 3)
+        return elapsed
+
+    def stats(self):
+        with self._lock:
+            marks = dict(self.marks)
+        first_byte = marks.get("first_byte")
+        return dict(marks, ttfb_target=self.ttfb_target,
+                    ttfb_met=None if first_byte is None else first_byte <= self.ttfb_target)
+
+startup_timer = StartupTimer()
+metrics_registry.callback(
+    "defi_startup_seconds", "Seconds from process start to each cold-start phase",
+    lambda: {(phase,): value for phase, value in startup_timer.stats().items() if isinstance(value, float)},
+    ["phase"])
+
+def observe_upstream(source, started, ok):
+    """記錄一次上游請求的延遲與結果（started 為 time.perf_counter()）"""
+    UPSTREAM_LATENCY.observe(time.perf_counter() - started, source=source)
+    if not ok:
+        UPSTREAM_ERRORS.inc(source=source)
+
+# === 共享 HTTP 客戶端 ===
+class HttpClient:
+    """所有對外請求共用的客戶端：每個主機一個 keep-alive 連線池，並套用重試退避策略"""
+
+    def __init__(self, pool_maxsize=HTTP_POOL_MAXSIZE, retries=HTTP_RETRY_TOTAL,
+                 backoff=HTTP_RETRY_BACKOFF, host_policies=None):
+        self.pool_maxsize = pool_maxsize
+        self.retries = retries
+        self.backoff = backoff
+        self.host_policies = host_policies or {}
+        self.session = requests.Session()
+        self._adapters = {}
+        self._lock = threading.Lock()
+
+    def _build_adapter(self, host):
+        policy = self.host_policies.get(host, {})
+        allowed_methods = Retry.DEFAULT_ALLOWED_METHODS
+        if policy.get("retry_post"):
+            allowed_methods = allowed_methods | {"POST"}
+        retry = Retry(
+            total=policy.get("retries", self.retries),
+            backoff_factor=policy.get("backoff", self.backoff),
+            status_forcelist=HTTP_RETRY_STATUSES,
+            allowed_methods=allowed_methods,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        return HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=policy.get("pool_maxsize", self.pool_maxsize),
+            max_retries=retry,
+        )
+
+    def _ensure_adapter(self, url):
+        parts = urlsplit(url)
+        prefix = f"{parts.scheme}://{parts.netloc}"
+        if prefix in self._adapters:
+            return
+        with self._lock:
+            if prefix not in self._adapters:
+                adapter = self._build_adapter(parts.hostname)
+                self.session.mount(prefix, adapter)
+                self._adapters[prefix] = adapter
+
+    def request(self, method, url, source=None, **kwargs):
+        """送出請求；指定 source 時記錄該上游的延遲與錯誤"""
+        self._ensure_adapter(url)
+        if source is None:
+            return self.session.request(method, url, **kwargs)
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except Exception:
+            observe_upstream(source, started, False)
+            raise
+        observe_upstream(source, started, response.status_code < 400)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def stats(self):
+        """各主機的連線重用統計（requests / new_connections / reused）"""
+        result = {}
+        for prefix, adapter in list(self._adapters.items()):
+            requests_made = 0
+            new_connections = 0
+            for key in adapter.poolmanager.pools.keys():
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                requests_made += pool.num_requests
+                new_connections += pool.num_connections
+            result[urlsplit(prefix).netloc] = {
+                "requests": requests_made,
+                "new_connections": new_connections,
+                "reused": max(requests_made - new_connections, 0),
+            }
+        return result
+
+http_client = HttpClient(host_policies=HTTP_HOST_POLICIES)
 
 # === GitHub Gist 管理函數 ===
+def encode_subscribers(subscribers_list):
+    """訂閱者清單的緊湊編碼：排序後的 JSON 經 gzip 壓縮再轉為 base64"""
+    raw = json.dumps(sorted(subscribers_list), separators=(",", ":")).encode("utf-8")
+    return base64.b64encode(gzip.compress(raw, mtime=0)).decode("ascii")
+
+def decode_subscribers(content):
+    return json.loads(gzip.decompress(base64.b64decode(content)))
+
+def subscribers_hash(subscribers_list):
+    return hashlib.sha256(json.dumps(sorted(subscribers_list), separators=(",", ":")).encode("utf-8")).hexdigest()
+
+def parse_gist_subscribers(gist_data):
+    """從 Gist 回應取出訂閱者清單（新格式優先，其次為舊版 JSON）"""
+    files = gist_data.get("files", {})
+    if GIST_FILENAME in files:
+        return decode_subscribers(files[GIST_FILENAME]["content"])
+    return json.loads(files[LEGACY_GIST_FILENAME]["content"])
+
 def backup_subscribers_to_github_gist(subscribers_list):
-    """備份訂閱者到 GitHub Gist"""
+    """備份訂閱者到 GitHub Gist；成功時回傳 (新 Gist ID 或 True, ETag)，失敗回傳 (False, None)"""
     if not GITHUB_TOKEN:
         logger.info("ℹ️ GITHUB_TOKEN not set, skipping Gist backup")
-        return None
+        return None, None
         
     try:
         gist_data = {
             "description": "DeFi Bot Subscribers Backup",
             "public": False,
             "files": {
-                "subscribers.json": {
-                    "content": json.dumps(subscribers_list, indent=2)
+                GIST_FILENAME: {
+                    "content": encode_subscribers(subscribers_list)
                 }
             }
         }
@@ -92,65 +562,219 @@ def backup_subscribers_to_github_gist(subscribers_list):
         global GIST_ID
         if GIST_ID:
             # 更新現有 Gist
-            response = requests.patch(
-                f"https://api.github.com/gists/{GIST_ID}",
+            response = http_client.patch(
+                f"{GITHUB_API_URL}/gists/{GIST_ID}",
                 headers={"Authorization": f"token {GITHUB_TOKEN}"},
                 json=gist_data,
-                timeout=10
+                timeout=10,
+                source="gist"
             )
             if response.status_code == 200:
-                logger.info("✅ Subscribers backed up to existing GitHub Gist")
-                return True
+                logger.info(f"✅ {len(subscribers_list)} subscribers backed up to existing GitHub Gist")
+                return True, response.headers.get("ETag")
             else:
                 logger.error(f"❌ Failed to update Gist: {response.status_code}")
-                return False
+                return False, None
         else:
             # 創建新 Gist
-            response = requests.post(
-                "https://api.github.com/gists",
+            response = http_client.post(
+                f"{GITHUB_API_URL}/gists",
                 headers={"Authorization": f"token {GITHUB_TOKEN}"},
                 json=gist_data,
-                timeout=10
+                timeout=10,
+                source="gist"
             )
             if response.status_code == 201:
                 new_gist_id = response.json()["id"]
+                GIST_ID = new_gist_id  # 之後的備份更新同一個 Gist
                 logger.info("✅ New GitHub Gist created successfully")
                 logger.info(f"🔧 Please add this to Render environment variables:")
                 logger.info(f"   GIST_ID = {new_gist_id}")
-                return new_gist_id
+                return new_gist_id, response.headers.get("ETag")
             else:
                 logger.error(f"❌ Failed to create Gist: {response.status_code}")
-                return False
+                return False, None
                 
     except Exception as e:
         logger.error(f"❌ GitHub Gist backup error: {e}")
-        return False
+        return False, None
 
-def load_subscribers_from_github_gist():
-    """從 GitHub Gist 載入訂閱者"""
+def fetch_subscribers_from_github_gist(etag=None):
+    """條件式下載 Gist：回傳 (status, 訂閱者清單, ETag)，status 為 ok / not_modified / error"""
     if not GITHUB_TOKEN or not GIST_ID:
-        return set()
+        return "error", None, None
         
     try:
-        response = requests.get(
-            f"https://api.github.com/gists/{GIST_ID}",
-            headers={"Authorization": f"token {GITHUB_TOKEN}"},
-            timeout=10
+        headers = {"Authorization": f"token {GITHUB_TOKEN}"}
+        if etag:
+            headers["If-None-Match"] = etag
+        response = http_client.get(
+            f"{GITHUB_API_URL}/gists/{GIST_ID}",
+            headers=headers,
+            timeout=10,
+            source="gist"
         )
         
+        if response.status_code == 304:
+            return "not_modified", None, etag
         if response.status_code == 200:
-            gist_data = response.json()
-            content = gist_data["files"]["subscribers.json"]["content"]
-            subscribers_list = json.loads(content)
-            logger.info(f"✅ Loaded {len(subscribers_list)} subscribers from GitHub Gist")
-            return set(subscribers_list)
-        else:
-            logger.error(f"❌ Failed to load from GitHub Gist: {response.status_code}")
-            return set()
+            subscribers_list = parse_gist_subscribers(response.json())
+            return "ok", subscribers_list, response.headers.get("ETag")
+        logger.error(f"❌ Failed to load from GitHub Gist: {response.status_code}")
+        return "error", None, None
             
     except Exception as e:
         logger.error(f"❌ GitHub Gist load error: {e}")
+        return "error", None, None
+
+class GistSync:
+    """訂閱者的 Gist 同步
+
+    備份：合併變更、內容雜湊未變時不上傳、兩次上傳間隔至少 GIST_MIN_INTERVAL 秒。
+    還原：先使用本機快取（GIST_CACHE_FILE）讓啟動不必等待 GitHub，再以 If-None-Match 在背景確認。
+    """
+
+    def __init__(self, cache_path=GIST_CACHE_FILE, min_interval=GIST_MIN_INTERVAL):
+        self.cache_path = cache_path
+        self.min_interval = min_interval
+        self._pending = None
+        self._last_upload = 0.0
+        self._timer = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._revalidate_from = None
+        self.uploads = 0
+        self.unchanged = 0
+        self.not_modified = 0
+
+    def _read_cache(self):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.error(f"Failed to read Gist cache: {e}")
+            return {}
+
+    def _write_cache(self, subscribers_list, etag):
+        try:
+            tmp_path = f"{self.cache_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({
+                    "gist_id": GIST_ID,
+                    "etag": etag,
+                    "hash": subscribers_hash(subscribers_list),
+                    "subscribers": sorted(subscribers_list),
+                }, f, separators=(",", ":"))
+            os.replace(tmp_path, self.cache_path)
+        except Exception as e:
+            logger.error(f"Failed to write Gist cache: {e}")
+
+    # --- 備份 ---
+    def schedule(self, subs):
+        """排程備份目前的訂閱者清單；間隔內的多次變更合併為一次上傳"""
+        if not GITHUB_TOKEN:
+            return
+        with self._lock:
+            self._pending = sorted(subs)
+            self._start_timer()
+
+    def _start_timer(self):
+        """（持有 _lock 時呼叫）尚未排程時於下個間隔執行 flush"""
+        if self._timer is not None:
+            return
+        delay = max(self._last_upload + self.min_interval - time.monotonic(), 0)
+        self._timer = threading.Timer(delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self):
+        """立即上傳待備份的清單（內容未變則略過）"""
+        with self._flush_lock:
+            with self._lock:
+                pending = self._pending
+                self._pending = None
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if pending is None:
+                return
+            
+            cache = self._read_cache()
+            if cache.get("hash") == subscribers_hash(pending) and cache.get("gist_id") == GIST_ID:
+                self.unchanged += 1
+                return
+            
+            result, etag = backup_subscribers_to_github_gist(pending)
+            self._last_upload = time.monotonic()
+            if result:
+                self.uploads += 1
+                self._write_cache(pending, etag)
+            elif result is False:
+                # 失敗時於下個間隔重試；上傳期間已排入較新的清單則以較新的為準
+                with self._lock:
+                    if self._pending is None:
+                        self._pending = pending
+                    self._start_timer()
+
+    # --- 還原 ---
+    def restore(self):
+        """回傳 Gist 上的訂閱者清單；有本機快取時立即回傳快取，稍後由 revalidate() 在 app_loop 上確認"""
+        cache = self._read_cache()
+        if cache.get("subscribers") and cache.get("gist_id") == GIST_ID:
+            self._revalidate_from = cache
+            logger.info(f"✅ Loaded {len(cache['subscribers'])} subscribers from Gist cache")
+            return set(cache["subscribers"])
+        
+        status, subscribers_list, etag = fetch_subscribers_from_github_gist()
+        if status != "ok":
+            return set()
+        self._write_cache(subscribers_list, etag)
+        logger.info(f"✅ Loaded {len(subscribers_list)} subscribers from GitHub Gist")
+        return set(subscribers_list)
+
+    async def revalidate(self):
+        """以 If-None-Match 確認快取仍與 Gist 相同；有差異時套用增減的訂閱者
+
+        在 app_loop 上執行，訂閱者集合只在 loop 上修改，不會與指令處理同時變動。
+        """
+        cache = self._revalidate_from
+        self._revalidate_from = None
+        if cache is None:
+            return
+        
+        try:
+            status, subscribers_list, etag = await run_blocking(fetch_subscribers_from_github_gist, cache.get("etag"))
+            if status == "not_modified":
+                self.not_modified += 1
+                logger.info("Gist cache is up to date (304 Not Modified)")
+                return
+            if status != "ok":
+                return
+            cached, latest = set(cache["subscribers"]), set(subscribers_list)
+            added, removed = latest - cached, cached - latest
+            await run_blocking(self._write_cache, subscribers_list, etag)
+            for chat_id in added:
+                subscribers.add(chat_id)
+                subscriber_persistence.record("subscribe", chat_id)
+            for chat_id in removed:
+                subscribers.discard(chat_id)
+                subscriber_persistence.record("unsubscribe", chat_id)
+            logger.info(f"Gist changed since cache: +{len(added)} / -{len(removed)} subscribers")
+        except Exception as e:
+            logger.error(f"Gist revalidation failed: {e}")
+
+    def stats(self):
+        return {"uploads": self.uploads, "unchanged": self.unchanged, "not_modified": self.not_modified}
+
+gist_sync = GistSync()
+
+def load_subscribers_from_github_gist():
+    """從 GitHub Gist 載入訂閱者（優先使用本機快取）"""
+    if not GITHUB_TOKEN or not GIST_ID:
         return set()
+    return gist_sync.restore()
 
 def load_subscribers_from_env():
     """從環境變數載入"""
@@ -178,54 +802,354 @@ def load_subscribers_from_file():
         logger.error(f"❌ Failed to load from file: {e}")
         return set()
 
+# === SQLite 狀態儲存 ===
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscribers (
+    chat_id INTEGER PRIMARY KEY,
+    subscribed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS watchlists (
+    chat_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (chat_id, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    lhs TEXT NOT NULL,
+    op TEXT NOT NULL,
+    rhs TEXT NOT NULL,
+    triggered INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS alerts_chat_id ON alerts (chat_id);
+CREATE TABLE IF NOT EXISTS delivery (
+    chat_id INTEGER PRIMARY KEY,
+    last_status TEXT NOT NULL,
+    last_attempt_at REAL NOT NULL,
+    last_success_at REAL,
+    consecutive_failures INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+class StateStore:
+    """訂閱者、觀察清單、警示規則與每個 chat 的推播狀態（SQLite WAL，單一連線 + 鎖）"""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """第一次使用時才開啟資料庫（需持有 _lock）"""
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(STATE_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _read(self, sql, params=()):
+        with self._lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    def get_meta(self, key):
+        rows = self._read("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def set_meta(self, key, value):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    # --- 訂閱者 ---
+    def subscriber_count(self):
+        return self._read("SELECT COUNT(*) FROM subscribers")[0][0]
+
+    def is_subscribed(self, chat_id):
+        return bool(self._read("SELECT 1 FROM subscribers WHERE chat_id = ?", (chat_id,)))
+
+    def subscriber_page(self, after=None, limit=BROADCAST_PAGE_SIZE):
+        """依 chat_id 遞增分頁（keyset pagination），after 為上一頁最後一個 chat_id"""
+        if after is None:
+            rows = self._read("SELECT chat_id FROM subscribers ORDER BY chat_id LIMIT ?", (limit,))
+        else:
+            rows = self._read(
+                "SELECT chat_id FROM subscribers WHERE chat_id > ? ORDER BY chat_id LIMIT ?", (after, limit)
+            )
+        return [row[0] for row in rows]
+
+    def iter_subscribers(self, page_size=BROADCAST_PAGE_SIZE):
+        after = None
+        while True:
+            page = self.subscriber_page(after, page_size)
+            if not page:
+                return
+            yield from page
+            after = page[-1]
+
+    def import_subscribers(self, chat_ids):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO subscribers (chat_id, subscribed_at) VALUES (?, ?)",
+                    [(int(chat_id), now) for chat_id in chat_ids],
+                )
+
+    # --- 變更事件 ---
+    def apply(self, events, preferences, alert_states=()):
+        """在單一交易中套用訂閱事件、chat 的偏好設定與警示觸發狀態
+
+        events: [(action, chat_id)]（依發生順序）
+        preferences: chat_id -> (觀察清單名稱, [AlertRule])，整個取代該 chat 的設定
+        alert_states: [(rule_id, triggered)]（依發生順序，在偏好設定之後套用）
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                for action, chat_id in events:
+                    if action == "subscribe":
+                        conn.execute(
+                            "INSERT OR IGNORE INTO subscribers (chat_id, subscribed_at) VALUES (?, ?)", (chat_id, now)
+                        )
+                    elif action == "unsubscribe":
+                        conn.execute("DELETE FROM subscribers WHERE chat_id = ?", (chat_id,))
+                        conn.execute("DELETE FROM delivery WHERE chat_id = ?", (chat_id,))
+                for chat_id, (names, rules) in preferences.items():
+                    conn.execute("DELETE FROM watchlists WHERE chat_id = ?", (chat_id,))
+                    conn.executemany(
+                        "INSERT INTO watchlists (chat_id, name) VALUES (?, ?)", [(chat_id, name) for name in names]
+                    )
+                    conn.execute("DELETE FROM alerts WHERE chat_id = ?", (chat_id,))
+                    conn.executemany(
+                        "INSERT INTO alerts (id, chat_id, lhs, op, rhs, triggered) VALUES (?, ?, ?, ?, ?, ?)",
+                        [(rule.rule_id, chat_id, rule.left, rule.op, json.dumps(rule.right), int(rule.triggered))
+                         for rule in rules],
+                    )
+                conn.executemany(
+                    "UPDATE alerts SET triggered = ? WHERE id = ?",
+                    [(int(triggered), rule_id) for rule_id, triggered in alert_states],
+                )
+
+    # --- 偏好設定 ---
+    def load_watchlists(self):
+        watchlists = {}
+        for chat_id, name in self._read("SELECT chat_id, name FROM watchlists"):
+            watchlists.setdefault(chat_id, set()).add(name)
+        return watchlists
+
+    def load_alerts(self):
+        return [
+            {"id": rule_id, "chat_id": chat_id, "left": lhs, "op": op, "right": json.loads(rhs), "triggered": bool(triggered)}
+            for rule_id, chat_id, lhs, op, rhs, triggered in self._read(
+                "SELECT id, chat_id, lhs, op, rhs, triggered FROM alerts ORDER BY id"
+            )
+        ]
+
+    # --- 推播狀態 ---
+    def record_deliveries(self, outcomes):
+        """記錄每個 chat 最近一次推播結果：[(chat_id, status, error)]，status 為 sent / failed / evicted"""
+        now = time.time()
+        rows = [
+            (chat_id, status, now, now if status == "sent" else None, 0 if status == "sent" else 1, error)
+            for chat_id, status, error in outcomes
+        ]
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    """
+                    INSERT INTO delivery (chat_id, last_status, last_attempt_at, last_success_at, consecutive_failures, last_error)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (chat_id) DO UPDATE SET
+                        last_status = excluded.last_status,
+                        last_attempt_at = excluded.last_attempt_at,
+                        last_success_at = COALESCE(excluded.last_success_at, delivery.last_success_at),
+                        consecutive_failures = CASE WHEN excluded.last_status = 'sent' THEN 0
+                                                    ELSE delivery.consecutive_failures + 1 END,
+                        last_error = excluded.last_error
+                    """,
+                    rows,
+                )
+
+    def delivery_state(self, chat_id):
+        rows = self._read(
+            "SELECT last_status, last_attempt_at, last_success_at, consecutive_failures, last_error "
+            "FROM delivery WHERE chat_id = ?", (chat_id,)
+        )
+        if not rows:
+            return None
+        status, attempt_at, success_at, failures, error = rows[0]
+        return {"last_status": status, "last_attempt_at": attempt_at, "last_success_at": success_at,
+                "consecutive_failures": failures, "last_error": error}
+
+    def delivery_summary(self):
+        return dict(self._read("SELECT last_status, COUNT(*) FROM delivery GROUP BY last_status"))
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+state_store = StateStore(STATE_DB)
+
 def load_subscribers():
-    """改進版訂閱者載入（多重來源）"""
-    logger.info("🔍 Loading subscribers from multiple sources...")
-    
-    # 1. 嘗試從環境變數載入
-    env_subs = load_subscribers_from_env()
-    if env_subs:
-        logger.info("📋 Using subscribers from environment variables")
-        return env_subs
-    
-    # 2. 嘗試從 GitHub Gist 載入
-    gist_subs = load_subscribers_from_github_gist()
-    if gist_subs:
-        logger.info("📋 Using subscribers from GitHub Gist")
-        return gist_subs
-    
-    # 3. 最後從文件載入
-    file_subs = load_subscribers_from_file()
-    if file_subs:
-        logger.info("📋 Using subscribers from local file")
-        return file_subs
+    """從 SQLite 載入訂閱者；資料庫為空時依序從環境變數、GitHub Gist、舊版檔案匯入"""
+    count = state_store.subscriber_count()
+    if count:
+        logger.info(f"📋 Loaded {count} subscribers from {STATE_DB}")
+        return set(state_store.iter_subscribers())
+    
+    logger.info("🔍 State database is empty, importing subscribers from legacy sources...")
+    for source, loader in (
+        ("environment variables", load_subscribers_from_env),
+        ("GitHub Gist", load_subscribers_from_github_gist),
+        ("local file", load_subscribers_from_file),
+    ):
+        imported = loader()
+        if imported:
+            state_store.import_subscribers(imported)
+            logger.info(f"📋 Imported {len(imported)} subscribers from {source} into {STATE_DB}")
+            return set(imported)
     
     logger.info("📋 No existing subscribers found, starting fresh")
     return set()
 
-def save_subscribers(subs):
-    """改進版訂閱者保存（多重備份）"""
-    try:
-        subscribers_list = list(subs)
-        
-        # 1. 保存到文件
-        with open(SUB_FILE, "w", encoding="utf-8") as f:
-            json.dump(subscribers_list, f, ensure_ascii=False, indent=2)
-        
-        # 2. 記錄到日誌供手動設定環境變數
-        subscribers_json = json.dumps(subscribers_list)
-        logger.info(f"📋 Manual backup - SUBSCRIBERS_LIST = {subscribers_json}")
-        
-        # 3. 備份到 GitHub Gist（如果設定了）
-        gist_result = backup_subscribers_to_github_gist(subscribers_list)
-        if gist_result and isinstance(gist_result, str):
-            # 新建的 Gist，需要設定 GIST_ID
-            logger.info(f"🆕 New Gist created, please update environment variable:")
-            logger.info(f"   GIST_ID = {gist_result}")
-        
-        logger.info(f"✅ Saved {len(subs)} subscribers with multiple backups")
-    except Exception as e:
-        logger.error(f"❌ Failed to save subscribers: {e}")
+# === 訂閱者延遲寫入 ===
+class SubscriberPersistence:
+    """訂閱者變更的 write-behind 佇列：合併事件後在背景執行緒以單一交易寫入 SQLite 並備份到 Gist"""
+
+    def __init__(self, delay=SUBSCRIBER_FLUSH_DELAY, max_delay=SUBSCRIBER_FLUSH_MAX_DELAY):
+        self.delay = delay
+        self.max_delay = max_delay
+        self._events = []
+        self._first_event_at = None
+        self._last_event_at = None
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+        self.flush_count = 0
+        self.last_flush_duration = 0.0
+
+    def record(self, action, chat_id):
+        """記錄一筆訂閱/取消/偏好設定變更事件（不阻塞呼叫端，需在 app_loop 上呼叫）
+
+        偏好設定與訂閱者清單在此（與修改它們的 handler 同一執行緒）複製，
+        背景寫入時不再迭代仍會被修改的 watchlists / subscribers。
+        """
+        preferences = None
+        if action == "preferences":
+            # 規則物件的 triggered 會被刷新執行緒修改，複製當下的內容
+            rules = [replace(rule) for rule in alert_index.for_chat(chat_id)]
+            preferences = (sorted(watchlists.get(chat_id, ())), rules)
+        else:
+            gist_sync.schedule(subscribers)
+        with self._cond:
+            now = time.monotonic()
+            self._events.append((action, chat_id, preferences))
+            if self._first_event_at is None:
+                self._first_event_at = now
+            self._last_event_at = now
+            self._cond.notify()
+        self._ensure_thread()
+
+    def record_alert_states(self, states):
+        """記錄警示觸發狀態的變化 [(rule_id, triggered)]（刷新執行緒呼叫，不讀取 loop 上的狀態）"""
+        with self._cond:
+            now = time.monotonic()
+            self._events.append(("alert_state", None, tuple(states)))
+            if self._first_event_at is None:
+                self._first_event_at = now
+            self._last_event_at = now
+            self._cond.notify()
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._cond:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="subscriber-flush", daemon=True)
+                    self._thread.start()
+
+    def _due_in(self):
+        """距離下次寫入的秒數（需持有 _cond）"""
+        now = time.monotonic()
+        debounce_due = self._last_event_at + self.delay
+        max_due = self._first_event_at + self.max_delay
+        return min(debounce_due, max_due) - now
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._events and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                wait = self._due_in()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+            self.flush()
+
+    def flush(self):
+        """立即寫入所有待處理變更（關機時也會呼叫）"""
+        with self._flush_lock:
+            with self._cond:
+                events = self._events
+                if not events:
+                    return
+                self._events = []
+                self._first_event_at = None
+                self._last_event_at = None
+            
+            started = time.monotonic()
+            added = sum(1 for action, _, _ in events if action == "subscribe")
+            removed = sum(1 for action, _, _ in events if action == "unsubscribe")
+            # 依發生順序覆寫，同一 chat 以最後一次的設定為準
+            preferences = {chat_id: prefs for action, chat_id, prefs in events if action == "preferences"}
+            alert_states = [state for action, _, states in events if action == "alert_state" for state in states]
+            try:
+                state_store.apply(
+                    [(action, chat_id) for action, chat_id, _ in events if action != "alert_state"],
+                    preferences, alert_states,
+                )
+            except Exception as e:
+                # 寫入失敗時把事件放回佇列前端，於下個延遲後重試，不遺失整批變更
+                with self._cond:
+                    self._events = events + self._events
+                    now = time.monotonic()
+                    self._first_event_at = now
+                    self._last_event_at = now
+                logger.error(f"❌ Failed to write {len(events)} subscriber events to {STATE_DB}, will retry: {e}")
+                return
+            self.flush_count += 1
+            self.last_flush_duration = time.monotonic() - started
+            SUBSCRIBER_FLUSH_DURATION.observe(self.last_flush_duration)
+            logger.info(
+                f"Flushed {len(events)} subscriber events "
+                f"(+{added} / -{removed}) in {self.last_flush_duration:.2f}s"
+            )
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self.flush()
+        gist_sync.flush()
+
+subscriber_persistence = SubscriberPersistence()
+atexit.register(subscriber_persistence.stop)
 
 # === 儀表板 HTML ===
 DASHBOARD_HTML = """<!DOCTYPE html>
@@ -262,6 +1186,9 @@ DASHBOARD_HTML = """<!DOCTYPE html>
         .funding-header { display: flex; justify-content: space-between; align-items: center; margin-bottom: 10px; }
         .asset-name { font-size: 1.1rem; font-weight: 600; color: #212529; }
         .funding-rate { font-size: 1.2rem; font-weight: 700; color: #495057; }
+        .funding-stats, .stats-note { font-size: 0.8rem; color: #6c757d; font-weight: 400; }
+        .funding-stats { margin-top: 6px; }
+        .screener-grid { display: grid; grid-template-columns: repeat(auto-fit, minmax(320px, 1fr)); gap: 18px; }
         .footer { margin-top: 60px; text-align: center; color: #6c757d; padding: 20px; }
         .refresh-btn { position: fixed; bottom: 30px; right: 30px; background: #495057; color: white; border: none; width: 60px; height: 60px; border-radius: 50%; font-size: 1.5rem; cursor: pointer; box-shadow: 0 4px 16px rgba(0,0,0,0.15); transition: all 0.3s ease; z-index: 1000; }
         .refresh-btn:hover { background: #343a40; transform: scale(1.05); box-shadow: 0 6px 20px rgba(0,0,0,0.2); }
@@ -276,7 +1203,7 @@ DASHBOARD_HTML = """<!DOCTYPE html>
         </div>
         
         <div class="status-banner">
-            🚀 Running on Render | Bot: {{ 'Online' if bot_running else 'Offline' }} | Subscribers: {{ subscriber_count }} | Last updated: {{ last_update }} | Backup: {{ backup_status }}
+            🚀 Running on Render | Bot: {{ 'Online' if bot_running else 'Offline' }} | Subscribers: {{ subscriber_count }} | Last updated: {{ last_update }}{{ ' (stale)' if stale else '' }} | Backup: {{ backup_status }}{{ ' | Cached data: ' ~ stale_sources|join(', ') if stale_sources else '' }}
         </div>
         
         <div class="pools-grid">
@@ -301,6 +1228,18 @@ DASHBOARD_HTML = """<!DOCTYPE html>
                         <span class="yield-label">Underlying APY</span>
                         <span class="yield-value {{ pool.underlying_class }}">{{ pool.underlying_apy }}</span>
                     </div>
+                    {% if pool.spread %}
+                    <div class="yield-row" title="{{ pool.spread_title }}">
+                        <span class="yield-label">Spread</span>
+                        <span class="yield-value">{{ pool.spread }}{% if pool.spread_note %} <span class="stats-note">({{ pool.spread_note }})</span>{% endif %}</span>
+                    </div>
+                    {% endif %}
+                    {% if pool.implied_ema %}
+                    <div class="yield-row" title="{{ pool.implied_title }}">
+                        <span class="yield-label">Implied EMA</span>
+                        <span class="yield-value">{{ pool.implied_ema }}{% if pool.implied_note %} <span class="stats-note">({{ pool.implied_note }})</span>{% endif %}</span>
+                    </div>
+                    {% endif %}
                 </div>
             </div>
             {% endfor %}
@@ -330,9 +1269,34 @@ DASHBOARD_HTML = """<!DOCTYPE html>
                     <div class="asset-name">{{ funding.asset }}</div>
                     <div class="funding-rate">{{ funding.rate }}</div>
                 </div>
+                {% if funding.ema %}
+                <div class="funding-stats" title="{{ funding.title }}">EMA {{ funding.ema }}{% if funding.note %} · {{ funding.note }}{% endif %}</div>
+                {% endif %}
+            </div>
+            {% endfor %}
+        </div>
+        
+        {% if funding_screener %}
+        <div class="section-title">Funding Screener ({{ funding_screener.universe_size }} perps)</div>
+        
+        <div class="screener-grid">
+            {% for side, title in [('top', 'Highest Funding APR'), ('bottom', 'Lowest Funding APR')] %}
+            <div class="pool-card">
+                <div class="pool-header">
+                    <div class="pool-name">{{ title }}</div>
+                </div>
+                <div class="yield-info">
+                    {% for row in funding_screener[side] %}
+                    <div class="yield-row">
+                        <span class="yield-label">{{ row.asset }}</span>
+                        <span class="yield-value">{{ row.rate }}</span>
+                    </div>
+                    {% endfor %}
+                </div>
             </div>
             {% endfor %}
         </div>
+        {% endif %}
         
         <div class="footer">
             <p>&copy; 2025 DeFi Yield Dashboard | Powered by Render</p>
@@ -354,267 +1318,2023 @@ def get_app_url():
     service_name = os.getenv("RENDER_SERVICE_NAME", "defi-dashboard")
     return f"https://{service_name}.onrender.com"
 
+# === 上游回應指紋 ===
+class UpstreamFingerprints:
+    """上游回應指紋：有 ETag / Last-Modified 時發送條件式請求，否則比對回應內容雜湊
+
+    回應未變時回傳上一次解析出的同一個 payload 物件（不重新解析 JSON），
+    下游以物件身分（is）判斷來源未變並沿用衍生結果。
+    """
+
+    def __init__(self):
+        self._responses = {}  # 請求 -> (etag, last_modified, digest, payload)
+        self._payloads = {}  # 來源 -> 上一輪的 payload
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _count(self, source, field):
+        with self._lock:
+            stats = self._stats.setdefault(source, {
+                "requests": 0, "not_modified": 0, "hash_matches": 0, "fetches": 0, "unchanged": 0,
+            })
+            stats[field] += 1
+
+    def request_json(self, source, method, url, timeout, **kwargs):
+        """送出請求並回傳 JSON；與上次相同的回應直接沿用上次的 payload"""
+        key = (method, url, json.dumps(kwargs.get("params"), sort_keys=True), json.dumps(kwargs.get("json"), sort_keys=True))
+        with self._lock:
+            previous = self._responses.get(key)
+        headers = dict(kwargs.pop("headers", None) or {})
+        # 只有手上有上次的 payload 時才發送驗證器，304 才能沿用
+        if previous and previous[3] is not None:
+            if previous[0]:
+                headers["If-None-Match"] = previous[0]
+            if previous[1]:
+                headers["If-Modified-Since"] = previous[1]
+        
+        response = http_client.request(method, url, headers=headers, timeout=timeout, **kwargs)
+        self._count(source, "requests")
+        if response.status_code == 304:
+            if previous and previous[3] is not None:
+                self._count(source, "not_modified")
+                UPSTREAM_UNCHANGED.inc(source=source, method="not_modified")
+                return previous[3]
+            # 沒有可沿用的 payload（例如重啟後上游仍認得舊的驗證器）：不帶驗證器重新擷取
+            for name in ("If-None-Match", "If-Modified-Since"):
+                headers.pop(name, None)
+            response = http_client.request(method, url, headers=headers, timeout=timeout, **kwargs)
+            self._count(source, "requests")
+        response.raise_for_status()
+        if response.status_code == 304:
+            raise ValueError(f"{source} answered 304 to an unconditional request")
+        
+        digest = hashlib.blake2b(response.content, digest_size=16).digest()
+        if previous and previous[2] == digest:
+            self._count(source, "hash_matches")
+            UPSTREAM_UNCHANGED.inc(source=source, method="hash")
+            payload = previous[3]
+        else:
+            payload = response.json()
+        with self._lock:
+            self._responses[key] = (response.headers.get("ETag"), response.headers.get("Last-Modified"), digest, payload)
+        return payload
+
+    def settle(self, source, payload):
+        """記錄來源本輪的 payload，回傳 (payload, 是否與上一輪相同)
+
+        逐頁或逐市場組成的 payload（dict）只要每個值都是上一輪的同一物件即視為未變，並沿用上一輪的物件。
+        """
+        with self._lock:
+            previous = self._payloads.get(source)
+            unchanged = payload is not None and previous is not None and (
+                payload is previous or (
+                    isinstance(payload, dict) and isinstance(previous, dict)
+                    and payload.keys() == previous.keys()
+                    and all(payload[key] is previous[key] for key in payload)
+                )
+            )
+            if unchanged:
+                payload = previous
+            elif payload is not None:
+                self._payloads[source] = payload
+        self._count(source, "fetches")
+        if unchanged:
+            self._count(source, "unchanged")
+            UPSTREAM_UNCHANGED.inc(source=source, method="source")
+        return payload, unchanged
+
+    def stats(self):
+        with self._lock:
+            return {
+                source: dict(stats, unchanged_ratio=round(stats["unchanged"] / stats["fetches"], 3) if stats["fetches"] else 0.0)
+                for source, stats in self._stats.items()
+            }
+
+upstream_fingerprints = UpstreamFingerprints()
+
+class PayloadMemo:
+    """依上游 payload 物件身分快取衍生結果（解析、格式化），同 FundingUniverse 的作法"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name, inputs, build):
+        """inputs 中每個物件都與上次相同（is）時回傳上次的結果，否則重新計算"""
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry is not None and len(entry[0]) == len(inputs) and all(a is b for a, b in zip(entry[0], inputs)):
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        value = build()
+        with self._lock:
+            self._entries[name] = (inputs, value)
+        return value
+
+payload_memo = PayloadMemo()
+
 # === 其他函數保持不變 ===
-def fetch_api_data(url, description=""):
-    """通用 API 資料擷取函數"""
+def fetch_api_data(url, description="", timeout=REQUEST_TIMEOUT, source=None):
+    """通用 API 資料擷取函數（source 為指紋統計用的上游名稱，預設為 description）"""
     try:
-        response = requests.get(url, timeout=REQUEST_TIMEOUT)
-        response.raise_for_status()
-        return response.json()
+        return upstream_fingerprints.request_json((source or description).lower(), "GET", url, timeout)
     except Exception as e:
         logger.error(f"{description} API request failed: {e}")
         return None
 
-def get_funding_rates(asset_names):
-    """取得 Hyperliquid 資金費率"""
+def fetch_hyperliquid_contexts(timeout=REQUEST_TIMEOUT):
+    """擷取 Hyperliquid metaAndAssetCtxs 原始資料"""
     try:
         payload = {"type": "metaAndAssetCtxs"}
         headers = {"Content-Type": "application/json"}
-        resp = requests.post(HYPERLIQUID_API_URL, json=payload, headers=headers, timeout=REQUEST_TIMEOUT)
-        resp.raise_for_status()
-        meta, asset_contexts = resp.json()
-        
-        asset_map = {asset["name"].upper(): idx for idx, asset in enumerate(meta["universe"])}
+        return upstream_fingerprints.request_json(
+            "hyperliquid", "POST", HYPERLIQUID_API_URL, timeout, json=payload, headers=headers
+        )
+    except Exception as e:
+        logger.error(f"Hyperliquid API request failed: {e}")
+        return None
+
+# === Hyperliquid 全市場資金費率表 ===
+@dataclass(frozen=True)
+class FundingTable:
+    """單次 metaAndAssetCtxs 的全市場資料（numpy 陣列，索引與 names 對齊）"""
+    names: np.ndarray
+    index: dict
+    active: np.ndarray
+    funding: np.ndarray
+    premium: np.ndarray
+    open_interest: np.ndarray
+    mark_price: np.ndarray
+    funding_apr: np.ndarray
+
+    def rates_for(self, asset_names):
+        """指定資產的每小時資金費率"""
         rates = {}
-        
         for name in asset_names:
-            idx = asset_map.get(name.upper())
+            idx = self.index.get(name.upper())
             if idx is not None:
-                ctx = asset_contexts[idx]
-                rate = float(ctx.get("funding", 0))
-                rates[name] = rate
+                rates[name] = float(self.funding[idx])
             else:
                 logger.warning(f"Asset {name} not found in Hyperliquid")
-                
         return rates
+
+    def ranked(self, limit=None, descending=True):
+        """依資金費率 APR 排序的索引（排除已下架資產），limit 時只做部分排序"""
+        candidates = np.flatnonzero(self.active & ~np.isnan(self.funding_apr))
+        keys = self.funding_apr[candidates]
+        if descending:
+            keys = -keys
+        if limit is not None and limit < len(candidates):
+            part = np.argpartition(keys, limit)[:limit]
+            return candidates[part[np.argsort(keys[part], kind="stable")]]
+        return candidates[np.argsort(keys, kind="stable")]
+
+    def rows(self, indices):
+        """轉換為數值資料列"""
+        return [
+            {
+                "asset": str(self.names[i]),
+                "funding_apr": float(self.funding_apr[i]),
+                "premium": None if np.isnan(self.premium[i]) else float(self.premium[i]),
+                "open_interest_usd": None if np.isnan(self.open_interest[i]) else float(self.open_interest[i] * self.mark_price[i]),
+                "mark_price": None if np.isnan(self.mark_price[i]) else float(self.mark_price[i]),
+            }
+            for i in indices
+        ]
+
+    def screener(self, size=FUNDING_SCREENER_SIZE):
+        """資金費率最高與最低的資產"""
+        return {
+            "top": self.rows(self.ranked(size, descending=True)),
+            "bottom": self.rows(self.ranked(size, descending=False)),
+            "universe_size": int(self.active.sum()),
+        }
+
+def _column(asset_contexts, field):
+    """將某欄位字串值一次轉為 float64 陣列，缺值為 NaN"""
+    values = [ctx.get(field) for ctx in asset_contexts]
+    return np.array(["nan" if value is None else value for value in values], dtype=str).astype(np.float64)
+
+class FundingUniverse:
+    """快取 universe 索引（只在 meta 改變時重建），並將 asset contexts 轉為 FundingTable"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta_names = None
+        self._names = None
+        self._index = {}
+        self._last_contexts = None
+        self._last_table = None
+
+    def _ensure_index(self, universe):
+        names = tuple(asset["name"] for asset in universe)
+        if names == self._meta_names:
+            return
+        self._meta_names = names
+        self._names = np.array(names, dtype=object)
+        self._index = {name.upper(): idx for idx, name in enumerate(names)}
+        logger.info(f"Hyperliquid universe index rebuilt ({len(names)} assets)")
+
+    def table(self, contexts):
+        """解析 metaAndAssetCtxs；同一份回應只解析一次"""
+        with self._lock:
+            if contexts is self._last_contexts:
+                return self._last_table
+            
+            meta, asset_contexts = contexts
+            universe = meta["universe"]
+            self._ensure_index(universe)
+            funding = _column(asset_contexts, "funding")
+            table = FundingTable(
+                names=self._names,
+                index=self._index,
+                # 下架狀態可能在資產名稱不變時改變，每次解析都重建
+                active=np.array([not asset.get("isDelisted", False) for asset in universe], dtype=bool),
+                funding=funding,
+                premium=_column(asset_contexts, "premium"),
+                open_interest=_column(asset_contexts, "openInterest"),
+                mark_price=_column(asset_contexts, "markPx"),
+                funding_apr=calculate_apr(funding) * 100,
+            )
+            self._last_contexts = contexts
+            self._last_table = table
+            return table
+
+funding_universe = FundingUniverse()
+
+def parse_funding_rates(contexts, asset_names):
+    """從 metaAndAssetCtxs 解析指定資產的資金費率"""
+    try:
+        return funding_universe.table(contexts).rates_for(asset_names)
     except Exception as e:
         logger.error(f"Failed to get Hyperliquid funding rates: {e}")
         return {}
 
-def calculate_apr(hourly_rate):
-    """計算年化報酬率"""
-    return hourly_rate * 24 * 365
+# === Pendle 市場清單 ===
+@dataclass(frozen=True)
+class PendleMarket:
+    name: str
+    chain_id: int
+    address: str
+    type: str = "Pendle YT"
 
-# === 數據處理函數 ===
-def get_dashboard_data():
-    """獲取儀表板數據"""
-    try:
-        # 獲取 PENDLE 數據
-        pendle_data = []
-        
-        # 獲取 Magpie 數據
-        magpie_data = fetch_api_data(MAGPIE_API_URL, "Magpie")
-        staking_apy = None
-        if magpie_data and "data" in magpie_data:
-            pools = magpie_data["data"]["snapshot"]["pools"]
-            target_pool = next((p for p in pools if p.get("poolId") == TARGET_POOL_ID), None)
-            if target_pool and "aprInfo" in target_pool:
-                apr = target_pool["aprInfo"]["value"]
-                staking_apy = f"{apr*100:.2f}%"
+    def to_dict(self):
+        return {"name": self.name, "chain_id": self.chain_id, "address": self.address, "type": self.type}
 
-        # 處理每個 PENDLE 池
-        pool_types = {
-            "mPendle": "Pendle YT",
-            "fGHO": "Pendle YT", 
-            "USDS-SPK": "Pendle YT",
-            "X33": "Pendle YT",
-            "ClisBNB": "Pendle YT",
-            "fxSAVE": "Pendle YT",
-            "RLP": "Pendle YT"
-        }
-        
-        for name, url in PENDLE_URLS.items():
-            pool_info = {"name": name, "type": pool_types.get(name, "Pool")}
-            
-            if name == "mPendle" and staking_apy:
-                pool_info["staking_apy"] = staking_apy
-                
-            pendle_data_api = fetch_api_data(url, f"Pendle {name}")
-            if pendle_data_api:
-                implied_apy = pendle_data_api.get("impliedApy")
-                underlying_apy = pendle_data_api.get("underlyingApy")
-                
-                if implied_apy is not None:
-                    pool_info["implied_apy"] = f"{implied_apy*100:.2f}%"
-                else:
-                    pool_info["implied_apy"] = "N/A"
-                    
-                if underlying_apy is not None:
-                    pool_info["underlying_apy"] = f"{underlying_apy*100:.2f}%"
-                    # 比較 Underlying 和 Implied APY
-                    if implied_apy is not None:
-                        if underlying_apy > implied_apy:
-                            pool_info["underlying_class"] = "underlying-higher"
-                        else:
-                            pool_info["underlying_class"] = "underlying-lower"
-                    else:
-                        pool_info["underlying_class"] = ""
-                else:
-                    pool_info["underlying_apy"] = "N/A"
-                    pool_info["underlying_class"] = ""
-            else:
-                pool_info["implied_apy"] = "API Error"
-                pool_info["underlying_apy"] = "API Error"
-                pool_info["underlying_class"] = ""
-                
-            pendle_data.append(pool_info)
+# MARKETS_FILE 不存在時使用的內建市場
+DEFAULT_PENDLE_MARKETS = [
+    {"name": "mPendle", "chain_id": 42161, "address": "0x4e77520688601ceb5d4bbd217763640a689956cd", "type": "Pendle YT"},
+    {"name": "fGHO", "chain_id": 1, "address": "0xc64d59eb11c869012c686349d24e1d7c91c86ee2", "type": "Pendle YT"},
+    {"name": "USDS-SPK", "chain_id": 1, "address": "0xff43e751f2f07bbf84da1fc1fa12ce116bf447e5", "type": "Pendle YT"},
+    {"name": "X33", "chain_id": 146, "address": "0x6d3ecf7a9fc726387bb6a91fffb4f90d1f38139c", "type": "Pendle YT"},
+    {"name": "ClisBNB", "chain_id": 56, "address": "0xbd577ddabb5a1672d3c786726b87a175de652b96", "type": "Pendle YT"},
+    {"name": "fxSAVE", "chain_id": 1, "address": "0x9bc2fb257e00468fe921635fe5a73271f385d0eb", "type": "Pendle YT"},
+    {"name": "RLP", "chain_id": 1, "address": "0x55f06992e4c3ed17df830da37644885c0c34edda", "type": "Pendle YT"},
+]
 
-        # 獲取 Merkl 數據
-        merkl_data = []
-        merkl_api_data = fetch_api_data(MERKL_API_URL, "Merkl")
-        if merkl_api_data and isinstance(merkl_api_data, list):
-            merkl_result = {item["identifier"]: item["apr"] for item in merkl_api_data}
-            for identifier, display_name in MERKL_IDENTIFIERS.items():
-                apr = merkl_result.get(identifier)
-                merkl_data.append({
-                    "name": display_name,
-                    "apr": f"{apr:.2f}%" if apr is not None else "N/A"
-                })
-        else:
-            for display_name in MERKL_IDENTIFIERS.values():
-                merkl_data.append({
-                    "name": display_name,
-                    "apr": "API Error"
-                })
-
-        # 獲取 Hyperliquid 數據
-        hyperliquid_data = []
-        rates = get_funding_rates(HYPERLIQUID_ASSETS)
-        if rates:
-            for asset, rate in rates.items():
-                apr = calculate_apr(rate) * 100
-                hyperliquid_data.append({
-                    "asset": asset,
-                    "rate": f"{apr:.2f}%"
-                })
-        else:
-            for asset in HYPERLIQUID_ASSETS:
-                hyperliquid_data.append({
-                    "asset": asset,
-                    "rate": "API Error"
-                })
+class MarketRegistry:
+    """追蹤的 Pendle 市場（依名稱），保存於 MARKETS_FILE"""
 
-        # 備份狀態
-        backup_status = "GitHub" if GITHUB_TOKEN and GIST_ID else "Local"
+    def __init__(self, path):
+        self.path = path
+        self._markets = {}
+        self._lock = threading.Lock()
+        self.version = 0  # 每次市場清單變更時遞增，快照據此判斷能否沿用舊資料
 
-        return {
-            "pendle_data": pendle_data,
-            "merkl_data": merkl_data,
-            "hyperliquid_data": hyperliquid_data,
-            "last_update": datetime.datetime.now().strftime('%H:%M:%S'),
-            "bot_running": telegram_app is not None,
-            "subscriber_count": len(subscribers),
-            "backup_status": backup_status
-        }
-        
-    except Exception as e:
-        logger.error(f"Failed to get dashboard data: {e}")
-        return None
+    def load(self):
+        try:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    entries = json.load(f)
+                source = self.path
+            except FileNotFoundError:
+                entries = DEFAULT_PENDLE_MARKETS
+                source = "built-in defaults"
+                logger.warning(f"{self.path} not found, using built-in Pendle markets")
+            markets = {}
+            for entry in entries:
+                market = PendleMarket(entry["name"], int(entry["chain_id"]), entry["address"].lower(),
+                                      entry.get("type", "Pendle YT"))
+                markets[market.name] = market
+            with self._lock:
+                self._markets = markets
+                self.version += 1
+            logger.info(f"✅ Loaded {len(markets)} Pendle markets from {source}")
+        except Exception as e:
+            logger.error(f"❌ Failed to load Pendle markets: {e}")
 
-# === Telegram 相關函數 ===
-def get_combined_message():
-    """產生整合訊息（Telegram 用）"""
-    timestamp = (datetime.datetime.utcnow() + timedelta(hours=8)).strftime('%Y-%m-%d %H:%M:%S')
-    
-    lines = [
-        f"{timestamp} (UTC+8) | ",
+    def save(self):
+        try:
+            with self._lock:
+                entries = [market.to_dict() for market in self._markets.values()]
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"❌ Failed to save Pendle markets: {e}")
+
+    def markets(self):
+        with self._lock:
+            return list(self._markets.values())
+
+    def get(self, name):
+        with self._lock:
+            return self._markets.get(name)
+
+    def add(self, market):
+        with self._lock:
+            self._markets[market.name] = market
+            self.version += 1
+
+    def remove(self, name):
+        with self._lock:
+            market = self._markets.pop(name, None)
+            if market is not None:
+                self.version += 1
+            return market
+
+    def by_chain(self):
+        """chain_id -> 該鏈的市場清單"""
+        chains = {}
+        for market in self.markets():
+            chains.setdefault(market.chain_id, []).append(market)
+        return chains
+
+market_registry = MarketRegistry(MARKETS_FILE)
+market_registry.load()
+
+pendle_fallback_executor = ThreadPoolExecutor(max_workers=PENDLE_FALLBACK_CONCURRENCY, thread_name_prefix="pendle")
+
+def fetch_pendle_chain(chain_id, markets, timeout=REQUEST_TIMEOUT):
+    """以每鏈的市場列表端點分頁批次擷取，缺漏的市場再以單一市場端點並行補查
+
+    回傳 address -> 市場資料；全部失敗時回傳 None。
+    """
+    wanted = {market.address for market in markets}
+    found = {}
+    try:
+        for page in range(PENDLE_MAX_PAGES):
+            body = upstream_fingerprints.request_json(
+                f"pendle:{chain_id}", "GET", f"{PENDLE_API_URL}/core/v1/{chain_id}/markets", timeout,
+                params={"skip": page * PENDLE_PAGE_SIZE, "limit": PENDLE_PAGE_SIZE},
+            )
+            results = body.get("results") or []
+            for item in results:
+                address = str(item.get("address", "")).lower()
+                if address in wanted:
+                    found[address] = item
+            if len(found) == len(wanted) or len(results) < PENDLE_PAGE_SIZE:
+                break
+            if body.get("total") is not None and (page + 1) * PENDLE_PAGE_SIZE >= body["total"]:
+                break
+    except Exception as e:
+        logger.error(f"Pendle chain {chain_id} bulk request failed: {e}")
+    
+    missing = [market for market in markets if market.address not in found]
+    if missing:
+        futures = {
+            market.address: pendle_fallback_executor.submit(
+                fetch_api_data,
+                f"{PENDLE_API_URL}/core/v2/{chain_id}/markets/{market.address}/data",
+                f"Pendle {market.name}",
+                timeout,
+                f"pendle:{chain_id}",
+            )
+            for market in missing
+        }
+        for address, future in futures.items():
+            payload = future.result()
+            if payload:
+                found[address] = payload
+    
+    return found or None
+
+def pendle_market_data(upstream, market):
+    """從擷取結果中取出單一市場的資料"""
+    return (upstream.get(f"pendle:{market.chain_id}") or {}).get(market.address)
+
+# === 上游斷路器與自適應逾時 ===
+class CircuitBreaker:
+    """單一上游來源的斷路器：closed -> open（連續失敗）-> half_open（背景探測）-> closed"""
+
+    def __init__(self, source, timeout, failure_threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.source = source
+        self.max_timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.latencies = deque(maxlen=ADAPTIVE_TIMEOUT_WINDOW)
+        self.last_good = None
+        self.last_good_at = 0.0
+        self.short_circuits = 0
+        self._lock = threading.Lock()
+
+    def timeout(self):
+        """依最近成功請求的 p99 延遲決定逾時，介於 ADAPTIVE_TIMEOUT_MIN 與來源設定值之間"""
+        with self._lock:
+            samples = list(self.latencies)
+        if len(samples) < ADAPTIVE_TIMEOUT_MIN_SAMPLES:
+            return self.max_timeout
+        adaptive = percentile(samples, 99) * ADAPTIVE_TIMEOUT_FACTOR
+        return min(max(adaptive, ADAPTIVE_TIMEOUT_MIN), self.max_timeout)
+
+    def allow(self):
+        """closed 時放行；open 時拒絕，冷卻結束則轉為 half_open 並回傳 "probe"（由呼叫端在背景探測）"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = "half_open"
+                return "probe"
+            self.short_circuits += 1
+            return False
+
+    def record_success(self, latency, payload):
+        with self._lock:
+            if self.state != "closed":
+                logger.info(f"Circuit for {self.source} closed")
+            self.state = "closed"
+            self.failures = 0
+            self.latencies.append(latency)
+            self.last_good = payload
+            self.last_good_at = time.time()
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning(f"Circuit for {self.source} opened after {self.failures} failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def fallback(self):
+        """回傳仍在可沿用期限內的最後成功資料與其年齡（秒），否則 (None, None)"""
+        with self._lock:
+            if self.last_good is None:
+                return None, None
+            age = time.time() - self.last_good_at
+            if age > BREAKER_STALE_MAX_AGE:
+                return None, None
+            return self.last_good, age
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "short_circuits": self.short_circuits,
+                "timeout": None,
+                "last_good_age": round(time.time() - self.last_good_at, 1) if self.last_good_at else None,
+            }
+
+class UpstreamGuard:
+    """管理每個上游來源的斷路器"""
+
+    def __init__(self):
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, source):
+        with self._lock:
+            breaker = self._breakers.get(source)
+            if breaker is None:
+                timeout = SOURCE_TIMEOUTS.get(source, REQUEST_TIMEOUT)
+                breaker = self._breakers[source] = CircuitBreaker(source, timeout)
+            return breaker
+
+    def call(self, source, fetcher, probe=False):
+        """在斷路器保護下以自適應逾時執行擷取；斷路或失敗時回傳 None（probe 為已取得的半開探測許可）"""
+        breaker = self.breaker(source)
+        if not probe and not breaker.allow():
+            return None
+        started = time.perf_counter()
+        payload = None
+        try:
+            payload = fetcher(breaker.timeout())
+        finally:
+            observe_upstream(source, started, payload is not None)
+            if payload is not None:
+                breaker.record_success(time.perf_counter() - started, payload)
+            else:
+                breaker.record_failure()
+        return payload
+
+    def stats(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+        stats = {}
+        for source, breaker in breakers.items():
+            stats[source] = breaker.stats()
+            stats[source]["timeout"] = round(breaker.timeout(), 2)
+        return stats
+
+upstream_guard = UpstreamGuard()
+
+class UpstreamResults(dict):
+    """來源名稱 -> payload；stale 記錄以最後成功資料替代的來源及其年齡（秒），unchanged 為與上一輪相同的來源"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stale = {}
+        self.unchanged = set()
+
+    def same_as(self, other):
+        """來源、替代狀態與每個 payload 物件皆與 other 相同"""
+        return (
+            other is not None and self.keys() == other.keys() and self.stale.keys() == other.stale.keys()
+            and all(self[source] is other[source] for source in self)
+        )
+
+# === 並行擷取階段 ===
+fetch_executor = ThreadPoolExecutor(max_workers=FETCH_MAX_WORKERS, thread_name_prefix="fetch")
+
+def get_upstream_sources():
+    """列出所有上游來源（名稱 -> 擷取函數，參數為逾時秒數）"""
+    sources = {
+        "magpie": lambda timeout: fetch_api_data(MAGPIE_API_URL, "Magpie", timeout),
+    }
+    for chain_id, markets in market_registry.by_chain().items():
+        sources[f"pendle:{chain_id}"] = (
+            lambda timeout, chain_id=chain_id, markets=markets: fetch_pendle_chain(chain_id, markets, timeout)
+        )
+    sources["merkl"] = lambda timeout: fetch_api_data(MERKL_API_URL, "Merkl", timeout)
+    sources["hyperliquid"] = fetch_hyperliquid_contexts
+    return sources
+
+def probe_upstream(source, fetcher):
+    """半開探測：在背景執行一次擷取，成功即關閉斷路器"""
+    try:
+        payload = upstream_guard.call(source, fetcher, probe=True)
+        logger.info(f"Half-open probe for {source} {'succeeded' if payload is not None else 'failed'}")
+    except Exception as e:
+        logger.error(f"Half-open probe for {source} failed: {e}")
+
+def fetch_all_upstreams(deadline=FETCH_DEADLINE):
+    """同時擷取所有上游來源，超過總期限者視為失敗並回傳部分結果
+
+    斷路中或失敗的來源改用最後成功的資料（記錄於 results.stale）；
+    斷路冷卻結束的來源在背景探測，不拖慢本次擷取。
+    """
+    started = time.monotonic()
+    futures = {}
+    for source, fetcher in get_upstream_sources().items():
+        allowed = upstream_guard.breaker(source).allow()
+        if allowed == "probe":
+            fetch_executor.submit(probe_upstream, source, fetcher)
+        elif allowed:
+            futures[source] = fetch_executor.submit(upstream_guard.call, source, fetcher)
+    
+    done, not_done = wait_futures(futures.values(), timeout=deadline)
+    
+    results = UpstreamResults()
+    for source in get_upstream_sources():
+        future = futures.get(source)
+        payload = None
+        if future is None:
+            pass  # 斷路中
+        elif future in done:
+            try:
+                payload = future.result()
+            except Exception as e:
+                logger.error(f"{source} fetch failed: {e}")
+        else:
+            future.cancel()
+            UPSTREAM_DEADLINE_MISSES.inc(source=source)
+            logger.warning(f"{source} missed fetch deadline ({deadline:.0f}s)")
+        
+        if payload is None:
+            payload, age = upstream_guard.breaker(source).fallback()
+            if payload is not None:
+                results.stale[source] = age
+        payload, unchanged = upstream_fingerprints.settle(source, payload)
+        if unchanged:
+            results.unchanged.add(source)
+        results[source] = payload
+    
+    failed = sum(1 for payload in results.values() if payload is None)
+    logger.info(
+        f"Fetched {len(results)} upstreams in {time.monotonic() - started:.2f}s "
+        f"({failed} failed, {len(results.stale)} stale, {len(results.unchanged)} unchanged)"
+    )
+    return results
+
+# === 請求合併（single-flight） ===
+class SingleFlight:
+    """相同 key 的並行呼叫共用同一次執行與結果，Flask 執行緒與 asyncio loop 皆適用"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._stats = {}
+
+    def _join(self, key):
+        """回傳 (future, 是否為執行者)"""
+        with self._lock:
+            stats = self._stats.setdefault(key, {"calls": 0, "executions": 0})
+            stats["calls"] += 1
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, False
+            future = self._inflight[key] = Future()
+            stats["executions"] += 1
+            return future, True
+
+    def _execute(self, key, future, fn):
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def do(self, key, fn):
+        """同步呼叫：已有進行中的相同請求時等待其結果"""
+        future, leader = self._join(key)
+        if leader:
+            self._execute(key, future, fn)
+        return future.result()
+
+    async def do_async(self, key, fn):
+        """asyncio 呼叫：在執行緒池中執行 fn，不阻塞 event loop"""
+        future, leader = self._join(key)
+        if leader:
+            asyncio.get_running_loop().run_in_executor(loop_io_executor, self._execute, key, future, fn)
+        return await asyncio.wrap_future(future)
+
+    def stats(self):
+        """各 key 的呼叫數、實際執行數與合併比例"""
+        with self._lock:
+            return {
+                key: dict(
+                    stats,
+                    coalesced=stats["calls"] - stats["executions"],
+                    coalescing_ratio=round(1 - stats["executions"] / stats["calls"], 3) if stats["calls"] else 0.0,
+                )
+                for key, stats in self._stats.items()
+            }
+
+request_coalescer = SingleFlight()
+
+# === Event loop 阻塞邊界 ===
+# app_loop 上不得直接呼叫任何同步網路或磁碟 I/O，一律透過 run_blocking 交給專用執行緒池
+loop_io_executor = ThreadPoolExecutor(max_workers=LOOP_IO_WORKERS, thread_name_prefix="loop-io")
+
+async def run_blocking(fn, *args):
+    """在專用執行緒池執行阻塞函數並等待結果"""
+    return await asyncio.get_running_loop().run_in_executor(loop_io_executor, fn, *args)
+
+class LoopLagMonitor:
+    """定期量測 event loop 排程延遲，超過門檻時記錄停頓"""
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL, threshold=LOOP_LAG_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+
+    async def run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(time.monotonic() - started - self.interval, 0.0)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            LOOP_LAG.observe(lag)
+            if lag > self.threshold:
+                self.stalls += 1
+                logger.warning(f"Event loop stalled for {lag*1000:.0f}ms")
+
+    def stats(self):
+        return {
+            "last_lag_ms": round(self.last_lag * 1000, 1),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "stalls": self.stalls,
+            "threshold_ms": round(self.threshold * 1000),
+        }
+
+loop_lag_monitor = LoopLagMonitor()
+
+def fetch_all_upstreams_shared():
+    """合併並行呼叫的上游擷取"""
+    return request_coalescer.do("upstreams", fetch_all_upstreams)
+
+def parse_magpie_apr(magpie_data):
+    """從 Magpie 快照取得目標池的 APR（小數）"""
+    if magpie_data and "data" in magpie_data:
+        pools = magpie_data["data"]["snapshot"]["pools"]
+        target_pool = next((p for p in pools if p.get("poolId") == TARGET_POOL_ID), None)
+        if target_pool and "aprInfo" in target_pool:
+            return target_pool["aprInfo"]["value"]
+    return None
+
+def parse_magpie_staking_apy(magpie_data):
+    """從 Magpie 快照取得目標池的 Staking APY（%）"""
+    apr = parse_magpie_apr(magpie_data)
+    return apr * 100 if apr is not None else None
+
+def calculate_apr(hourly_rate):
+    """計算年化報酬率"""
+    return hourly_rate * 24 * 365
+
+def percentile(values, pct):
+    """計算百分位數（pct 為 0-100）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+# === 快照資料模型 ===
+# 數值一律為原始 float（單位：%），格式化由各輸出（HTML / Telegram / JSON）的渲染函數負責
+STATUS_OK = "ok"
+STATUS_ERROR = "error"  # 來源擷取失敗（顯示為 API Error）；STATUS_OK 而數值為 None 表示來源沒有此欄位（N/A）
+
+@dataclass(frozen=True, slots=True)
+class PoolYield:
+    """單一 Pendle 池"""
+    name: str
+    type: str
+    implied_apy: float | None = None
+    underlying_apy: float | None = None
+    staking_apy: float | None = None
+    status: str = STATUS_OK
+
+@dataclass(frozen=True, slots=True)
+class RateRow:
+    """Merkl APR 或資金費率 APR"""
+    name: str
+    value: float | None = None
+    status: str = STATUS_OK
+
+@dataclass(frozen=True, slots=True)
+class DashboardData:
+    """單次刷新的儀表板資料"""
+    pools: tuple
+    merkl: tuple
+    merkl_status: str
+    funding: tuple
+    funding_status: str
+    screener_top: tuple
+    screener_bottom: tuple
+    universe_size: int  # 0 表示沒有全市場資料
+    staking_apy: float | None
+    stale_sources: tuple
+    backup_status: str
+    updated_at: float
+
+def build_pool(market, pendle_data_api, staking_apy):
+    """單一 Pendle 池的資料"""
+    staking = staking_apy if market.name == "mPendle" else None
+    if not pendle_data_api:
+        return PoolYield(market.name, market.type, staking_apy=staking, status=STATUS_ERROR)
+    implied_apy = pendle_data_api.get("impliedApy")
+    underlying_apy = pendle_data_api.get("underlyingApy")
+    return PoolYield(
+        market.name, market.type,
+        implied_apy=implied_apy * 100 if implied_apy is not None else None,
+        underlying_apy=underlying_apy * 100 if underlying_apy is not None else None,
+        staking_apy=staking,
+    )
+
+def build_merkl_rows(merkl_api_data):
+    """Merkl APR 列表，來源失敗時回傳 None"""
+    if not merkl_api_data or not isinstance(merkl_api_data, list):
+        return None
+    merkl_result = {item["identifier"]: item["apr"] for item in merkl_api_data}
+    return tuple(
+        RateRow(display_name, float(merkl_result[identifier]) if merkl_result.get(identifier) is not None else None)
+        for identifier, display_name in MERKL_IDENTIFIERS.items()
+    )
+
+def build_funding_rows(contexts):
+    """追蹤資產的資金費率 APR，來源失敗時回傳 None"""
+    rates = parse_funding_rates(contexts, HYPERLIQUID_ASSETS) if contexts else {}
+    if not rates:
+        return None
+    return tuple(RateRow(asset, calculate_apr(rate) * 100) for asset, rate in rates.items())
+
+def build_funding_screener(contexts):
+    """全市場資金費率排行 (top, bottom, universe_size)，無資料時回傳 None"""
+    if not contexts:
+        return None
+    try:
+        screener = funding_universe.table(contexts).screener()
+        return (
+            tuple(RateRow(row["asset"], float(row["funding_apr"])) for row in screener["top"]),
+            tuple(RateRow(row["asset"], float(row["funding_apr"])) for row in screener["bottom"]),
+            screener["universe_size"],
+        )
+    except Exception as e:
+        logger.error(f"Failed to build funding screener: {e}")
+        return None
+
+# === 數據處理函數 ===
+def get_dashboard_data(upstream=None):
+    """獲取儀表板數據（DashboardData），來源未變的部分沿用上次的結果"""
+    try:
+        if upstream is None:
+            upstream = fetch_all_upstreams_shared()
+        
+        # 獲取 Magpie 數據
+        magpie_data = upstream.get("magpie")
+        staking_apy = payload_memo.get("magpie:staking_apy", (magpie_data,), lambda: parse_magpie_staking_apy(magpie_data))
+
+        # 處理每個 PENDLE 池
+        pools = []
+        for market in market_registry.markets():
+            pendle_data_api = pendle_market_data(upstream, market)
+            magpie = magpie_data if market.name == "mPendle" else None
+            pools.append(payload_memo.get(
+                f"dashboard:pendle:{market.name}", (market, pendle_data_api, magpie),
+                lambda market=market, pendle_data_api=pendle_data_api: build_pool(market, pendle_data_api, staking_apy),
+            ))
+
+        # 獲取 Merkl 數據
+        merkl_api_data = upstream.get("merkl")
+        merkl = payload_memo.get("dashboard:merkl", (merkl_api_data,), lambda: build_merkl_rows(merkl_api_data))
+
+        # 獲取 Hyperliquid 數據與全市場資金費率排行
+        contexts = upstream.get("hyperliquid")
+        funding = payload_memo.get("dashboard:hyperliquid", (contexts,), lambda: build_funding_rows(contexts))
+        screener = payload_memo.get("dashboard:screener", (contexts,), lambda: build_funding_screener(contexts))
+
+        return DashboardData(
+            pools=tuple(pools),
+            merkl=merkl or tuple(RateRow(name, status=STATUS_ERROR) for name in MERKL_IDENTIFIERS.values()),
+            merkl_status=STATUS_OK if merkl else STATUS_ERROR,
+            funding=funding or tuple(RateRow(asset, status=STATUS_ERROR) for asset in HYPERLIQUID_ASSETS),
+            funding_status=STATUS_OK if funding else STATUS_ERROR,
+            screener_top=screener[0] if screener else (),
+            screener_bottom=screener[1] if screener else (),
+            universe_size=screener[2] if screener else 0,
+            staking_apy=staking_apy,
+            stale_sources=tuple(sorted(getattr(upstream, "stale", {}))),
+            backup_status="GitHub" if GITHUB_TOKEN and GIST_ID else "Local",
+            updated_at=time.time(),
+        )
+        
+    except Exception as e:
+        logger.error(f"Failed to get dashboard data: {e}")
+        return None
+
+def metric_key(source, name, field):
+    """指標名稱，例如 pendle.fGHO.implied_apy"""
+    return f"{source}.{name.strip().replace(' ', '_')}.{field}"
+
+def extract_metrics(data):
+    """從儀表板資料取出數值指標（單位：%），失敗的來源不列入；資料列皆未變時回傳上次的同一個 dict"""
+    inputs = (data.staking_apy, *data.pools, *data.merkl, *data.funding)
+    return payload_memo.get("metrics", inputs, lambda: _extract_metrics(data))
+
+def _extract_metrics(data):
+    metrics = {}
+    
+    if data.staking_apy is not None:
+        metrics[metric_key("magpie", "mPendle", "staking_apy")] = data.staking_apy
+    
+    for pool in data.pools:
+        for field in ("implied_apy", "underlying_apy"):
+            value = getattr(pool, field)
+            if value is not None:
+                metrics[metric_key("pendle", pool.name, field)] = value
+        if pool.implied_apy is not None and pool.underlying_apy is not None:
+            metrics[metric_key("pendle", pool.name, "spread")] = pool.underlying_apy - pool.implied_apy
+    
+    for row in data.merkl:
+        if row.value is not None:
+            metrics[metric_key("merkl", row.name, "apr")] = row.value
+    
+    for row in data.funding:
+        if row.value is not None:
+            metrics[metric_key("hyperliquid", row.name, "funding_apr")] = row.value
+    
+    return metrics
+
+# === 渲染：HTML ===
+def format_percent(value, status=STATUS_OK):
+    """數值的顯示字串：12.34% / N/A / API Error"""
+    if status == STATUS_ERROR:
+        return "API Error"
+    return f"{value:.2f}%" if value is not None else "N/A"
+
+def format_stats_note(stats, percentile=False):
+    """滾動統計摘要，例如 "p82, z +1.2"；樣本不足時回傳空字串"""
+    if stats is None:
+        return ""
+    parts = []
+    if percentile and stats.percentile is not None:
+        parts.append(f"p{stats.percentile:.0f}")
+    if stats.zscore is not None:
+        parts.append(f"z {stats.zscore:+.1f}")
+    return ", ".join(parts)
+
+def format_stats_title(stats):
+    """滾動統計的完整說明（儀表板 tooltip）"""
+    if stats is None:
+        return ""
+    return f"EMA {stats.ema:.2f}% · mean {stats.mean:.2f}% · σ {stats.stdev:.2f}% · n={stats.count}"
+
+def html_view(data, analytics):
+    """儀表板模板使用的格式化資料"""
+    pendle_data = []
+    for pool in data.pools:
+        pool_info = {
+            "name": pool.name,
+            "type": pool.type,
+            "implied_apy": format_percent(pool.implied_apy, pool.status),
+            "underlying_apy": format_percent(pool.underlying_apy, pool.status),
+            "underlying_class": "",
+        }
+        if pool.staking_apy is not None:
+            pool_info["staking_apy"] = format_percent(pool.staking_apy)
+        # 比較 Underlying 和 Implied APY
+        if pool.implied_apy is not None and pool.underlying_apy is not None:
+            pool_info["underlying_class"] = (
+                "underlying-higher" if pool.underlying_apy > pool.implied_apy else "underlying-lower"
+            )
+            spread = analytics.get(metric_key("pendle", pool.name, "spread"))
+            pool_info["spread"] = f"{pool.underlying_apy - pool.implied_apy:+.2f}%"
+            pool_info["spread_note"] = format_stats_note(spread, percentile=True)
+            pool_info["spread_title"] = format_stats_title(spread)
+        implied = analytics.get(metric_key("pendle", pool.name, "implied_apy"))
+        if implied is not None and pool.implied_apy is not None:
+            pool_info["implied_ema"] = format_percent(implied.ema)
+            pool_info["implied_note"] = format_stats_note(implied)
+            pool_info["implied_title"] = format_stats_title(implied)
+        pendle_data.append(pool_info)
+    
+    funding_screener = None
+    if data.universe_size:
+        funding_screener = {
+            side: [{"asset": row.name, "rate": format_percent(row.value)} for row in rows]
+            for side, rows in (("top", data.screener_top), ("bottom", data.screener_bottom))
+        }
+        funding_screener["universe_size"] = data.universe_size
+    
+    return {
+        "pendle_data": pendle_data,
+        "merkl_data": [{"name": row.name, "apr": format_percent(row.value, row.status)} for row in data.merkl],
+        "hyperliquid_data": [funding_view(row, analytics) for row in data.funding],
+        "funding_screener": funding_screener,
+        "last_update": datetime.datetime.fromtimestamp(data.updated_at).strftime('%H:%M:%S'),
+        "backup_status": data.backup_status,
+        "stale_sources": list(data.stale_sources),
+    }
+
+def funding_view(row, analytics):
+    view = {"asset": row.name, "rate": format_percent(row.value, row.status)}
+    stats = analytics.get(metric_key("hyperliquid", row.name, "funding_apr"))
+    if stats is not None and row.value is not None:
+        view.update(ema=format_percent(stats.ema), note=format_stats_note(stats), title=format_stats_title(stats))
+    return view
+
+# === 渲染：JSON ===
+def render_yields_bytes(version, updated_at, data, analytics):
+    """/api/yields 的 JSON 內容（數值為 float，單位 %），每個快照版本只序列化一次
+
+    updated_at 為此版本建立的時間；上游未變但統計更新時（沿用 data）仍會前進。
+    """
+    body = {
+        "snapshot_version": version,
+        "snapshot_updated_at": datetime.datetime.fromtimestamp(updated_at).isoformat(timespec="seconds"),
+        "ttl": snapshot_cache.ttl,
+        "pendle_data": [
+            {
+                "name": pool.name, "type": pool.type, "status": pool.status,
+                "implied_apy": pool.implied_apy, "underlying_apy": pool.underlying_apy, "staking_apy": pool.staking_apy,
+            }
+            for pool in data.pools
+        ],
+        "merkl_data": [{"name": row.name, "apr": row.value, "status": row.status} for row in data.merkl],
+        "hyperliquid_data": [{"asset": row.name, "rate": row.value, "status": row.status} for row in data.funding],
+        "funding_screener": {
+            "universe_size": data.universe_size,
+            "top": [{"asset": row.name, "rate": row.value} for row in data.screener_top],
+            "bottom": [{"asset": row.name, "rate": row.value} for row in data.screener_bottom],
+        } if data.universe_size else None,
+        "stale_sources": list(data.stale_sources),
+        "analytics": {
+            key: {
+                "value": stats.value, "ema": stats.ema, "mean": stats.mean, "stdev": stats.stdev,
+                "zscore": stats.zscore, "percentile": stats.percentile, "count": stats.count,
+            }
+            for key, stats in analytics.items()
+        },
+    }
+    return json.dumps(body, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+# === 渲染：Telegram ===
+def get_combined_message(data, stale=None, analytics=None):
+    """產生整合訊息（Telegram 用）；stale 為以快取資料替代的來源及其年齡（秒），analytics 為滾動統計"""
+    analytics = {} if analytics is None else analytics
+    timestamp = (datetime.datetime.utcnow() + timedelta(hours=8)).strftime('%Y-%m-%d %H:%M:%S')
+    
+    lines = [
+        f"{timestamp} (UTC+8) | ",
         "_" * 33,
         ""
     ]
     
-    # PENDLE 收益率
-    pendle_msg = get_pendle_message()
+    # PENDLE 收益率（資料列未變時沿用上次的文字）
+    pendle_msg = payload_memo.get(
+        "message:pendle", (analytics, *data.pools, *data.merkl), lambda: get_pendle_message(data, analytics)
+    )
     lines.append(pendle_msg)
     
     lines.append("_" * 33)
     lines.append("")
     
     # Hyperliquid 資金費率
-    hyperliquid_msg = get_hyperliquid_message()
+    hyperliquid_msg = payload_memo.get(
+        "message:hyperliquid", (analytics, *data.funding), lambda: get_hyperliquid_message(data, analytics)
+    )
     lines.append(hyperliquid_msg)
     
     lines.append("_" * 33)
     
+    if stale:
+        lines.append("⚠️ Cached data: " + ", ".join(
+            f"{source} ({age / 60:.0f}m old)" for source, age in sorted(stale.items())
+        ))
+    
     return "\n".join(lines)
 
-def get_pendle_message():
+def get_pendle_message(data, analytics=None):
     """產生 PENDLE 收益率訊息（Telegram 用）"""
+    analytics = {} if analytics is None else analytics
     lines = []
 
-    # 獲取 Magpie 數據
-    magpie_data = fetch_api_data(MAGPIE_API_URL, "Magpie")
-    staking_apy = None
-    if magpie_data and "data" in magpie_data:
-        pools = magpie_data["data"]["snapshot"]["pools"]
-        target_pool = next((p for p in pools if p.get("poolId") == TARGET_POOL_ID), None)
-        if target_pool and "aprInfo" in target_pool:
-            apr = target_pool["aprInfo"]["value"]
-            staking_apy = f"{apr*100:.2f}%"
+    for pool in data.pools:
+        lines.append(f"{pool.name}:")
+        
+        # 如果是 mPendle，加入 Staking APY
+        if pool.staking_apy is not None:
+            lines.append(f"• Staking APY: {format_percent(pool.staking_apy)}")
+            
+        if pool.status == STATUS_OK:
+            lines.append(f"• Implied APY: {format_percent(pool.implied_apy)}")
+            lines.append(f"• Underlying APY: {format_percent(pool.underlying_apy)}")
+            if pool.implied_apy is not None and pool.underlying_apy is not None:
+                note = format_stats_note(analytics.get(metric_key("pendle", pool.name, "spread")), percentile=True)
+                spread = f"• Spread: {pool.underlying_apy - pool.implied_apy:+.2f}%"
+                lines.append(f"{spread} ({note})" if note else spread)
+        else:
+            lines.append(f"• API Error")
+        
+        lines.append("")
+
+    lines.append("$carrot APR:")
+    if data.merkl_status == STATUS_OK:
+        for row in data.merkl:
+            lines.append(f"• {row.name}: {format_percent(row.value)}")
+    else:
+        lines.append("• API Error")
+
+    return "\n".join(lines)
+
+def get_hyperliquid_message(data, analytics=None):
+    """產生 Hyperliquid 資金費率訊息（Telegram 用）"""
+    analytics = {} if analytics is None else analytics
+    lines = ["Hyperliquid funding rate APR:"]
+    
+    if data.funding_status != STATUS_OK:
+        lines.append("• API Error")
+        return "\n".join(lines)
+        
+    for row in data.funding:
+        line = f"• {row.name} = {format_percent(row.value)}"
+        stats = analytics.get(metric_key("hyperliquid", row.name, "funding_apr"))
+        if stats is not None and stats.zscore is not None:
+            line += f" (EMA {format_percent(stats.ema)}, z {stats.zscore:+.1f})"
+        lines.append(line)
+        
+    return "\n".join(lines)
+
+# === 歷史資料（記憶體環狀緩衝） ===
+class MetricRing:
+    """單一指標的固定長度環狀緩衝（timestamp + value，numpy 陣列）"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros(capacity, dtype=np.float64)
+        self._next = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, timestamp, value):
+        self.timestamps[self._next] = timestamp
+        self.values[self._next] = value
+        self._next = (self._next + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def last_timestamp(self):
+        if not self._size:
+            return None
+        return self.timestamps[(self._next - 1) % self.capacity]
+
+    def ordered(self):
+        """依時間排序的 (timestamps, values) 複本"""
+        if self._size < self.capacity:
+            return self.timestamps[:self._size].copy(), self.values[:self._size].copy()
+        order = np.r_[self._next:self.capacity, 0:self._next]
+        return self.timestamps[order], self.values[order]
+
+    def range(self, start, end):
+        timestamps, values = self.ordered()
+        lo = np.searchsorted(timestamps, start, side="left")
+        hi = np.searchsorted(timestamps, end, side="right")
+        return timestamps[lo:hi], values[lo:hi]
+
+def downsample(timestamps, values, start, end, buckets):
+    """將時間範圍切成等寬區間，回傳每個非空區間的 min / max / mean / count"""
+    if buckets <= 0 or len(timestamps) == 0 or end <= start:
+        return {
+            "t": timestamps.tolist(), "min": values.tolist(), "max": values.tolist(),
+            "mean": values.tolist(), "count": [1] * len(values),
+        }
+    
+    width = (end - start) / buckets
+    idx = np.minimum(((timestamps - start) / width).astype(np.int64), buckets - 1)
+    counts = np.bincount(idx, minlength=buckets)
+    sums = np.bincount(idx, weights=values, minlength=buckets)
+    mins = np.full(buckets, np.inf)
+    maxs = np.full(buckets, -np.inf)
+    np.minimum.at(mins, idx, values)
+    np.maximum.at(maxs, idx, values)
+    
+    filled = counts > 0
+    starts = start + np.arange(buckets) * width
+    return {
+        "t": starts[filled].round(3).tolist(),
+        "min": mins[filled].tolist(),
+        "max": maxs[filled].tolist(),
+        "mean": (sums[filled] / counts[filled]).tolist(),
+        "count": counts[filled].tolist(),
+    }
+
+class HistoryStore:
+    """各指標的歷史資料，每次刷新寫入，記憶體用量固定"""
+
+    def __init__(self, capacity=HISTORY_CAPACITY, sample_interval=HISTORY_SAMPLE_INTERVAL):
+        self.capacity = capacity
+        self.sample_interval = sample_interval
+        self._rings = {}
+        self._lock = threading.Lock()
+
+    def record(self, timestamp, metrics):
+        """寫入一次刷新的所有指標（距上次取樣不足間隔者略過），回傳實際寫入的指標"""
+        accepted = {}
+        with self._lock:
+            for key, value in metrics.items():
+                ring = self._rings.get(key)
+                if ring is None:
+                    ring = self._rings[key] = MetricRing(self.capacity)
+                last = ring.last_timestamp()
+                if last is not None and timestamp - last < self.sample_interval:
+                    continue
+                ring.append(timestamp, value)
+                accepted[key] = value
+        return accepted
+
+    def load(self, key, timestamps, values):
+        """以既有資料（依時間排序）預先填入指標"""
+        with self._lock:
+            ring = self._rings.get(key)
+            if ring is None:
+                ring = self._rings[key] = MetricRing(self.capacity)
+            for timestamp, value in zip(timestamps[-self.capacity:], values[-self.capacity:]):
+                ring.append(timestamp, value)
+
+    def first_timestamp(self, key):
+        with self._lock:
+            ring = self._rings.get(key)
+            if ring is None or not len(ring):
+                return None
+            return float(ring.ordered()[0][0])
+
+    def metrics(self):
+        """列出所有指標及其資料範圍"""
+        with self._lock:
+            result = {}
+            for key, ring in sorted(self._rings.items()):
+                timestamps, _ = ring.ordered()
+                result[key] = {
+                    "points": len(ring),
+                    "first": float(timestamps[0]) if len(ring) else None,
+                    "last": float(timestamps[-1]) if len(ring) else None,
+                }
+            return result
+
+    def query(self, key, start, end, buckets):
+        with self._lock:
+            ring = self._rings.get(key)
+            if ring is None:
+                return None
+            timestamps, values = ring.range(start, end)
+        return downsample(timestamps, values, start, end, buckets)
+
+    def memory_bytes(self):
+        return sum(ring.timestamps.nbytes + ring.values.nbytes for ring in self._rings.values())
+
+    def tail(self, key, count):
+        """指標最近 count 筆數值（依時間排序）"""
+        with self._lock:
+            ring = self._rings.get(key)
+            if ring is None:
+                return np.zeros(0)
+            return ring.ordered()[1][-count:]
+
+history_store = HistoryStore()
+
+# === 滾動統計 ===
+@dataclass(frozen=True, slots=True)
+class MetricStats:
+    """單一指標的滾動統計（單位同指標，%）；樣本不足 ANALYTICS_MIN_SAMPLES 時 zscore / percentile 為 None"""
+    value: float
+    ema: float
+    mean: float
+    stdev: float
+    zscore: float | None
+    percentile: float | None  # 只有價差指標（*.spread）有
+    count: int
+
+def is_spread_metric(key):
+    return key.endswith(".spread")
+
+class RollingAnalytics:
+    """所有指標的滾動統計，狀態存放於 numpy 陣列（每個指標一列）
+
+    每次取樣以向量運算更新所有指標，每個指標 O(1)：視窗環狀緩衝替換最舊的值並增減
+    累計和與平方和、更新 EMA；價差指標另維護固定分箱的直方圖，百分位只需一次分箱累加。
+    每滿一個視窗以視窗內容重算累計和，消除浮點誤差累積（攤還仍為 O(1)）。
+    """
+
+    def __init__(self, window=ANALYTICS_WINDOW, ema_span=ANALYTICS_EMA_SPAN, min_samples=ANALYTICS_MIN_SAMPLES,
+                 bins=SPREAD_HISTOGRAM_BINS, spread_range=SPREAD_HISTOGRAM_RANGE):
+        self.window = window
+        self.alpha = 2.0 / (ema_span + 1)
+        self.min_samples = min_samples
+        self.bins = bins
+        self.spread_range = spread_range
+        self._slots = {}
+        self._capacity = 0
+        self._ticks = 0
+        self._lock = threading.Lock()
+        self._stats = {}
+        # numpy 陣列於第一次 update()/seed() 建立指標列時才配置，匯入模組時不觸發 numpy 的延遲匯入
+        self._values = None
+        self._pos = None
+        self._count = None
+        self._sum = None
+        self._sumsq = None
+        self._ema = None
+        self._last = None
+        self._spread = None
+        self._hist = None
+
+    def _grow(self, capacity):
+        """擴充指標列數（倍增，攤還 O(1)）"""
+        def extend(array, shape, dtype):
+            grown = np.zeros(shape, dtype=dtype)
+            if array is not None:
+                grown[:self._capacity] = array
+            return grown
+        self._values = extend(self._values, (capacity, self.window), np.float64)
+        self._pos = extend(self._pos, capacity, np.int64)
+        self._count = extend(self._count, capacity, np.int64)
+        self._sum = extend(self._sum, capacity, np.float64)
+        self._sumsq = extend(self._sumsq, capacity, np.float64)
+        self._ema = extend(self._ema, capacity, np.float64)
+        self._last = extend(self._last, capacity, np.float64)
+        self._spread = extend(self._spread, capacity, bool)
+        self._hist = extend(self._hist, (capacity, self.bins), np.int64)
+        self._capacity = capacity
+
+    def _slot(self, key):
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = len(self._slots)
+            if slot >= self._capacity:
+                self._grow(max(self._capacity * 2, 16))
+            self._spread[slot] = is_spread_metric(key)
+        return slot
+
+    def _bin(self, values):
+        scaled = (values + self.spread_range) / (2 * self.spread_range) * self.bins
+        return np.clip(scaled.astype(np.int64), 0, self.bins - 1)
+
+    def update(self, metrics):
+        """加入一次取樣（指標 -> 數值），回傳所有指標的 MetricStats；沒有新樣本時回傳上次的同一個 dict"""
+        if not metrics:
+            return self._stats
+        with self._lock:
+            idx = np.fromiter((self._slot(key) for key in metrics), dtype=np.int64, count=len(metrics))
+            x = np.fromiter(metrics.values(), dtype=np.float64, count=len(metrics))
+            pos = self._pos[idx]
+            full = self._count[idx] >= self.window
+            old = np.where(full, self._values[idx, pos], 0.0)
+            
+            self._values[idx, pos] = x
+            self._pos[idx] = (pos + 1) % self.window
+            self._sum[idx] += x - old
+            self._sumsq[idx] += x * x - old * old
+            self._ema[idx] = np.where(self._count[idx] == 0, x, self._ema[idx] + self.alpha * (x - self._ema[idx]))
+            self._count[idx] = np.minimum(self._count[idx] + 1, self.window)
+            self._last[idx] = x
+            
+            spread = self._spread[idx]
+            if spread.any():
+                rows = idx[spread]
+                np.add.at(self._hist, (rows, self._bin(x[spread])), 1)
+                evicted = full[spread]
+                np.subtract.at(self._hist, (rows[evicted], self._bin(old[spread][evicted])), 1)
+            
+            self._ticks += 1
+            if self._ticks % self.window == 0:
+                self._resync()
+            self._stats = self._compute()
+            return self._stats
+
+    def _resync(self):
+        used = len(self._slots)
+        self._sum[:used] = self._values[:used].sum(axis=1)
+        self._sumsq[:used] = np.square(self._values[:used]).sum(axis=1)
+
+    def _compute(self):
+        used = len(self._slots)
+        if not used:
+            return {}
+        count = self._count[:used]
+        safe = np.maximum(count, 1)
+        mean = self._sum[:used] / safe
+        variance = self._sumsq[:used] / safe - mean * mean
+        variance[variance < 1e-10 * (mean * mean + 1)] = 0.0  # 由累計和相減產生的捨入誤差，視為常數
+        stdev = np.sqrt(variance)
+        last = self._last[:used]
+        ready = (count >= self.min_samples) & (stdev > 0)
+        zscore = np.where(ready, (last - mean) / np.where(stdev > 0, stdev, 1.0), np.nan)
+        
+        percentile = np.full(used, np.nan)
+        rows = np.flatnonzero(self._spread[:used] & (count >= self.min_samples))
+        if len(rows):
+            hist = self._hist[rows]
+            bins = self._bin(last[rows])
+            below = np.cumsum(hist, axis=1)[np.arange(len(rows)), bins] - hist[np.arange(len(rows)), bins]
+            percentile[rows] = (below + 0.5 * hist[np.arange(len(rows)), bins]) / count[rows] * 100
+        
+        return {
+            key: MetricStats(
+                value=float(last[slot]), ema=float(self._ema[slot]), mean=float(mean[slot]), stdev=float(stdev[slot]),
+                zscore=None if np.isnan(zscore[slot]) else float(zscore[slot]),
+                percentile=None if np.isnan(percentile[slot]) else float(percentile[slot]),
+                count=int(count[slot]),
+            )
+            for key, slot in self._slots.items() if count[slot]
+        }
+
+    def seed(self, store):
+        """以歷史資料預先填入各指標最近一個視窗的樣本（啟動時一次）"""
+        with self._lock:
+            for key in store.metrics():
+                values = store.tail(key, self.window)
+                if not len(values):
+                    continue
+                slot = self._slot(key)
+                n = len(values)
+                self._values[slot, :n] = values
+                self._pos[slot] = n % self.window
+                self._count[slot] = n
+                self._sum[slot] = values.sum()
+                self._sumsq[slot] = np.square(values).sum()
+                self._last[slot] = values[-1]
+                ema = values[0]
+                for value in values[1:]:
+                    ema += self.alpha * (value - ema)
+                self._ema[slot] = ema
+                if self._spread[slot]:
+                    self._hist[slot] = np.bincount(self._bin(values), minlength=self.bins)
+            self._stats = self._compute()
+            logger.info(f"Rolling analytics seeded for {len(self._slots)} metrics")
+
+    def stats(self):
+        return self._stats
+
+rolling_analytics = RollingAnalytics()
+
+# === 歷史資料（磁碟，memory-mapped） ===
+# 每個指標一個檔案：<HISTORY_DIR>/<metric>.col
+#
+#   偏移  長度  內容
+#   0     8     magic "DFHIST01"
+#   8     4     格式版本（uint32 little-endian，目前為 1）
+#   12    4     每筆紀錄長度（uint32，固定 16）
+#   16    8     檔案建立時間（float64，epoch 秒）
+#   24    8     保留
+#   32    16*N  紀錄：timestamp（float64）+ value（float64），little-endian，依時間遞增
+#
+# 只會在檔尾追加；查詢時以 mmap 二分搜尋 timestamp 欄，只讀取需要的頁面。
+# 結尾不完整的紀錄（寫入中斷）會在開啟時截掉；壓縮時以暫存檔 + os.replace 原子替換。
+HISTORY_MAGIC = b"DFHIST01"
+HISTORY_VERSION = 1
+HISTORY_HEADER = struct.Struct("<8sIIdd")
+HISTORY_RECORD_DTYPE = [("t", "<f8"), ("v", "<f8")]  # numpy 結構化 dtype
+HISTORY_RECORD_SIZE = 16
+
+class DiskHistory:
+    """只追加的固定寬度歷史檔，以 mmap 讀取，重啟後資料仍在"""
+
+    def __init__(self, directory=HISTORY_DIR, retention_days=HISTORY_RETENTION_DAYS,
+                 compact_interval=HISTORY_COMPACT_INTERVAL):
+        self.directory = directory
+        self.retention = retention_days * 86400
+        self.compact_interval = compact_interval
+        self._lock = threading.Lock()
+        self._last_compact = time.time()
+        self._checked = set()
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, re.sub(r"[^A-Za-z0-9._-]", "_", key) + ".col")
+
+    def _open_for_append(self, path):
+        f = open(path, "ab")
+        size = f.tell()
+        if size < HISTORY_HEADER.size:
+            f.truncate(0)
+            f.write(HISTORY_HEADER.pack(HISTORY_MAGIC, HISTORY_VERSION, HISTORY_RECORD_SIZE, time.time(), 0.0))
+        elif path not in self._checked:
+            # 截掉中斷寫入留下的殘缺紀錄
+            extra = (size - HISTORY_HEADER.size) % HISTORY_RECORD_SIZE
+            if extra:
+                f.truncate(size - extra)
+                logger.warning(f"Truncated {extra} trailing bytes in {path}")
+        self._checked.add(path)
+        return f
+
+    def append(self, timestamp, metrics):
+        """追加一次取樣的所有指標"""
+        if not self.enabled or not metrics:
+            return
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            for key, value in metrics.items():
+                try:
+                    with self._open_for_append(self._path(key)) as f:
+                        f.seek(0, os.SEEK_END)
+                        f.write(struct.pack("<dd", timestamp, value))
+                except OSError as e:
+                    logger.error(f"History append failed for {key}: {e}")
+        if time.time() - self._last_compact > self.compact_interval:
+            self.compact()
+
+    def _map(self, path):
+        """以 mmap 開啟紀錄區，回傳 (mmap, 紀錄陣列)；檔案不存在或為空時回傳 (None, None)"""
+        try:
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                count = (size - HISTORY_HEADER.size) // HISTORY_RECORD_SIZE
+                if count <= 0:
+                    return None, None
+                magic, version, record_size, _, _ = HISTORY_HEADER.unpack(f.read(HISTORY_HEADER.size))
+                if magic != HISTORY_MAGIC or record_size != HISTORY_RECORD_SIZE:
+                    logger.error(f"Unrecognized history file {path}")
+                    return None, None
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None, None
+        records = np.frombuffer(mm, dtype=HISTORY_RECORD_DTYPE, count=count, offset=HISTORY_HEADER.size)
+        return mm, records
+
+    def range(self, key, start, end):
+        """讀取時間範圍內的 (timestamps, values)；只會觸及二分搜尋與結果所在的頁面"""
+        mm, records = self._map(self._path(key))
+        if records is None:
+            return np.empty(0), np.empty(0)
+        lo = np.searchsorted(records["t"], start, side="left")
+        hi = np.searchsorted(records["t"], end, side="right")
+        selected = records[lo:hi].copy()
+        del records  # 釋放對 mmap 的參照後才能關閉
+        mm.close()
+        return selected["t"], selected["v"]
+
+    def keys(self):
+        if not self.enabled or not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-4] for name in os.listdir(self.directory) if name.endswith(".col"))
+
+    def warm(self, store):
+        """啟動時將保留期內的磁碟資料載入記憶體環狀緩衝"""
+        if not self.enabled:
+            return
+        start = time.time() - self.retention
+        loaded = 0
+        for key in self.keys():
+            timestamps, values = self.range(key, start, float("inf"))
+            if len(timestamps):
+                store.load(key, timestamps, values)
+                loaded += len(timestamps)
+        logger.info(f"Loaded {loaded} history points for {len(self.keys())} metrics from {self.directory}")
+
+    def compact(self):
+        """移除超過保留期的紀錄（暫存檔 + 原子替換）"""
+        cutoff = time.time() - self.retention
+        removed = 0
+        with self._lock:
+            self._last_compact = time.time()
+            for key in self.keys():
+                path = self._path(key)
+                mm, records = self._map(path)
+                if records is None:
+                    continue
+                keep_from = int(np.searchsorted(records["t"], cutoff, side="left"))
+                kept = records[keep_from:].tobytes() if keep_from else None
+                del records
+                mm.close()
+                if not kept and not keep_from:
+                    continue
+                
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(HISTORY_HEADER.pack(HISTORY_MAGIC, HISTORY_VERSION, HISTORY_RECORD_SIZE, time.time(), 0.0))
+                    f.write(kept)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, path)
+                self._checked.discard(path)
+                removed += keep_from
+        logger.info(f"History compaction removed {removed} expired records")
+
+disk_history = DiskHistory()
+
+def query_history(key, start, end, buckets):
+    """查詢指標歷史：記憶體涵蓋範圍內直接使用環狀緩衝，否則讀取磁碟檔"""
+    first = history_store.first_timestamp(key)
+    if disk_history.enabled and (first is None or start < first):
+        timestamps, values = disk_history.range(key, start, end)
+        if len(timestamps):
+            return downsample(timestamps, values, start, end, buckets)
+    return history_store.query(key, start, end, buckets)
+
+# === 共享資料快照 ===
+@dataclass(frozen=True, slots=True)
+class Snapshot:
+    """單次刷新的不可變資料快照（建立後不得修改內容）"""
+    version: int
+    created_at: float
+    data: DashboardData
+    message: str
+    metrics: dict
+    analytics: dict  # 指標 -> MetricStats
+    yields_json: bytes  # /api/yields 的預先序列化內容
+    funding_table: object = None
+
+    def age(self):
+        return time.time() - self.created_at
+
+class SnapshotCache:
+    """共享快照快取：背景定期刷新，過期時先回傳舊資料再背景重新驗證"""
+
+    def __init__(self, ttl=SNAPSHOT_TTL, refresh_interval=SNAPSHOT_REFRESH_INTERVAL):
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self._snapshot = None
+        self._version = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.follower = False  # 多 worker 模式下非 leader 的 worker 只讀取共享快照
+        self._restore_attempted = False
+        self._upstream = None  # 建立目前快照的上游結果；從磁碟還原的快照一律重建
+        self._markets_version = None  # 建立目前快照時的市場清單版本
+        self.unchanged_refreshes = 0
+        self._revalidating = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _build(self):
+        """擷取所有上游並建立新快照；失敗時保留舊快照，所有來源與市場清單都未變時沿用舊快照內容"""
+        markets_version = market_registry.version
+        upstream = fetch_all_upstreams()
+        previous = self._snapshot
+        if previous is not None and upstream.same_as(self._upstream) and markets_version == self._markets_version:
+            return self._reuse(previous, upstream)
+        
+        data = get_dashboard_data(upstream)
+        if data is None:
+            logger.error("Snapshot refresh failed, keeping previous snapshot")
+            return self._snapshot
+        
+        metrics = extract_metrics(data)
+        analytics = self._sample(data.updated_at, metrics)
+        self._version += 1
+        snapshot = Snapshot(
+            version=self._version,
+            created_at=data.updated_at,
+            data=data,
+            message=get_combined_message(data, upstream.stale, analytics),
+            metrics=metrics,
+            analytics=analytics,
+            yields_json=render_yields_bytes(self._version, data.updated_at, data, analytics),
+            funding_table=funding_universe.table(upstream["hyperliquid"]) if upstream.get("hyperliquid") else None,
+        )
+        self._snapshot = snapshot
+        self._upstream = upstream
+        self._markets_version = markets_version
+        shared_snapshot.write(snapshot, leader_status())
+        startup_timer.mark("first_live_snapshot")
+        dispatch_alerts(alert_index.evaluate(changed_metric_keys(previous, snapshot.metrics), snapshot.metrics))
+        logger.info(f"Snapshot v{snapshot.version} ready")
+        return snapshot
+
+    def _sample(self, timestamp, metrics):
+        """寫入歷史取樣並以實際取樣的指標更新滾動統計，回傳目前的統計"""
+        sampled = history_store.record(timestamp, metrics)
+        disk_history.append(timestamp, sampled)
+        return rolling_analytics.update(sampled)
+
+    def _reuse(self, previous, upstream):
+        """上游皆未變：沿用儀表板資料，不重新解析與做變化偵測
+
+        滾動統計沒有新樣本時連版本號也沿用（頁面不需重新渲染、ETag 不變），只更新時間與訊息時間戳。
+        """
+        now = time.time()
+        analytics = self._sample(now, previous.metrics)
+        if analytics is previous.analytics:
+            snapshot = replace(previous, created_at=now,
+                               message=get_combined_message(previous.data, upstream.stale, analytics))
+        else:
+            self._version += 1
+            snapshot = replace(
+                previous, version=self._version, created_at=now, analytics=analytics,
+                message=get_combined_message(previous.data, upstream.stale, analytics),
+                yields_json=render_yields_bytes(self._version, now, previous.data, analytics),
+            )
+        self._snapshot = snapshot
+        self.unchanged_refreshes += 1
+        shared_snapshot.write(snapshot, leader_status())
+        startup_timer.mark("first_live_snapshot")
+        logger.info(f"Upstreams unchanged, reusing snapshot data for v{snapshot.version}")
+        return snapshot
+
+    def refresh(self):
+        """刷新快照；並行呼叫共用同一次刷新"""
+        return request_coalescer.do("snapshot", self._build)
+
+    async def refresh_async(self):
+        """在 asyncio loop 中刷新快照（不阻塞 loop）"""
+        return await request_coalescer.do_async("snapshot", self._build)
+
+    def get(self):
+        """取得目前快照；尚無快照時同步建立，過期時觸發背景重新驗證"""
+        snapshot = self.peek() or self.restore()
+        if snapshot is None:
+            self.misses += 1
+            return None if self.follower else self.refresh()
+        return self._serve(snapshot)
+
+    async def get_async(self):
+        """asyncio 版本的 get()"""
+        snapshot = self.peek() or self.restore()
+        if snapshot is None:
+            self.misses += 1
+            return None if self.follower else await self.refresh_async()
+        return self._serve(snapshot)
+
+    def _serve(self, snapshot):
+        if snapshot.age() > self.ttl:
+            self.stale_hits += 1
+            if not self.follower:
+                self._revalidate()
+        else:
+            self.hits += 1
+        return snapshot
+
+    def peek(self):
+        """取得目前快照但不觸發任何刷新"""
+        if self.follower:
+            return shared_snapshot.read()[0]
+        return self._snapshot
+
+    def restore(self):
+        """以上次保存的快照暖啟動（只嘗試一次），在第一次即時刷新完成前提供服務"""
+        if self._restore_attempted or self.follower:
+            return None
+        self._restore_attempted = True
+        snapshot = shared_snapshot.read()[0]
+        if snapshot is not None and self._snapshot is None:
+            self._snapshot = snapshot
+            self._version = max(self._version, snapshot.version)
+            startup_timer.mark("snapshot_restored")
+            logger.info(f"Serving persisted snapshot v{snapshot.version} ({snapshot.age():.0f}s old) until the first refresh")
+        return self._snapshot
+
+    def promote(self):
+        """follower 成為 leader：沿用共享快照與版本號，之後由本程序刷新"""
+        self.follower = False
+        self._restore_attempted = False
+        self.restore()
+
+    def refresh_soon(self):
+        """在背景重新建立快照（例如追蹤清單變更後）"""
+        if not self.follower:
+            self._revalidate()
+
+    def _revalidate(self):
+        if self._revalidating.is_set():
+            return
+        self._revalidating.set()
+        
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Snapshot revalidation error: {e}")
+            finally:
+                self._revalidating.clear()
+        
+        threading.Thread(target=run, name="snapshot-revalidate", daemon=True).start()
+
+    def start(self):
+        """啟動背景刷新執行緒"""
+        if self._thread and self._thread.is_alive():
+            return
+        self.restore()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="snapshot-refresher", daemon=True)
+        self._thread.start()
+        logger.info(f"Snapshot refresher started (every {self.refresh_interval}s, TTL {self.ttl}s)")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Snapshot refresher error: {e}")
+            self._stop.wait(self.refresh_interval)
+
+snapshot_cache = SnapshotCache()
+
+def live_status():
+    """目前的 Bot 狀態與訂閱數；多 worker 模式的 follower 取自 leader 寫入的共享快照"""
+    if snapshot_cache.follower:
+        status = shared_snapshot.read()[1]
+        if status:
+            return status["bot_running"], status["subscriber_count"]
+    return telegram_app is not None, len(subscribers)
+
+def get_snapshot_view(snapshot):
+    """快照加上即時狀態（Bot、訂閱數）與快照時間"""
+    bot_running, subscriber_count = live_status()
+    return dict(
+        html_view(snapshot.data, snapshot.analytics),
+        bot_running=bot_running,
+        subscriber_count=subscriber_count,
+        snapshot_version=snapshot.version,
+        snapshot_updated_at=datetime.datetime.fromtimestamp(snapshot.created_at).isoformat(timespec="seconds"),
+        stale=snapshot.age() > snapshot_cache.ttl,
+    )
+
+# === 多 worker 模式 ===
+# gunicorn 的每個 worker 都提供網頁服務；其中一個以檔案鎖選出的 leader 負責刷新快照、
+# Telegram Bot、推播與訂閱者儲存。leader 將快照寫入共享檔案，follower 以 mmap 讀取；
+# follower 收到的 webhook 更新寫入暫存目錄，由 leader 取出處理。leader 程序結束時
+# 作業系統釋放檔案鎖，另一個 worker 在 LEADER_POLL_INTERVAL 內接手。
+SHARED_SNAPSHOT_MAGIC = b"DFSNAPJ1"  # 容器格式（SnapshotCodec 的編碼方式改變時才遞增）
+SHARED_SNAPSHOT_HEADER = struct.Struct("<8s8sQdQ")  # magic, 結構指紋, version, created_at, payload 長度
+
+class SnapshotCodec:
+    """共享快照的 JSON 編碼（不使用 pickle，讀取檔案不會執行任何程式碼）
+
+    只接受白名單內的 dataclass，欄位依宣告順序編成陣列；tuple、dict、bytes 與 numpy 陣列以
+    {"t": 型別} 標記。fingerprint 由各型別的欄位名稱與型別註記計算，欄位新增、改名或換序時
+    自動改變，指紋不符的舊檔案視為不存在，不會把值套到錯誤的欄位。
+    """
+
+    def __init__(self, types):
+        self.types = {cls.__name__: cls for cls in types}
+        spec = [[name, [[field.name, str(field.type)] for field in fields(cls)]] for name, cls in self.types.items()]
+        self.fingerprint = hashlib.sha1(json.dumps(spec).encode("utf-8")).digest()[:8]
+
+    def encode(self, value):
+        if value is None or isinstance(value, (str, int, float)):
+            return value
+        if is_dataclass(value):
+            name = type(value).__name__
+            if self.types.get(name) is not type(value):
+                raise TypeError(f"{name} is not a shared snapshot type")
+            return {"t": name, "v": [self.encode(getattr(value, field.name)) for field in fields(value)]}
+        if isinstance(value, tuple):
+            return {"t": "tuple", "v": [self.encode(item) for item in value]}
+        if isinstance(value, list):
+            return [self.encode(item) for item in value]
+        if isinstance(value, dict):
+            return {"t": "dict", "v": [[key, self.encode(item)] for key, item in value.items()]}
+        if isinstance(value, bytes):
+            return {"t": "bytes", "v": base64.b64encode(value).decode("ascii")}
+        if isinstance(value, np.ndarray):
+            return {"t": "ndarray", "dtype": value.dtype.str, "v": value.tolist()}
+        raise TypeError(f"Cannot encode {type(value).__name__} in a shared snapshot")
+
+    def decode(self, value):
+        if isinstance(value, list):
+            return [self.decode(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+        kind, items = value["t"], value["v"]
+        if kind == "tuple":
+            return tuple(self.decode(item) for item in items)
+        if kind == "dict":
+            return {key: self.decode(item) for key, item in items}
+        if kind == "bytes":
+            return base64.b64decode(items)
+        if kind == "ndarray":
+            return np.array(items, dtype=np.dtype(value["dtype"]))
+        cls = self.types.get(kind)
+        if cls is None:
+            raise ValueError(f"Unknown shared snapshot type {kind}")
+        return cls(*(self.decode(item) for item in items))
+
+snapshot_codec = SnapshotCodec((Snapshot, DashboardData, PoolYield, RateRow, MetricStats, FundingTable))
+
+def leader_status():
+    return {
+        "bot_running": telegram_app is not None,
+        "subscriber_count": len(subscribers),
+        "leader_pid": os.getpid(),
+    }
+
+class SharedSnapshotFile:
+    """leader 以原子替換寫入快照（SnapshotCodec 的 JSON），follower 以 mmap 讀取並快取到檔案被替換為止"""
+
+    def __init__(self, path):
+        self.path = path
+        self._stamp = None
+        self._cached = (None, None)
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def write(self, snapshot, status):
+        try:
+            payload = json.dumps(
+                {"snapshot": snapshot_codec.encode(snapshot), "status": status}, separators=(",", ":")
+            ).encode("utf-8")
+            header = SHARED_SNAPSHOT_HEADER.pack(
+                SHARED_SNAPSHOT_MAGIC, snapshot_codec.fingerprint, snapshot.version, snapshot.created_at, len(payload)
+            )
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(header)
+                f.write(payload)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"Failed to write shared snapshot: {e}")
+
+    def read(self):
+        """回傳 (snapshot, status)；最多每 SHARED_SNAPSHOT_POLL 秒檢查一次檔案"""
+        with self._lock:
+            now = time.monotonic()
+            if self._cached[0] is not None and now - self._checked_at < SHARED_SNAPSHOT_POLL:
+                return self._cached
+            self._checked_at = now
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return self._cached
+            stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if stamp == self._stamp:
+                return self._cached
+            
+            try:
+                with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    magic, fingerprint, version, _, length = SHARED_SNAPSHOT_HEADER.unpack_from(mm, 0)
+                    if magic != SHARED_SNAPSHOT_MAGIC or fingerprint != snapshot_codec.fingerprint:
+                        logger.info(f"Ignoring shared snapshot v{version} written with another format")
+                        self._stamp = stamp
+                        return self._cached
+                    start = SHARED_SNAPSHOT_HEADER.size
+                    data = json.loads(mm[start:start + length])
+                    data["snapshot"] = snapshot_codec.decode(data["snapshot"])
+            except Exception as e:
+                logger.error(f"Failed to read shared snapshot: {e}")
+                return self._cached
+            
+            self._stamp = stamp
+            self._cached = (data["snapshot"], data["status"])
+            return self._cached
+
+shared_snapshot = SharedSnapshotFile(SHARED_SNAPSHOT_FILE)
+
+class LeaderElection:
+    """以 fcntl.flock 選出唯一 leader；取得鎖後呼叫 on_elected，鎖一直持有到程序結束"""
+
+    def __init__(self, path, on_elected, interval=LEADER_POLL_INTERVAL):
+        self.path = path
+        self.on_elected = on_elected
+        self.interval = interval
+        self.is_leader = False
+        self.elected_at = None
+        self._fd = None
+        self._thread = None
+
+    def try_acquire(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._fd = fd
+        self.is_leader = True
+        self.elected_at = time.time()
+        return True
+
+    def _run(self):
+        while not self.try_acquire():
+            time.sleep(self.interval)
+        logger.info(f"Worker {os.getpid()} elected leader")
+        try:
+            self.on_elected()
+        except Exception as e:
+            logger.error(f"Leader startup failed: {e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="leader-election", daemon=True)
+        self._thread.start()
+
+class WebhookSpool:
+    """follower 將 webhook 更新寫成檔案，leader 依 update_id 順序取出處理"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.spooled = 0
+        self.consumed = 0
 
-    # 獲取 Pendle 數據
-    for name, url in PENDLE_URLS.items():
-        pendle_data = fetch_api_data(url, f"Pendle {name}")
-        
-        lines.append(f"{name}:")
-        
-        # 如果是 mPendle，加入 Staking APY
-        if name == "mPendle" and staking_apy:
-            lines.append(f"• Staking APY: {staking_apy}")
-            
-        if pendle_data:
-            implied_apy = pendle_data.get("impliedApy")
-            underlying_apy = pendle_data.get("underlyingApy")
-            
-            if implied_apy is not None:
-                lines.append(f"• Implied APY: {implied_apy*100:.2f}%")
-            else:
-                lines.append(f"• Implied APY: N/A")
-                
-            if underlying_apy is not None:
-                lines.append(f"• Underlying APY: {underlying_apy*100:.2f}%")
-            else:
-                lines.append(f"• Underlying APY: N/A")
-        else:
-            lines.append(f"• API Error")
-        
-        lines.append("")
+    def put(self, data):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{int(data.get('update_id', 0)):012d}-{os.getpid()}-{time.time_ns()}.json"
+        tmp_path = os.path.join(self.directory, f".{name}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, os.path.join(self.directory, name))
+        self.spooled += 1
 
-    # 獲取 Merkl 數據
-    merkl_data = fetch_api_data(MERKL_API_URL, "Merkl")
-    if merkl_data and isinstance(merkl_data, list):
-        merkl_result = {item["identifier"]: item["apr"] for item in merkl_data}
-        lines.append("$carrot APR:")
+    def drain(self):
+        """取出並刪除所有待處理更新"""
+        try:
+            names = sorted(name for name in os.listdir(self.directory) if name.endswith(".json"))
+        except FileNotFoundError:
+            return []
         
-        for identifier, display_name in MERKL_IDENTIFIERS.items():
-            apr = merkl_result.get(identifier)
-            if apr is not None:
-                lines.append(f"• {display_name}: {apr:.2f}%")
-            else:
-                lines.append(f"• {display_name}: N/A")
-    else:
-        lines.append("$carrot APR:")
-        lines.append("• API Error")
+        updates = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    updates.append(json.load(f))
+            except Exception as e:
+                logger.error(f"Discarding unreadable spooled update {name}: {e}")
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return updates
 
-    return "\n".join(lines)
+    async def consume(self):
+        """leader 的 app_loop 上持續將暫存的更新交給 webhook_queue（佇列已滿時等待）"""
+        while True:
+            try:
+                for data in await run_blocking(self.drain):
+                    while webhook_queue.submit(data) in ("overloaded", "not_ready"):
+                        await asyncio.sleep(WEBHOOK_SPOOL_POLL)
+                    self.consumed += 1
+            except Exception as e:
+                logger.error(f"Webhook spool error: {e}")
+            await asyncio.sleep(WEBHOOK_SPOOL_POLL)
 
-def get_hyperliquid_message():
-    """產生 Hyperliquid 資金費率訊息（Telegram 用）"""
-    lines = ["Hyperliquid funding rate APR:"]
-    
-    try:
-        rates = get_funding_rates(HYPERLIQUID_ASSETS)
-        if not rates:
-            lines.append("• API Error")
-            return "\n".join(lines)
-            
-        for asset, rate in rates.items():
-            apr = calculate_apr(rate) * 100
-            lines.append(f"• {asset} = {apr:.2f}%")
-            
-    except Exception as e:
-        lines.append(f"• Data Error: {e}")
-        
-    return "\n".join(lines)
+webhook_spool = WebhookSpool(WEBHOOK_SPOOL_DIR)
+leader_election = None
 
 # === Telegram 指令處理 ===
 async def handle_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -625,7 +3345,7 @@ async def handle_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         if chat_id not in subscribers:
             subscribers.add(chat_id)
-            save_subscribers(subscribers)
+            subscriber_persistence.record("subscribe", chat_id)
             logger.info(f"New subscriber added, total: {len(subscribers)}")
         
         app_url = get_app_url()
@@ -634,6 +3354,8 @@ async def handle_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "Welcome to yield & funding rate updates!\n"
             f"Auto push: Every {push_interval//60} minutes\n"
             "Use /check to view immediately\n"
+            "Use /watch fGHO ETH to set a watchlist\n"
+            "Use /alert ETH funding > 30 to set an alert\n"
             "Use /stop to unsubscribe\n"
             f"Dashboard: {app_url}"
         )
@@ -648,46 +3370,699 @@ async def handle_stop(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = update.effective_chat.id
         if chat_id in subscribers:
             subscribers.remove(chat_id)
-            save_subscribers(subscribers)
+            subscriber_persistence.record("unsubscribe", chat_id)
             logger.info(f"Subscriber removed, total: {len(subscribers)}")
+        if watchlists.pop(chat_id, None) or alert_index.count_for_chat(chat_id):
+            alert_index.remove_chat(chat_id)
+            subscriber_persistence.record("preferences", chat_id)
         await update.message.reply_text("Successfully unsubscribed")
     except Exception as e:
         logger.error(f"handle_stop error: {e}")
 
 async def handle_check(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
-        status_message = await update.message.reply_text("Fetching latest data...")
-        message = get_combined_message()
-        await status_message.edit_text(message)
+        snapshot = await snapshot_cache.get_async()
+        await update.message.reply_text(snapshot.message if snapshot else DATA_LOADING_MESSAGE)
     except Exception as e:
         logger.error(f"handle_check error: {e}")
 
-async def send_to_all_subscribers(message):
-    """發送訊息給所有訂閱者"""
-    global subscribers
+async def handle_watch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/watch <池或資產...>：加入觀察清單"""
+    try:
+        chat_id = update.effective_chat.id
+        snapshot = await snapshot_cache.get_async()
+        if snapshot is None:
+            await update.message.reply_text(DATA_LOADING_MESSAGE)
+            return
+        known = {metric_entity(key) for key in snapshot.metrics}
+        requested = [name.lower() for name in context.args]
+        unknown = [name for name in requested if name not in known]
+        names = watchlists.setdefault(chat_id, set())
+        for name in requested:
+            if name in known and len(names) < MAX_WATCHLIST_SIZE:
+                names.add(name)
+        subscriber_persistence.record("preferences", chat_id)
+        
+        reply = format_watchlist(chat_id, snapshot)
+        if unknown:
+            reply += f"\nUnknown: {', '.join(unknown)}"
+        await update.message.reply_text(reply)
+    except Exception as e:
+        logger.error(f"handle_watch error: {e}")
+
+async def handle_unwatch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/unwatch <池或資產...|all>：移出觀察清單"""
+    try:
+        chat_id = update.effective_chat.id
+        names = watchlists.get(chat_id, set())
+        requested = [name.lower() for name in context.args]
+        if not requested or "all" in requested:
+            names.clear()
+        else:
+            names.difference_update(requested)
+        if not names:
+            watchlists.pop(chat_id, None)
+        subscriber_persistence.record("preferences", chat_id)
+        
+        snapshot = await snapshot_cache.get_async()
+        await update.message.reply_text(format_watchlist(chat_id, snapshot))
+    except Exception as e:
+        logger.error(f"handle_unwatch error: {e}")
+
+async def handle_watchlist(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        snapshot = await snapshot_cache.get_async()
+        await update.message.reply_text(format_watchlist(update.effective_chat.id, snapshot))
+    except Exception as e:
+        logger.error(f"handle_watchlist error: {e}")
+
+def parse_alert_args(args, keys):
+    """解析 /alert 參數，例如 ["ETH", "funding", ">", "30"]、["fGHO", "implied", "<", "fGHO", "underlying"]
+
+    右側為同一池或資產的欄位時可省略名稱：["fGHO", "implied", "<", "underlying"]。
+    """
+    op_index = next((i for i, arg in enumerate(args) if arg in ALERT_OPERATORS), None)
+    if op_index is None:
+        raise ValueError("missing operator (>, >=, <, <=)")
+    left = resolve_metric(" ".join(args[:op_index]), keys)
+    if left is None:
+        raise ValueError(f"unknown metric '{' '.join(args[:op_index])}'")
+    right_text = " ".join(args[op_index + 1:])
+    try:
+        right = float(right_text.rstrip("%"))
+    except ValueError:
+        right = resolve_metric(right_text, keys) or resolve_metric(f"{metric_entity(left)} {right_text}", keys)
+        if right is None:
+            raise ValueError(f"unknown value or metric '{right_text}'")
+    return left, args[op_index], right
+
+async def handle_alert(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/alert <指標> <運算子> <數值|指標>：新增警示"""
+    try:
+        chat_id = update.effective_chat.id
+        snapshot = await snapshot_cache.get_async()
+        if not context.args:
+            await update.message.reply_text(
+                "Usage: /alert ETH funding > 30\n"
+                "       /alert fGHO implied < underlying"
+            )
+            return
+        if snapshot is None:
+            await update.message.reply_text(DATA_LOADING_MESSAGE)
+            return
+        if alert_index.count_for_chat(chat_id) >= MAX_ALERTS_PER_CHAT:
+            await update.message.reply_text(f"Alert limit reached ({MAX_ALERTS_PER_CHAT}), use /delalert first")
+            return
+        try:
+            left, op, right = parse_alert_args(context.args, snapshot.metrics.keys())
+        except ValueError as e:
+            await update.message.reply_text(f"Invalid alert: {e}")
+            return
+        
+        rule = alert_index.add(chat_id, left, op, right, metrics=snapshot.metrics)
+        subscriber_persistence.record("preferences", chat_id)
+        state = "currently true" if rule.triggered else "currently false"
+        await update.message.reply_text(f"Alert {rule.describe()} added ({state})")
+    except Exception as e:
+        logger.error(f"handle_alert error: {e}")
+
+async def handle_alerts(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        rules = alert_index.for_chat(update.effective_chat.id)
+        if not rules:
+            await update.message.reply_text("No alerts. Use /alert ETH funding > 30")
+            return
+        await update.message.reply_text("Alerts:\n" + "\n".join(f"• {rule.describe()}" for rule in rules))
+    except Exception as e:
+        logger.error(f"handle_alerts error: {e}")
+
+async def handle_delalert(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/delalert <編號>：刪除警示"""
+    try:
+        chat_id = update.effective_chat.id
+        removed = []
+        for arg in context.args:
+            rule = alert_index.remove(int(arg.lstrip("#")), chat_id=chat_id) if arg.lstrip("#").isdigit() else None
+            if rule:
+                removed.append(rule.describe())
+        if removed:
+            subscriber_persistence.record("preferences", chat_id)
+            await update.message.reply_text("Removed:\n" + "\n".join(f"• {text}" for text in removed))
+        else:
+            await update.message.reply_text("Usage: /delalert <id> (see /alerts)")
+    except Exception as e:
+        logger.error(f"handle_delalert error: {e}")
+
+# === 市場管理指令（ADMIN_CHAT_IDS） ===
+async def handle_markets(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/markets：列出追蹤的 Pendle 市場"""
+    try:
+        lines = [f"Tracked Pendle markets ({len(market_registry.markets())}):"]
+        for chain_id, markets in sorted(market_registry.by_chain().items()):
+            lines.append(f"Chain {chain_id}:")
+            lines.extend(f"• {market.name} ({market.type}) {market.address}" for market in markets)
+        await update.message.reply_text("\n".join(lines))
+    except Exception as e:
+        logger.error(f"handle_markets error: {e}")
+
+async def handle_addmarket(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/addmarket <名稱> <chain_id> <市場地址> [類型]"""
+    try:
+        if update.effective_chat.id not in ADMIN_CHAT_IDS:
+            await update.message.reply_text("This command is restricted to admins.")
+            return
+        args = context.args
+        if len(args) < 3 or not args[1].isdigit() or not re.fullmatch(r"0x[0-9a-fA-F]{40}", args[2]):
+            await update.message.reply_text("Usage: /addmarket <name> <chain_id> <market address> [type]")
+            return
+        market = PendleMarket(args[0], int(args[1]), args[2].lower(), " ".join(args[3:]) or "Pendle YT")
+        market_registry.add(market)
+        await run_blocking(market_registry.save)
+        snapshot_cache.refresh_soon()
+        await update.message.reply_text(f"✅ Tracking {market.name} on chain {market.chain_id}")
+    except Exception as e:
+        logger.error(f"handle_addmarket error: {e}")
+
+async def handle_removemarket(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/removemarket <名稱>"""
+    try:
+        if update.effective_chat.id not in ADMIN_CHAT_IDS:
+            await update.message.reply_text("This command is restricted to admins.")
+            return
+        if not context.args:
+            await update.message.reply_text("Usage: /removemarket <name>")
+            return
+        market = market_registry.remove(context.args[0])
+        if market is None:
+            await update.message.reply_text(f"Unknown market: {context.args[0]}")
+            return
+        await run_blocking(market_registry.save)
+        snapshot_cache.refresh_soon()
+        await update.message.reply_text(f"✅ Stopped tracking {market.name}")
+    except Exception as e:
+        logger.error(f"handle_removemarket error: {e}")
+
+# === 推播引擎 ===
+class AsyncTokenBucket:
+    """全域令牌桶，限制每秒發送數"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = None
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        while True:
+            async with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            await asyncio.sleep(wait)
+
+def classify_send_error(error):
+    """分類發送錯誤：retry_after / migrated / permanent / transient / failed"""
+    if isinstance(error, telegram.error.RetryAfter):
+        return "retry_after"
+    if isinstance(error, telegram.error.ChatMigrated):
+        return "migrated"
+    if isinstance(error, telegram.error.Forbidden):
+        return "permanent"
+    if isinstance(error, telegram.error.BadRequest):
+        text = str(error).lower()
+        if any(marker in text for marker in PERMANENT_SEND_ERRORS):
+            return "permanent"
+        return "failed"
+    if isinstance(error, telegram.error.NetworkError):  # 包含 TimedOut
+        return "transient"
+    return "failed"
+
+class BroadcastEngine:
+    """並行推播：限制並行數、全域限速、RetryAfter 時暫停整個推播，並回報吞吐與延遲"""
+
+    def __init__(self, concurrency=BROADCAST_CONCURRENCY, rate=BROADCAST_RATE,
+                 burst=BROADCAST_BURST, max_attempts=BROADCAST_MAX_ATTEMPTS):
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.bucket = AsyncTokenBucket(rate, burst)
+        self._resume_at = 0.0  # Telegram 的 flood control 以 Bot 為單位，收到 RetryAfter 後所有發送等到此時間
+
+    async def _flood_wait(self):
+        while (delay := self._resume_at - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+
+    async def _deliver(self, bot, chat_id, message, semaphore, report):
+        target = chat_id  # 群組遷移後改送新的 chat_id，結果也記在新的 chat_id 下
+        for attempt in range(1, self.max_attempts + 1):
+            async with semaphore:
+                await self._flood_wait()
+                await self.bucket.acquire()
+                started = time.monotonic()
+                perf_started = time.perf_counter()
+                try:
+                    await bot.send_message(chat_id=target, text=message)
+                    observe_upstream("telegram", perf_started, True)
+                    report["latencies"].append(time.monotonic() - started)
+                    report["sent"] += 1
+                    report["outcomes"].append((target, "sent", None))
+                    return
+                except Exception as e:
+                    observe_upstream("telegram", perf_started, False)
+                    error = e
+                    kind = classify_send_error(e)
+            
+            # 等待時釋放 semaphore，避免阻塞其他 chat
+            if kind == "retry_after":
+                report["retry_after"] += 1
+                self._resume_at = max(self._resume_at, time.monotonic() + float(error.retry_after) + 0.5)
+                logger.warning(f"Telegram flood control, pausing broadcast for {float(error.retry_after):.0f}s")
+            elif kind == "migrated":
+                report["migrated"][chat_id] = error.new_chat_id
+                target = error.new_chat_id
+            elif kind == "transient" and attempt < self.max_attempts:
+                await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+            elif kind == "permanent":
+                logger.warning(f"Push failed permanently chat_id={target}: {error}")
+                report["migrated"].pop(chat_id, None)
+                report["evicted"].append(chat_id)
+                report["outcomes"].append((target, "evicted", str(error)))
+                return
+            else:
+                break
+        
+        logger.warning(f"Push failed chat_id={target}: {error}")
+        report["failed"] += 1
+        report["outcomes"].append((target, "failed", str(error)))
+
+    async def broadcast(self, bot, chat_ids, message):
+        """發送同一則訊息給所有 chat_ids，回傳統計報告"""
+        return await self.send_messages(bot, [(chat_id, message) for chat_id in chat_ids])
+
+    async def send_messages(self, bot, messages):
+        """發送 [(chat_id, 訊息)]（每個 chat 可不同），回傳統計報告"""
+        async def single_page():
+            yield messages
+        return await self.send_pages(bot, single_page())
+
+    async def send_pages(self, bot, pages):
+        """依序發送非同步產生的多頁 [(chat_id, 訊息)]，同一時間只保留一頁的待發送工作
+
+        報告的 outcomes 為每個 chat 的 (chat_id, sent/failed/evicted, 錯誤)。
+        """
+        report = {
+            "total": 0,
+            "sent": 0,
+            "failed": 0,
+            "retry_after": 0,
+            "evicted": [],
+            "migrated": {},
+            "latencies": [],
+            "outcomes": [],
+        }
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.monotonic()
+        async for messages in pages:
+            report["total"] += len(messages)
+            await asyncio.gather(*(
+                self._deliver(bot, chat_id, message, semaphore, report) for chat_id, message in messages
+            ))
+        duration = time.monotonic() - started
+        latencies = report.pop("latencies")
+        report.update({
+            "duration": round(duration, 3),
+            "throughput": round(report["sent"] / duration, 2) if duration > 0 else 0.0,
+            "latency_p50": round(percentile(latencies, 50), 3),
+            "latency_p95": round(percentile(latencies, 95), 3),
+            "latency_max": round(max(latencies), 3) if latencies else 0.0,
+            "finished_at": time.time(),
+        })
+        BROADCAST_DURATION.observe(duration)
+        BROADCAST_RATE_GAUGE.set(report["throughput"])
+        BROADCAST_MESSAGES.inc(report["sent"], result="sent")
+        BROADCAST_MESSAGES.inc(report["failed"], result="failed")
+        BROADCAST_MESSAGES.inc(len(report["evicted"]), result="evicted")
+        return report
+
+broadcast_engine = BroadcastEngine()
+last_broadcast_report = None
+
+async def send_to_all_subscribers(message, personalize=None):
+    """發送訊息給所有訂閱者；personalize(chat_id) 可回傳個人化訊息，回傳 None 則略過該 chat"""
+    global subscribers, last_broadcast_report
     if not subscribers:
         return
     
-    failed_chats = []
-    success_count = 0
+    # 先寫入待處理的訂閱變更，再從資料庫分頁讀取訂閱者
+    await run_blocking(subscriber_persistence.flush)
     
-    for chat_id in subscribers.copy():
-        try:
-            await telegram_app.bot.send_message(chat_id=chat_id, text=message)
-            success_count += 1
-            await asyncio.sleep(0.1)
-        except Exception as e:
-            logger.warning(f"Push failed chat_id={chat_id}: {e}")
-            failed_chats.append(chat_id)
+    async def pages():
+        after = None
+        while True:
+            page = await run_blocking(state_store.subscriber_page, after, BROADCAST_PAGE_SIZE)
+            if not page:
+                return
+            after = page[-1]
+            if personalize is None:
+                yield [(chat_id, message) for chat_id in page]
+            else:
+                yield [(chat_id, text) for chat_id in page if (text := personalize(chat_id)) is not None]
     
-    # 移除失效的 chat_id
-    if failed_chats:
-        for chat_id in failed_chats:
+    report = await broadcast_engine.send_pages(telegram_app.bot, pages())
+    outcomes = report.pop("outcomes")
+    last_broadcast_report = report
+    try:
+        await run_blocking(state_store.record_deliveries, outcomes)
+    except Exception as e:
+        logger.error(f"Failed to record delivery state: {e}")
+    
+    # 只移除永久失效的 chat_id，並更新已遷移的群組
+    if report["evicted"] or report["migrated"]:
+        for chat_id in report["evicted"]:
             subscribers.discard(chat_id)
-        save_subscribers(subscribers)
-        logger.info(f"Removed {len(failed_chats)} failed chat IDs")
+            subscriber_persistence.record("unsubscribe", chat_id)
+        for old_id, new_id in report["migrated"].items():
+            subscribers.discard(old_id)
+            subscribers.add(new_id)
+            subscriber_persistence.record("unsubscribe", old_id)
+            subscriber_persistence.record("subscribe", new_id)
+        logger.info(f"Removed {len(report['evicted'])} dead chat IDs, migrated {len(report['migrated'])}")
+    
+    logger.info(
+        f"Auto push completed: {report['sent']} sent, {report['failed']} failed, "
+        f"{len(report['evicted'])} evicted in {report['duration']:.2f}s "
+        f"({report['throughput']:.1f} msg/s, p95 {report['latency_p95']*1000:.0f}ms)"
+    )
+
+# === 變化偵測推播 ===
+METRIC_FIELD_LABELS = {
+    "implied_apy": "Implied APY",
+    "underlying_apy": "Underlying APY",
+    "staking_apy": "Staking APY",
+    "apr": "APR",
+    "funding_apr": "funding APR",
+}
+
+def describe_metric(key):
+    """指標名稱轉為訊息用標籤，例如 fGHO Implied APY"""
+    _, name, field = key.split(".", 2)
+    return f"{name.replace('_', ' ')} {METRIC_FIELD_LABELS.get(field, field)}"
+
+def detect_changes(baseline, metrics, abs_threshold=PUSH_ABS_THRESHOLD, rel_threshold=PUSH_REL_THRESHOLD):
+    """比較基準值與最新指標，回傳超過門檻的變化 [(key, 舊值, 新值, 原因)]
+
+    相對門檻只在舊值絕對值不小於絕對門檻時採用，避免接近 0 的資金費率產生雜訊。
+    """
+    changes = []
+    for key, new in metrics.items():
+        old = baseline.get(key)
+        if old is None:
+            continue
+        diff = new - old
+        if key.endswith(".funding_apr") and old * new < 0:
+            changes.append((key, old, new, "sign flip"))
+        elif abs(diff) >= abs_threshold:
+            changes.append((key, old, new, "abs"))
+        elif abs(old) >= abs_threshold and abs(diff) / abs(old) >= rel_threshold:
+            changes.append((key, old, new, "rel"))
+    return changes
+
+def format_changes_message(snapshot, changes):
+    """只包含變化項目的推播訊息"""
+    timestamp = (datetime.datetime.utcfromtimestamp(snapshot.created_at) + timedelta(hours=8)).strftime('%Y-%m-%d %H:%M:%S')
+    lines = [
+        f"{timestamp} (UTC+8) | Changes",
+        "_" * 33,
+        "",
+    ]
+    for key, old, new, reason in changes:
+        note = " (sign flip)" if reason == "sign flip" else ""
+        lines.append(f"• {describe_metric(key)}: {old:.2f}% → {new:.2f}% ({new - old:+.2f}){note}")
+    lines.append("_" * 33)
+    lines.append("Use /check for full data")
+    return "\n".join(lines)
+
+class DeltaPushTracker:
+    """記錄上次推播的指標值，只在變化超過門檻時產生推播訊息"""
+
+    def __init__(self):
+        self.baseline = {}
+        self.sent = 0
+        self.skipped = 0
+
+    def prepare(self, snapshot):
+        """回傳 (訊息, 變化清單)；沒有需要推播的變化時訊息為 None"""
+        if not self.baseline:
+            return snapshot.message, None
+        changes = detect_changes(self.baseline, snapshot.metrics)
+        if not changes:
+            return None, []
+        return format_changes_message(snapshot, changes), changes
+
+    def commit(self, snapshot, changes):
+        """推播後更新基準值；只更新已推播的指標，讓緩慢變化持續累積"""
+        if changes is None:
+            self.baseline = dict(snapshot.metrics)
+        else:
+            for key, _, new, _ in changes:
+                self.baseline[key] = new
+            for key, value in snapshot.metrics.items():
+                self.baseline.setdefault(key, value)
+        self.sent += 1
+
+delta_push_tracker = DeltaPushTracker()
+
+# === 個人化：觀察清單與警示 ===
+ALERT_OPERATORS = {
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+}
+
+def metric_aliases(keys):
+    """指標的使用者輸入別名，例如 "eth funding"、"fgho implied" -> 指標名稱"""
+    aliases = {}
+    for key in keys:
+        _, name, field = key.split(".", 2)
+        readable = name.replace("_", " ").lower()
+        aliases[key.lower()] = key
+        aliases[f"{readable} {field.split('_')[0]}"] = key
+        aliases[f"{readable} {field.replace('_', ' ')}"] = key
+    return aliases
+
+def resolve_metric(text, keys):
+    """將使用者輸入解析為指標名稱，找不到時回傳 None"""
+    return metric_aliases(keys).get(" ".join(text.lower().split()))
+
+def metric_entity(key):
+    """指標所屬的池或資產名稱（小寫），供觀察清單比對"""
+    return key.split(".", 2)[1].replace("_", " ").lower()
+
+@dataclass
+class AlertRule:
+    """單一警示規則：left op right（right 可為數值或另一個指標）"""
+    rule_id: int
+    chat_id: int
+    left: str
+    op: str
+    right: object
+    triggered: bool = False
+
+    def metrics(self):
+        return [self.left] + ([self.right] if isinstance(self.right, str) else [])
+
+    def evaluate(self, metrics):
+        """規則是否成立；缺少資料時回傳 None"""
+        left = metrics.get(self.left)
+        right = metrics.get(self.right) if isinstance(self.right, str) else self.right
+        if left is None or right is None:
+            return None
+        return ALERT_OPERATORS[self.op](left, right)
+
+    def describe(self):
+        right = describe_metric(self.right) if isinstance(self.right, str) else f"{self.right:g}%"
+        return f"#{self.rule_id} {describe_metric(self.left)} {self.op} {right}"
+
+    def to_dict(self):
+        return {"id": self.rule_id, "chat_id": self.chat_id, "left": self.left, "op": self.op,
+                "right": self.right, "triggered": self.triggered}
+
+class AlertIndex:
+    """以指標為索引的警示規則：每次刷新只評估有變化指標的規則"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rules = {}
+        self.by_metric = {}
+        self.by_chat = {}
+        self._next_id = 1
+        self.evaluations = 0
+
+    def add(self, chat_id, left, op, right, metrics=None, rule_id=None, triggered=None):
+        with self._lock:
+            if rule_id is None:
+                rule_id = self._next_id
+            self._next_id = max(self._next_id, rule_id + 1)
+            rule = AlertRule(rule_id, chat_id, left, op, right)
+            if triggered is not None:
+                rule.triggered = triggered
+            elif metrics is not None:
+                rule.triggered = bool(rule.evaluate(metrics))
+            self.rules[rule_id] = rule
+            for key in rule.metrics():
+                self.by_metric.setdefault(key, set()).add(rule_id)
+            self.by_chat.setdefault(chat_id, set()).add(rule_id)
+            return rule
+
+    def remove(self, rule_id, chat_id=None):
+        with self._lock:
+            rule = self.rules.get(rule_id)
+            if rule is None or (chat_id is not None and rule.chat_id != chat_id):
+                return None
+            del self.rules[rule_id]
+            for key in rule.metrics():
+                ids = self.by_metric.get(key)
+                if ids:
+                    ids.discard(rule_id)
+                    if not ids:
+                        del self.by_metric[key]
+            chat_ids = self.by_chat.get(rule.chat_id)
+            if chat_ids:
+                chat_ids.discard(rule_id)
+                if not chat_ids:
+                    del self.by_chat[rule.chat_id]
+            return rule
+
+    def remove_chat(self, chat_id):
+        with self._lock:
+            rule_ids = list(self.by_chat.get(chat_id, ()))
+        for rule_id in rule_ids:
+            self.remove(rule_id)
+
+    def for_chat(self, chat_id):
+        with self._lock:
+            return [self.rules[rule_id] for rule_id in sorted(self.by_chat.get(chat_id, ()))]
+
+    def count_for_chat(self, chat_id):
+        with self._lock:
+            return len(self.by_chat.get(chat_id, ()))
+
+    def chat_ids(self):
+        with self._lock:
+            return set(self.by_chat)
+
+    def evaluate(self, changed_keys, metrics):
+        """評估受影響的規則，回傳剛由不成立轉為成立的 [(rule, 目前值)]
+
+        觸發狀態有變化的規則交給 subscriber_persistence 寫入，重啟後不會重複或漏發。
+        """
+        fired = []
+        changed = []
+        with self._lock:
+            candidates = set()
+            for key in changed_keys:
+                candidates.update(self.by_metric.get(key, ()))
+            for rule_id in candidates:
+                rule = self.rules[rule_id]
+                self.evaluations += 1
+                result = rule.evaluate(metrics)
+                if result is None:
+                    continue
+                if result and not rule.triggered:
+                    fired.append((rule, metrics[rule.left]))
+                if result != rule.triggered:
+                    changed.append((rule_id, result))
+                rule.triggered = result
+        if changed:
+            subscriber_persistence.record_alert_states(changed)
+        return fired
+
+alert_index = AlertIndex()
+watchlists = {}  # chat_id -> set(池或資產名稱，小寫)
+
+def load_preferences():
+    """從 SQLite 載入觀察清單與警示規則；首次啟動時匯入舊版 preferences.json"""
+    try:
+        if not state_store.get_meta("preferences_imported") and os.path.exists(PREFERENCES_FILE):
+            with open(PREFERENCES_FILE, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for chat_id, names in data.get("watchlists", {}).items():
+                watchlists[int(chat_id)] = set(names)
+            for rule in data.get("alerts", []):
+                alert_index.add(rule["chat_id"], rule["left"], rule["op"], rule["right"],
+                                rule_id=rule["id"], triggered=rule.get("triggered", False))
+            chat_ids = set(watchlists) | alert_index.chat_ids()
+            state_store.apply([], {
+                chat_id: (sorted(watchlists.get(chat_id, ())), alert_index.for_chat(chat_id)) for chat_id in chat_ids
+            })
+            state_store.set_meta("preferences_imported", PREFERENCES_FILE)
+            logger.info(f"📋 Imported {len(watchlists)} watchlists and {len(alert_index.rules)} alerts from {PREFERENCES_FILE}")
+            return
+        
+        for chat_id, names in state_store.load_watchlists().items():
+            watchlists[chat_id] = names
+        for rule in state_store.load_alerts():
+            alert_index.add(rule["chat_id"], rule["left"], rule["op"], rule["right"],
+                            rule_id=rule["id"], triggered=rule["triggered"])
+        logger.info(f"✅ Loaded {len(watchlists)} watchlists and {len(alert_index.rules)} alerts")
+    except Exception as e:
+        logger.error(f"❌ Failed to load preferences: {e}")
+
+def changed_metric_keys(previous, metrics):
+    """與上一個快照相比數值有變化（或新出現）的指標"""
+    if previous is None:
+        return set(metrics)
+    old = previous.metrics
+    if old is metrics:
+        return set()
+    return {key for key, value in metrics.items() if old.get(key) != value}
+
+def dispatch_alerts(fired):
+    """將觸發的警示交給 app_loop 發送"""
+    if not fired or not telegram_app or not app_loop:
+        return
+    messages = [
+        (rule.chat_id, f"🔔 Alert {rule.describe()} (now {value:.2f}%)")
+        for rule, value in fired
+    ]
+    asyncio.run_coroutine_threadsafe(
+        broadcast_engine.send_messages(telegram_app.bot, messages), app_loop
+    )
+    logger.info(f"Dispatched {len(messages)} alerts")
+
+def watchlist_filter(changes, snapshot):
+    """依觀察清單產生個人化推播（沒有相關變化的 chat 略過）"""
+    def personalize(chat_id):
+        names = watchlists.get(chat_id)
+        if not names:
+            return default_message
+        relevant = [change for change in changes if metric_entity(change[0]) in names]
+        if not relevant:
+            return None
+        return format_changes_message(snapshot, relevant)
     
-    logger.info(f"Auto push completed: {success_count} sent, {len(failed_chats)} failed")
+    default_message = format_changes_message(snapshot, changes)
+    return personalize
+
+def format_watchlist(chat_id, snapshot):
+    """觀察清單目前數值"""
+    names = watchlists.get(chat_id)
+    if not names:
+        return "Your watchlist is empty. Use /watch <pool or asset>, e.g. /watch fGHO ETH"
+    lines = ["Watchlist:"]
+    for key, value in sorted(snapshot.metrics.items() if snapshot else ()):
+        if metric_entity(key) in names:
+            lines.append(f"• {describe_metric(key)}: {value:.2f}%")
+    if len(lines) == 1:
+        lines.append("• No data yet")
+    return "\n".join(lines)
 
 # === 简化的自動推播任務 ===
 async def auto_push_task():
@@ -705,11 +4080,23 @@ async def auto_push_task():
         while True:
             try:
                 if auto_push_enabled and subscribers:
-                    logger.info(f"Starting auto push to {len(subscribers)} subscribers...")
-                    message = get_combined_message()
-                    await send_to_all_subscribers(message)
-                    last_push_time = time.time()
-                    logger.info(f"Auto push completed successfully")
+                    snapshot = await snapshot_cache.get_async()
+                    if PUSH_MODE == "delta":
+                        message, changes = delta_push_tracker.prepare(snapshot)
+                    else:
+                        message, changes = snapshot.message, None
+                    
+                    if message is None:
+                        delta_push_tracker.skipped += 1
+                        logger.info("No changes above push thresholds, skipping push")
+                    else:
+                        logger.info(f"Starting auto push to {len(subscribers)} subscribers...")
+                        personalize = watchlist_filter(changes, snapshot) if changes and watchlists else None
+                        await send_to_all_subscribers(message, personalize)
+                        if PUSH_MODE == "delta":
+                            delta_push_tracker.commit(snapshot, changes)
+                        last_push_time = time.time()
+                        logger.info(f"Auto push completed successfully")
                 else:
                     logger.info(f"Skipping push (enabled: {auto_push_enabled}, subscribers: {len(subscribers)})")
                 
@@ -725,23 +4112,153 @@ async def auto_push_task():
         push_task_active = False
         logger.info("Auto push task ended")
 
+# === 預先渲染頁面快取 ===
+@dataclass(frozen=True)
+class RenderedResponse:
+    """預先渲染並壓縮好的回應內容"""
+    body: bytes
+    gzip_body: bytes
+    br_body: bytes
+    etag: str
+    last_modified: float
+    content_type: str
+
+def build_rendered_response(body, content_type, last_modified):
+    """計算 ETag 並預先壓縮（gzip，安裝 brotli 時另加 br）"""
+    return RenderedResponse(
+        body=body,
+        gzip_body=gzip.compress(body, compresslevel=6),
+        br_body=brotli.compress(body) if brotli else None,
+        etag=hashlib.sha1(body).hexdigest()[:24],
+        last_modified=last_modified,
+        content_type=content_type,
+    )
+
+class PageCache:
+    """每種頁面只保留最新一份渲染結果，快照或即時狀態改變時才重新渲染"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._template = None
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self._stamps = {}
+
+    def render_stamp(self, name):
+        """此次渲染的 Last-Modified（整數秒，每次渲染嚴格遞增）
+
+        同一快照的頁面也會因即時狀態改變而重新渲染，Last-Modified 必須隨每次渲染前進，
+        舊的 If-Modified-Since 才不會對已改變的頁面回 304（在 build() 中呼叫，持有 _lock）。
+        """
+        stamp = max(int(time.time()), self._stamps.get(name, 0) + 1)
+        self._stamps[name] = stamp
+        return stamp
+
+    def dashboard_template(self):
+        """只編譯一次的儀表板模板"""
+        if self._template is None:
+            self._template = app.jinja_env.from_string(DASHBOARD_HTML)
+        return self._template
+
+    def get(self, name, key, build):
+        entry = self._entries.get(name)
+        if entry and entry[0] == key:
+            self.hits += 1
+            return entry[1]
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry and entry[0] == key:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            rendered = build()
+            self._entries[name] = (key, rendered)
+            return rendered
+
+page_cache = PageCache()
+
+def snapshot_cache_key(snapshot):
+    """影響渲染內容的快照版本與即時狀態"""
+    return (
+        snapshot.version,
+        *live_status(),
+        snapshot.age() > snapshot_cache.ttl,
+    )
+
+def render_dashboard_page(snapshot):
+    view = get_snapshot_view(snapshot)
+    body = page_cache.dashboard_template().render(**view).encode("utf-8")
+    return build_rendered_response(body, "text/html; charset=utf-8", page_cache.render_stamp("dashboard"))
+
+def render_yields_json(snapshot):
+    """快照的預先序列化內容前加上渲染時間與過期旗標（其餘位元組不重新序列化）"""
+    # 上游未變時 data.updated_at 不會前進，但統計更新仍會產生新版本，Last-Modified 與儀表板一樣取渲染時間
+    stamp = page_cache.render_stamp("api_yields")
+    live = json.dumps({
+        "generated_at": datetime.datetime.fromtimestamp(stamp).isoformat(timespec="seconds"),
+        "stale": snapshot.age() > snapshot_cache.ttl,
+    }, separators=(",", ":"))
+    body = live[:-1].encode("utf-8") + b"," + snapshot.yields_json[1:]
+    return build_rendered_response(body, "application/json", stamp)
+
+def serve_rendered(rendered, snapshot):
+    """以 ETag / Last-Modified 處理條件式請求，並依 Accept-Encoding 回傳預壓縮內容
+
+    每種編碼的內容位元組不同，強 ETag 依編碼加上後綴（-gz / -br）。
+    """
+    last_modified = datetime.datetime.fromtimestamp(int(rendered.last_modified), tz=datetime.timezone.utc)
+    
+    body, encoding, etag = rendered.body, None, rendered.etag
+    if rendered.br_body is not None and request.accept_encodings["br"]:
+        body, encoding, etag = rendered.br_body, "br", f"{rendered.etag}-br"
+    elif request.accept_encodings["gzip"]:
+        body, encoding, etag = rendered.gzip_body, "gzip", f"{rendered.etag}-gz"
+    
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        since = request.if_modified_since
+        not_modified = since is not None and last_modified <= since
+    
+    if not_modified:
+        page_cache.not_modified += 1
+        response = Response(status=304)
+    else:
+        response = Response(body, content_type=rendered.content_type)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+    
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["Age"] = str(int(snapshot.age()))
+    return response
+
 # === Flask 路由 ===
 @app.route('/')
 def dashboard():
     """主儀表板頁面"""
     try:
-        data = get_dashboard_data()
-        if data:
-            return render_template_string(DASHBOARD_HTML, **data)
+        snapshot = snapshot_cache.get()
+        if snapshot:
+            rendered = page_cache.get("dashboard", snapshot_cache_key(snapshot),
+                                      lambda: render_dashboard_page(snapshot))
+            return serve_rendered(rendered, snapshot)
         else:
             return render_template_string(DASHBOARD_HTML, 
                 pendle_data=[], 
                 merkl_data=[], 
                 hyperliquid_data=[], 
+                funding_screener=None,
                 last_update="Error",
                 bot_running=False,
                 subscriber_count=0,
-                backup_status="Error"
+                backup_status="Error",
+                stale=False,
+                stale_sources=[]
             )
     except Exception as e:
         logger.error(f"Dashboard page error: {e}")
@@ -752,43 +4269,322 @@ def health_check():
     """健康檢查端點 - 防止 Render 休眠"""
     current_time = time.time()
     time_since_last_push = current_time - last_push_time if last_push_time > 0 else 0
+    snapshot = snapshot_cache.peek()
+    bot_running, subscriber_count = live_status()
     
     return jsonify({
         "status": "healthy",
         "timestamp": datetime.datetime.now().isoformat(),
-        "bot_running": telegram_app is not None,
-        "subscribers": len(subscribers),
+        "bot_running": bot_running,
+        "subscribers": subscriber_count,
         "push_task_active": push_task_active,
         "last_push_ago": f"{time_since_last_push:.0f}s" if last_push_time > 0 else "never",
-        "github_backup": GITHUB_TOKEN is not None and GIST_ID is not None
+        "snapshot_age": f"{snapshot.age():.0f}s" if snapshot else "none",
+        "http_pools": http_client.stats(),
+        "coalescing": request_coalescer.stats(),
+        "event_loop": loop_lag_monitor.stats(),
+        "upstreams": upstream_guard.stats(),
+        "fingerprints": dict(
+            upstream_fingerprints.stats(),
+            unchanged_refreshes=snapshot_cache.unchanged_refreshes,
+            memo={"hits": payload_memo.hits, "misses": payload_memo.misses},
+        ),
+        "analytics": {"metrics": len(rolling_analytics.stats()), "window": rolling_analytics.window},
+        "webhook_queue": webhook_queue.stats(),
+        "page_cache": {"hits": page_cache.hits, "misses": page_cache.misses, "not_modified": page_cache.not_modified},
+        "last_broadcast": last_broadcast_report,
+        "delivery_state": state_store.delivery_summary() if not snapshot_cache.follower else None,
+        "push_mode": PUSH_MODE,
+        "delta_push": {"sent": delta_push_tracker.sent, "skipped": delta_push_tracker.skipped},
+        "alerts": {"rules": len(alert_index.rules), "watched_metrics": len(alert_index.by_metric), "evaluations": alert_index.evaluations},
+        "github_backup": GITHUB_TOKEN is not None and GIST_ID is not None,
+        "gist_sync": gist_sync.stats(),
+        "startup": startup_timer.stats(),
+        "bot_ready": bot_ready.is_set(),
+        "bot_startup_failed": bot_startup_done.is_set() and not bot_ready.is_set(),
+        "worker": {
+            "mode": WORKER_MODE,
+            "pid": os.getpid(),
+            "leader": not snapshot_cache.follower,
+            "webhook_spooled": webhook_spool.spooled,
+            "webhook_consumed": webhook_spool.consumed,
+        },
     })
 
 @app.route('/api/yields')
 def api_yields():
     """API 端點返回 JSON 數據"""
     try:
-        data = get_dashboard_data()
-        if data:
-            return jsonify(data)
+        snapshot = snapshot_cache.get()
+        if snapshot:
+            # 內容只含過期旗標這項即時狀態，每個快照版本最多壓縮兩次
+            rendered = page_cache.get("api_yields", (snapshot.version, snapshot.age() > snapshot_cache.ttl),
+                                      lambda: render_yields_json(snapshot))
+            return serve_rendered(rendered, snapshot)
         else:
             return jsonify({"error": "Failed to fetch data"}), 500
     except Exception as e:
         logger.error(f"API endpoint error: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/funding')
+def api_funding():
+    """Hyperliquid 全市場資金費率排行：?limit=N&order=desc|asc"""
+    try:
+        snapshot = snapshot_cache.get()
+        table = snapshot.funding_table if snapshot else None
+        if table is None:
+            return jsonify({"error": "Funding data unavailable"}), 503
+        
+        limit = None
+        if "limit" in request.args:
+            limit = int(request.args["limit"])
+            if limit < 1:
+                raise ValueError("limit must be at least 1")
+            limit = min(limit, len(table.names))
+        descending = request.args.get("order", "desc") != "asc"
+        rows = table.rows(table.ranked(limit, descending=descending))
+        return jsonify({
+            "snapshot_version": snapshot.version,
+            "universe_size": int(table.active.sum()),
+            "order": "desc" if descending else "asc",
+            "assets": rows,
+        })
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query: {e}"}), 400
+    except Exception as e:
+        logger.error(f"Funding endpoint error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def parse_duration(text):
+    """解析 30m / 24h / 7d 形式的時間長度（秒）"""
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    text = text.strip().lower()
+    if text and text[-1] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
+
+@app.route('/api/history')
+def api_history():
+    """歷史資料查詢：?metric=a,b&range=24h 或 start/end（epoch 秒）&buckets=N"""
+    try:
+        metric_names = [m for value in request.args.getlist("metric") for m in value.split(",") if m]
+        if not metric_names:
+            return jsonify({"metrics": history_store.metrics()})
+        
+        now = time.time()
+        end = float(request.args.get("end", now))
+        if "start" in request.args:
+            start = float(request.args["start"])
+        else:
+            start = end - parse_duration(request.args.get("range", "24h"))
+        buckets = min(int(request.args.get("buckets", 200)), HISTORY_MAX_BUCKETS)
+        
+        series = {}
+        for name in metric_names:
+            result = query_history(name, start, end, buckets)
+            if result is not None:
+                series[name] = result
+        missing = [name for name in metric_names if name not in series]
+        
+        return jsonify({"start": start, "end": end, "buckets": buckets, "series": series, "missing": missing})
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query: {e}"}), 400
+    except Exception as e:
+        logger.error(f"History endpoint error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# === 請求計時 ===
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = getattr(g, "request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        ROUTE_LATENCY.observe(time.perf_counter() - started, route=route)
+        ROUTE_RESPONSES.inc(route=route, status=response.status_code)
+        elapsed = startup_timer.mark("first_byte")
+        if elapsed is not None:
+            level = logging.INFO if elapsed <= COLD_START_TTFB_TARGET else logging.WARNING
+            logger.log(level, f"First response ({route}) {elapsed:.2f}s after start (target {COLD_START_TTFB_TARGET:.2f}s)")
+    return response
+
+def _coalescing_totals():
+    stats = request_coalescer.stats()
+    return {(key, kind): stat[kind] for key, stat in stats.items() for kind in ("calls", "executions")}
+
+def _http_pool_totals():
+    return {(host, kind): stat[kind] for host, stat in http_client.stats().items() for kind in ("requests", "new_connections")}
+
+metrics_registry.callback("defi_subscribers", "Current subscriber count", lambda: live_status()[1])
+metrics_registry.callback(
+    "defi_snapshot_age_seconds", "Age of the current snapshot",
+    lambda: round(snapshot_cache.peek().age(), 3) if snapshot_cache.peek() else -1)
+metrics_registry.callback(
+    "defi_snapshot_cache_requests_total", "Snapshot cache lookups by result",
+    lambda: {("hit",): snapshot_cache.hits, ("stale",): snapshot_cache.stale_hits, ("miss",): snapshot_cache.misses},
+    ["result"], "counter")
+metrics_registry.callback(
+    "defi_page_cache_requests_total", "Pre-rendered page cache lookups by result",
+    lambda: {("hit",): page_cache.hits, ("miss",): page_cache.misses, ("not_modified",): page_cache.not_modified},
+    ["result"], "counter")
+metrics_registry.callback(
+    "defi_singleflight_total", "Single-flight calls and actual executions per key",
+    _coalescing_totals, ["key", "kind"], "counter")
+metrics_registry.callback(
+    "defi_http_pool_total", "Outbound HTTP requests and new connections per host",
+    _http_pool_totals, ["host", "kind"], "counter")
+metrics_registry.callback(
+    "defi_circuit_open", "1 while the upstream's circuit breaker is not closed",
+    lambda: {(source, ): int(stat["state"] != "closed") for source, stat in upstream_guard.stats().items()},
+    ["source"])
+metrics_registry.callback(
+    "defi_upstream_timeout_seconds", "Current adaptive timeout per upstream",
+    lambda: {(source, ): stat["timeout"] for source, stat in upstream_guard.stats().items()},
+    ["source"])
+metrics_registry.callback(
+    "defi_webhook_queue_depth", "Webhook updates waiting for a handler", lambda: webhook_queue.depth())
+metrics_registry.callback(
+    "defi_snapshot_unchanged_refreshes_total", "Refreshes that reused the previous snapshot because no upstream changed",
+    lambda: snapshot_cache.unchanged_refreshes, type_name="counter")
+metrics_registry.callback(
+    "defi_payload_memo_total", "Derived results reused from unchanged upstream payloads",
+    lambda: {("hit",): payload_memo.hits, ("miss",): payload_memo.misses}, ["result"], "counter")
+metrics_registry.callback(
+    "defi_event_loop_stalls_total", "Event loop stalls above the lag threshold",
+    lambda: loop_lag_monitor.stalls, type_name="counter")
+metrics_registry.callback(
+    "defi_alert_evaluations_total", "Alert rule evaluations",
+    lambda: alert_index.evaluations, type_name="counter")
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus 文字格式監控指標"""
+    return Response(metrics_registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+# === Webhook 接收佇列 ===
+class WebhookQueue:
+    """Flask 執行緒與 app_loop 之間的有界佇列
+
+    Flask 執行緒只檢查 update_id 是否重複與佇列是否已滿，接受的更新交給 app_loop 上
+    固定數量的 worker 解碼並處理，因此同時執行的處理數有上限、待處理的更新數也有上限。
+    佇列已滿或尚未啟動時回傳拒絕，由呼叫端回 503 讓 Telegram 稍後重送。
+    """
+
+    def __init__(self, maxsize=WEBHOOK_QUEUE_SIZE, concurrency=WEBHOOK_CONCURRENCY, dedupe_size=WEBHOOK_DEDUPE_SIZE):
+        self.maxsize = maxsize
+        self.concurrency = concurrency
+        self._seen = set()
+        self._seen_order = deque()
+        self._dedupe_size = dedupe_size
+        self._depth = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._loop = None
+        self._queue = None
+        self.max_depth = 0
+        self.results = {"queued": 0, "duplicate": 0, "overloaded": 0, "not_ready": 0, "handled": 0, "failed": 0}
+        self._latencies = deque(maxlen=500)
+
+    def start(self, loop):
+        """在 app_loop 上啟動 worker（需在 loop 執行緒呼叫）"""
+        self._queue = asyncio.Queue()
+        for i in range(self.concurrency):
+            loop.create_task(self._worker())
+        self._loop = loop
+        logger.info(f"Webhook queue started ({self.concurrency} workers, capacity {self.maxsize})")
+
+    def _count(self, result):
+        self.results[result] += 1
+        WEBHOOK_UPDATES.inc(result=result)
+
+    def submit(self, data):
+        """接收一個更新（任何執行緒皆可呼叫），回傳 queued / duplicate / overloaded / not_ready"""
+        update_id = data.get("update_id")
+        with self._lock:
+            if self._loop is None:
+                result = "not_ready"
+            elif update_id is not None and update_id in self._seen:
+                result = "duplicate"
+            elif self._depth >= self.maxsize:
+                result = "overloaded"
+            else:
+                result = "queued"
+                self._depth += 1
+                self.max_depth = max(self.max_depth, self._depth)
+                if update_id is not None:
+                    self._seen.add(update_id)
+                    self._seen_order.append(update_id)
+                    if len(self._seen_order) > self._dedupe_size:
+                        self._seen.discard(self._seen_order.popleft())
+            self._count(result)
+        if result == "queued":
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, (time.perf_counter(), data))
+        return result
+
+    async def _worker(self):
+        while True:
+            queued_at, data = await self._queue.get()
+            with self._lock:
+                self._depth -= 1
+                self._in_flight += 1
+            started = time.perf_counter()
+            WEBHOOK_QUEUE_WAIT.observe(started - queued_at)
+            try:
+                update = telegram.Update.de_json(data, telegram_app.bot)
+                await telegram_app.process_update(update)
+                result = "handled"
+            except Exception as e:
+                logger.error(f"Webhook update {data.get('update_id')} failed: {e}")
+                result = "failed"
+            elapsed = time.perf_counter() - started
+            WEBHOOK_HANDLER_LATENCY.observe(elapsed)
+            with self._lock:
+                self._in_flight -= 1
+                self._latencies.append(elapsed)
+                self._count(result)
+
+    def depth(self):
+        return self._depth
+
+    def stats(self):
+        with self._lock:
+            latencies = list(self._latencies)
+            return dict(
+                self.results,
+                depth=self._depth,
+                max_depth=self.max_depth,
+                in_flight=self._in_flight,
+                capacity=self.maxsize,
+                concurrency=self.concurrency,
+                handler_p50_ms=round(percentile(latencies, 50) * 1000, 1),
+                handler_p95_ms=round(percentile(latencies, 95) * 1000, 1),
+            )
+
+webhook_queue = WebhookQueue()
+
 # === Webhook 處理 ===
 @app.route(WEBHOOK_PATH, methods=['POST'])
 def webhook():
-    """處理 Telegram webhook"""
+    """處理 Telegram webhook：只做去重與容量檢查，處理交給 webhook_queue"""
     try:
         data = request.get_json(force=True)
-        if telegram_app and app_loop:
-            update = Update.de_json(data, telegram_app.bot)
-            asyncio.run_coroutine_threadsafe(
-                telegram_app.process_update(update),
-                app_loop
-            )
-        return jsonify({"status": "ok"})
+        if snapshot_cache.follower:
+            webhook_spool.put(data)
+            return jsonify({"status": "ok"})
+        if not bot_ready.is_set():
+            # 只在初始化進行中等待；初始化失敗後立即回應，不讓每個請求都卡滿逾時
+            bot_startup_done.wait(WEBHOOK_READY_TIMEOUT)
+            if not bot_ready.is_set():
+                error = "Bot unavailable" if bot_startup_done.is_set() else "Bot is starting"
+                return jsonify({"error": error}), 503, {"Retry-After": "1"}  # Telegram 會重送
+        result = webhook_queue.submit(data)
+        if result in ("overloaded", "not_ready"):
+            return jsonify({"error": result}), 503, {"Retry-After": "1"}
+        return jsonify({"status": result})
     except Exception as e:
         logger.error(f"Webhook error: {e}")
         return jsonify({"error": str(e)}), 500
@@ -806,10 +4602,11 @@ def setup_webhook():
     logger.info(f"Setting Telegram Webhook: {webhook_url}")
     
     try:
-        response = requests.post(
-            f"https://api.telegram.org/bot{BOT_TOKEN}/setWebhook",
+        response = http_client.post(
+            f"{TELEGRAM_API_URL}/bot{BOT_TOKEN}/setWebhook",
             json={"url": webhook_url},
-            timeout=10
+            timeout=10,
+            source="telegram"
         )
         result = response.json()
         if result.get("ok"):
@@ -833,13 +4630,24 @@ async def setup_telegram():
     
     try:
         logger.info("Initializing Telegram application...")
-        telegram_app = ApplicationBuilder().token(BOT_TOKEN).build()
+        from telegram.ext import ApplicationBuilder, CommandHandler
+        
+        telegram_app = ApplicationBuilder().token(BOT_TOKEN).base_url(f"{TELEGRAM_API_URL}/bot").build()
         app_loop = asyncio.get_running_loop()
         
         # 註冊指令處理器
         telegram_app.add_handler(CommandHandler("start", handle_start))
         telegram_app.add_handler(CommandHandler("stop", handle_stop))
         telegram_app.add_handler(CommandHandler("check", handle_check))
+        telegram_app.add_handler(CommandHandler("watch", handle_watch))
+        telegram_app.add_handler(CommandHandler("unwatch", handle_unwatch))
+        telegram_app.add_handler(CommandHandler("watchlist", handle_watchlist))
+        telegram_app.add_handler(CommandHandler("alert", handle_alert))
+        telegram_app.add_handler(CommandHandler("alerts", handle_alerts))
+        telegram_app.add_handler(CommandHandler("delalert", handle_delalert))
+        telegram_app.add_handler(CommandHandler("markets", handle_markets))
+        telegram_app.add_handler(CommandHandler("addmarket", handle_addmarket))
+        telegram_app.add_handler(CommandHandler("removemarket", handle_removemarket))
         
         await telegram_app.initialize()
         await telegram_app.start()
@@ -858,13 +4666,23 @@ def run_async_loop():
     
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
+    loop.set_default_executor(loop_io_executor)
     app_loop = loop
     
     try:
+        loop.create_task(loop_lag_monitor.run())
+        loop.create_task(gist_sync.revalidate())  # 訂閱者集合只在 loop 上修改
+        
         # 設定 Telegram 應用程式
         success = loop.run_until_complete(setup_telegram())
         
         if success:
+            webhook_queue.start(loop)
+            bot_ready.set()
+            bot_startup_done.set()
+            elapsed = startup_timer.mark("bot_ready")
+            logger.info(f"Telegram bot ready {elapsed}s after start")
+            
             # 初始化推播时间
             last_push_time = time.time()
             
@@ -872,7 +4690,11 @@ def run_async_loop():
             loop.create_task(auto_push_task())
             logger.info("Auto push task scheduled")
             
+            if WORKER_MODE == "multi":
+                loop.create_task(webhook_spool.consume())
+            
         else:
+            bot_startup_done.set()
             logger.error("Telegram setup failed, web service only")
         
         # 保持 loop 運行
@@ -880,8 +4702,66 @@ def run_async_loop():
     except Exception as e:
         logger.error(f"Asyncio loop error: {e}")
     finally:
+        bot_startup_done.set()
         loop.close()
 
+def register_webhook():
+    app_url = get_app_url()
+    if setup_webhook():
+        startup_timer.mark("webhook_registered")
+        print(f"✅ Telegram webhook setup successful: {app_url}{WEBHOOK_PATH}")
+    else:
+        print("❌ Telegram webhook setup failed")
+
+def start_background_services():
+    """載入狀態並啟動快照刷新、Telegram Bot 與 webhook（單一程序或多 worker 的 leader）
+
+    在埠綁定之後於背景執行；webhook 註冊與 Bot 初始化同時進行，Bot 就緒時設定 bot_ready。
+    """
+    global subscribers
+    
+    warm_lazy_imports()
+    
+    # webhook 註冊不依賴 Bot 初始化，先送出
+    threading.Thread(target=register_webhook, name="webhook-setup", daemon=True).start()
+    
+    # 載入訂閱者與偏好設定
+    subscribers = load_subscribers()
+    print(f"📋 Loaded {len(subscribers)} subscribers from persistent storage")
+    load_preferences()
+    
+    # 載入磁碟上的歷史資料，並以此預先填入滾動統計
+    disk_history.warm(history_store)
+    rolling_analytics.seed(history_store)
+    
+    # 啟動共享快照背景刷新（先以上次保存的快照提供服務）
+    snapshot_cache.start()
+    
+    # 在背景啟動 asyncio loop (Telegram bot)
+    async_thread = threading.Thread(target=run_async_loop, name="telegram-loop", daemon=True)
+    async_thread.start()
+    print("🔄 Telegram background tasks started")
+
+def become_leader():
+    """取得 leader 鎖後接手：沿用共享快照、重新載入前任 leader 保存的狀態並啟動背景服務"""
+    snapshot_cache.promote()
+    start_background_services()
+
+def start_worker():
+    """gunicorn worker 啟動（由 gunicorn.conf.py 的 post_worker_init 呼叫）"""
+    global leader_election
+    
+    if WORKER_MODE != "multi" or fcntl is None:
+        if WORKER_MODE == "multi":
+            logger.error("WORKER_MODE=multi needs fcntl file locks, running this worker standalone")
+        become_leader()
+        return
+    
+    snapshot_cache.follower = True
+    leader_election = LeaderElection(LEADER_LOCK_FILE, become_leader)
+    leader_election.start()
+    logger.info(f"Worker {os.getpid()} started as follower")
+
 def main():
     """主程序 - Render 雲端版"""
     global subscribers
@@ -895,10 +4775,6 @@ def main():
     print("Features: Dashboard + Auto Push + Persistent Subscribers")
     print("Tracking assets: BTC, ETH, HYPE, BNB, SOL, AAVE, SUI, ENA, DOGE, PENDLE")
     
-    # 載入訂閱者（多重來源）
-    subscribers = load_subscribers()
-    print(f"📋 Loaded {len(subscribers)} subscribers from persistent storage")
-    
     # 顯示備份狀態
     if GITHUB_TOKEN:
         if GIST_ID:
@@ -908,22 +4784,20 @@ def main():
     else:
         print("ℹ️ GitHub Gist backup: DISABLED (GITHUB_TOKEN not set)")
     
-    # 在背景啟動 asyncio loop (Telegram bot)
-    async_thread = threading.Thread(target=run_async_loop, daemon=True)
-    async_thread.start()
-    print("🔄 Telegram background tasks started")
+    # 關機時先寫入尚未保存的訂閱者變更
+    def handle_shutdown(signum, frame):
+        logger.info(f"Received signal {signum}, flushing subscribers before exit")
+        subscriber_persistence.stop()
+        sys.exit(0)
     
-    # 等待 Telegram 應用程式初始化
-    time.sleep(3)
+    signal.signal(signal.SIGTERM, handle_shutdown)
     
-    # 設定 webhook
-    app_url = get_app_url()
-    if setup_webhook():
-        print(f"✅ Telegram webhook setup successful: {app_url}{WEBHOOK_PATH}")
-    else:
-        print("❌ Telegram webhook setup failed")
+    # 先綁定埠，其餘初始化在背景進行
+    server = make_server("0.0.0.0", PORT, app, threaded=True)
+    logger.info(f"Listening on port {PORT} {startup_timer.mark('port_bound')}s after start")
+    threading.Thread(target=start_background_services, name="startup", daemon=True).start()
     
-    # 啟動 Flask 應用程式
+    app_url = get_app_url()
     print(f"🌐 Dashboard URL: {app_url}")
     print(f"❤️ Health check: {app_url}/health")
     print("")
@@ -936,7 +4810,7 @@ def main():
     print("   ✓ Persistent subscribers across deployments")
     
     try:
-        app.run(host="0.0.0.0", port=PORT, debug=False)
+        server.serve_forever()
     except KeyboardInterrupt:
         print("\n👋 Dashboard stopped")
 
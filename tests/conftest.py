@@ -0,0 +1,53 @@
+# tests/conftest.py - 共用設定
+"""所有檔案路徑指向暫存目錄後才匯入 main，測試不寫入工作目錄"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+TEST_DIR = tempfile.mkdtemp(prefix="defi-dashboard-tests-")
+for name, value in {
+    "STATE_DB": "state.db",
+    "LEADER_LOCK_FILE": "leader.lock",
+    "SHARED_SNAPSHOT_FILE": "snapshot.shared",
+    "WEBHOOK_SPOOL_DIR": "webhook-spool",
+    "GIST_CACHE_FILE": "gist_cache.json",
+}.items():
+    os.environ.setdefault(name, os.path.join(TEST_DIR, value))
+os.environ.setdefault("HISTORY_DIR", "")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+def hyperliquid_contexts(rates, delisted=()):
+    """合成的 metaAndAssetCtxs 回應：資產名稱 -> 每小時資金費率"""
+    universe = [{"name": name, "isDelisted": name in delisted} for name in rates]
+    asset_contexts = [
+        {"funding": str(rate), "premium": "0.0", "openInterest": "10.0", "markPx": "2.0"}
+        for rate in rates.values()
+    ]
+    return [{"universe": universe}, asset_contexts]
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """以固定的上游結果取代網路擷取；回傳的 dict 可替換 payload"""
+    payloads = {"hyperliquid": hyperliquid_contexts({"BTC": 0.0001, "ETH": -0.00002, "SOL": 0.00005})}
+    monkeypatch.setattr(main, "fetch_all_upstreams", lambda *args, **kwargs: main.UpstreamResults(payloads))
+    return payloads
+
+@pytest.fixture
+def app_state(monkeypatch, upstream):
+    """全新的快照快取、頁面快取與滾動統計，且不追蹤任何 Pendle 市場"""
+    monkeypatch.setattr(main, "market_registry", main.MarketRegistry(os.path.join(TEST_DIR, "markets.json")))
+    monkeypatch.setattr(main, "rolling_analytics", main.RollingAnalytics())
+    monkeypatch.setattr(main, "history_store", main.HistoryStore(sample_interval=0))
+    monkeypatch.setattr(main, "page_cache", main.PageCache())
+    monkeypatch.setattr(main, "snapshot_cache", main.SnapshotCache())
+    return main.snapshot_cache
+
+@pytest.fixture
+def client():
+    return main.app.test_client()
@@ -0,0 +1,75 @@
+# tests/test_alerts.py - 警示規則解析、評估與保存
+import pytest
+
+import main
+
+METRICS = {
+    "pendle.fGHO.implied_apy": 8.0,
+    "pendle.fGHO.underlying_apy": 10.0,
+    "hyperliquid.ETH.funding_apr": 12.0,
+}
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = main.StateStore(str(tmp_path / "state.db"))
+    monkeypatch.setattr(main, "state_store", store)
+    monkeypatch.setattr(main, "subscriber_persistence", main.SubscriberPersistence(delay=60, max_delay=60))
+    return store
+
+@pytest.mark.parametrize("args, expected", [
+    (["ETH", "funding", ">", "30"], ("hyperliquid.ETH.funding_apr", ">", 30.0)),
+    (["fGHO", "implied", "<", "fGHO", "underlying"], ("pendle.fGHO.implied_apy", "<", "pendle.fGHO.underlying_apy")),
+    (["fGHO", "implied", "<", "underlying"], ("pendle.fGHO.implied_apy", "<", "pendle.fGHO.underlying_apy")),
+    (["fgho", "implied", "apy", ">=", "5%"], ("pendle.fGHO.implied_apy", ">=", 5.0)),
+])
+def test_parse_alert_args(args, expected):
+    assert main.parse_alert_args(args, METRICS.keys()) == expected
+
+@pytest.mark.parametrize("args", [["ETH", "funding", "30"], ["XYZ", ">", "1"], ["ETH", "funding", ">", "nothing"]])
+def test_parse_alert_args_rejects(args):
+    with pytest.raises(ValueError):
+        main.parse_alert_args(args, METRICS.keys())
+
+def test_evaluate_fires_on_false_to_true_only(store):
+    index = main.AlertIndex()
+    rule = index.add(1, "hyperliquid.ETH.funding_apr", ">", 20.0, metrics=METRICS)
+    assert rule.triggered is False
+    
+    key = {"hyperliquid.ETH.funding_apr"}
+    assert index.evaluate(key, dict(METRICS, **{"hyperliquid.ETH.funding_apr": 25.0})) == [(rule, 25.0)]
+    assert index.evaluate(key, dict(METRICS, **{"hyperliquid.ETH.funding_apr": 26.0})) == []
+    assert index.evaluate({"pendle.fGHO.implied_apy"}, METRICS) == []  # 不相關的指標不評估
+    assert index.evaluations == 2
+
+def test_triggered_state_survives_restart(store, monkeypatch):
+    index = main.AlertIndex()
+    monkeypatch.setattr(main, "alert_index", index)
+    rule = index.add(7, "pendle.fGHO.implied_apy", "<", "pendle.fGHO.underlying_apy", metrics={})
+    main.subscriber_persistence.record("preferences", 7)
+    index.evaluate(set(METRICS), METRICS)
+    main.subscriber_persistence.flush()
+    
+    (saved,) = store.load_alerts()
+    assert saved["id"] == rule.rule_id and saved["triggered"] is True
+    
+    restored = main.AlertIndex()
+    restored.add(saved["chat_id"], saved["left"], saved["op"], saved["right"],
+                 rule_id=saved["id"], triggered=saved["triggered"])
+    assert restored.evaluate(set(METRICS), METRICS) == []
+
+def test_recorded_preferences_are_not_changed_by_later_evaluation(store, monkeypatch):
+    index = main.AlertIndex()
+    monkeypatch.setattr(main, "alert_index", index)
+    index.add(9, "hyperliquid.ETH.funding_apr", ">", 20.0, metrics=METRICS)
+    main.subscriber_persistence.record("preferences", 9)
+    (_, _, (_, rules)), = main.subscriber_persistence._events
+    index.evaluate({"hyperliquid.ETH.funding_apr"}, dict(METRICS, **{"hyperliquid.ETH.funding_apr": 25.0}))
+    assert rules[0].triggered is False
+
+def test_count_and_remove_chat():
+    index = main.AlertIndex()
+    for value in (1.0, 2.0):
+        index.add(3, "hyperliquid.ETH.funding_apr", ">", value)
+    assert index.count_for_chat(3) == 2 and index.chat_ids() == {3}
+    index.remove_chat(3)
+    assert index.count_for_chat(3) == 0 and not index.rules and not index.by_metric
@@ -0,0 +1,32 @@
+# tests/test_analytics.py - 滾動統計
+import math
+
+import pytest
+
+import main
+
+def test_no_arrays_until_first_sample():
+    analytics = main.RollingAnalytics()
+    assert analytics._values is None
+    assert analytics.update({}) == {}
+
+def test_window_stats_and_growth():
+    analytics = main.RollingAnalytics(window=4, ema_span=3, min_samples=2)
+    keys = [f"hyperliquid.A{i}.funding_apr" for i in range(40)]  # 超過初始容量
+    for value in (1.0, 2.0, 3.0, 4.0, 5.0):
+        stats = analytics.update({key: value for key in keys})
+    last = stats[keys[-1]]
+    assert last.count == 4
+    assert last.mean == pytest.approx(3.5)
+    assert last.stdev == pytest.approx(math.sqrt(1.25))
+    assert last.zscore == pytest.approx(1.5 / math.sqrt(1.25))
+    assert last.ema == pytest.approx(4.0625)
+    assert last.percentile is None  # 只有價差指標有百分位
+
+def test_constant_metric_has_no_zscore():
+    analytics = main.RollingAnalytics(window=8, min_samples=2)
+    for _ in range(10):
+        stats = analytics.update({"pendle.fGHO.spread": 0.1})
+    assert stats["pendle.fGHO.spread"].stdev == 0.0
+    assert stats["pendle.fGHO.spread"].zscore is None
+    assert stats["pendle.fGHO.spread"].percentile == pytest.approx(50.0)
@@ -0,0 +1,45 @@
+# tests/test_broadcast.py - 推播引擎的錯誤處理
+import asyncio
+import time
+
+import telegram
+
+import main
+
+class FakeBot:
+    """依 chat_id 回傳預先排定的錯誤，記錄每次發送的時間"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        queued = self.errors.get(chat_id)
+        if queued:
+            raise queued.pop(0)
+        self.sent.append((chat_id, time.monotonic()))
+
+def broadcast(bot, chat_ids):
+    engine = main.BroadcastEngine(concurrency=4, rate=1000, burst=1000)
+    return asyncio.run(engine.broadcast(bot, chat_ids, "hi"))
+
+def test_migrated_chat_is_recorded_under_new_id():
+    bot = FakeBot({1: [telegram.error.ChatMigrated(100)]})
+    report = broadcast(bot, [1, 2])
+    assert report["migrated"] == {1: 100}
+    assert sorted(report["outcomes"]) == [(2, "sent", None), (100, "sent", None)]
+
+def test_retry_after_pauses_every_chat():
+    bot = FakeBot({1: [telegram.error.RetryAfter(1)]})
+    started = time.monotonic()
+    report = broadcast(bot, [1, 2, 3, 4, 5, 6])
+    assert report["retry_after"] == 1 and report["sent"] == 6
+    # 其他 chat 在 429 之後送出的訊息也等到暫停結束
+    late = [sent_at - started for chat_id, sent_at in bot.sent if chat_id in (1, 6)]
+    assert min(late) >= 1.0
+
+def test_permanent_error_evicts_chat():
+    bot = FakeBot({3: [telegram.error.Forbidden("bot was blocked by the user")]})
+    report = broadcast(bot, [3, 4])
+    assert report["evicted"] == [3]
+    assert (3, "evicted", "bot was blocked by the user") in report["outcomes"]
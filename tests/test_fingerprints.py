@@ -0,0 +1,55 @@
+# tests/test_fingerprints.py - 上游回應指紋與條件式請求
+import json
+
+import main
+
+class FakeResponse:
+    def __init__(self, status_code, body=b"", headers=None):
+        self.status_code = status_code
+        self.content = body
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(self.status_code)
+
+class FakeClient:
+    """依序回傳排定的回應，記錄每次請求的 headers"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, headers=None, timeout=None, **kwargs):
+        self.requests.append(dict(headers or {}))
+        return self.responses.pop(0)
+
+def request(fingerprints):
+    return fingerprints.request_json("test", "GET", "https://upstream.test/data", 5)
+
+def test_not_modified_reuses_previous_payload(monkeypatch):
+    client = FakeClient(FakeResponse(200, b'{"a": 1}', {"ETag": '"v1"'}), FakeResponse(304))
+    monkeypatch.setattr(main, "http_client", client)
+    fingerprints = main.UpstreamFingerprints()
+    first = request(fingerprints)
+    assert request(fingerprints) is first
+    assert client.requests[1]["If-None-Match"] == '"v1"'
+    assert fingerprints.stats()["test"]["not_modified"] == 1
+
+def test_identical_body_reuses_previous_payload(monkeypatch):
+    client = FakeClient(FakeResponse(200, b'{"a": 1}'), FakeResponse(200, b'{"a": 1}'), FakeResponse(200, b'{"a": 2}'))
+    monkeypatch.setattr(main, "http_client", client)
+    fingerprints = main.UpstreamFingerprints()
+    first = request(fingerprints)
+    assert request(fingerprints) is first
+    assert request(fingerprints) == {"a": 2}
+
+def test_unexpected_not_modified_refetches_unconditionally(monkeypatch):
+    client = FakeClient(FakeResponse(304), FakeResponse(200, b'{"a": 1}', {"ETag": '"v1"'}))
+    monkeypatch.setattr(main, "http_client", client)
+    assert request(main.UpstreamFingerprints()) == {"a": 1}
+    assert all("If-None-Match" not in headers for headers in client.requests)
+    assert len(client.requests) == 2
@@ -0,0 +1,46 @@
+# tests/test_funding.py - Hyperliquid 全市場資金費率表與 /api/funding
+import pytest
+
+import main
+from conftest import hyperliquid_contexts
+
+RATES = {"BTC": 0.0001, "ETH": -0.00002, "SOL": 0.00005, "DOGE": 0.0002}
+
+def test_table_parses_rates_and_ranks():
+    table = main.FundingUniverse().table(hyperliquid_contexts(RATES))
+    assert table.rates_for(["BTC", "eth"]) == {"BTC": 0.0001, "eth": -0.00002}
+    assert [row["asset"] for row in table.rows(table.ranked())] == ["DOGE", "BTC", "SOL", "ETH"]
+    assert [row["asset"] for row in table.rows(table.ranked(2, descending=False))] == ["ETH", "SOL"]
+    assert table.rows(table.ranked(1))[0]["open_interest_usd"] == 20.0
+
+def test_same_response_is_parsed_once():
+    universe = main.FundingUniverse()
+    contexts = hyperliquid_contexts(RATES)
+    assert universe.table(contexts) is universe.table(contexts)
+
+def test_delisting_with_same_names_is_picked_up():
+    universe = main.FundingUniverse()
+    assert universe.table(hyperliquid_contexts(RATES)).screener()["universe_size"] == 4
+    table = universe.table(hyperliquid_contexts(RATES, delisted={"DOGE"}))
+    assert table.screener()["universe_size"] == 3
+    assert "DOGE" not in [row["asset"] for row in table.rows(table.ranked())]
+
+@pytest.fixture
+def funding_app(app_state, upstream):
+    upstream["hyperliquid"] = hyperliquid_contexts(RATES)
+    app_state.refresh()
+
+@pytest.mark.parametrize("query, assets", [
+    ("", ["DOGE", "BTC", "SOL", "ETH"]),
+    ("?limit=2", ["DOGE", "BTC"]),
+    ("?limit=2&order=asc", ["ETH", "SOL"]),
+    ("?limit=1000", ["DOGE", "BTC", "SOL", "ETH"]),
+])
+def test_api_funding_limit(funding_app, client, query, assets):
+    response = client.get(f"/api/funding{query}")
+    assert response.status_code == 200
+    assert [row["asset"] for row in response.get_json()["assets"]] == assets
+
+@pytest.mark.parametrize("limit", ["0", "-3", "abc"])
+def test_api_funding_rejects_bad_limit(funding_app, client, limit):
+    assert client.get(f"/api/funding?limit={limit}").status_code == 400
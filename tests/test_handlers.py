@@ -0,0 +1,39 @@
+# tests/test_handlers.py - Telegram 指令處理
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+class FakeMessage:
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text):
+        self.replies.append(text)
+
+def run_command(handler, chat_id=5, args=()):
+    message = FakeMessage()
+    update = SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id), message=message)
+    asyncio.run(handler(update, SimpleNamespace(args=list(args))))
+    return message.replies
+
+@pytest.fixture
+def no_snapshot(monkeypatch):
+    async def get_async():
+        return None
+    monkeypatch.setattr(main.snapshot_cache, "get_async", get_async)
+
+@pytest.mark.parametrize("handler, args", [
+    (main.handle_check, ()),
+    (main.handle_watch, ("ETH",)),
+    (main.handle_alert, ("ETH", "funding", ">", "30")),
+])
+def test_commands_before_first_snapshot(no_snapshot, handler, args):
+    assert run_command(handler, args=args) == [main.DATA_LOADING_MESSAGE]
+    assert 5 not in main.watchlists
+
+def test_watchlist_before_first_snapshot(no_snapshot, monkeypatch):
+    monkeypatch.setitem(main.watchlists, 5, {"eth"})
+    assert run_command(main.handle_watchlist) == ["Watchlist:\n• No data yet"]
@@ -0,0 +1,29 @@
+# tests/test_lazy_import.py - 延遲載入
+import sys
+import threading
+
+import main
+
+def test_concurrent_first_access_sees_loaded_module(monkeypatch):
+    monkeypatch.delitem(sys.modules, "colorsys", raising=False)
+    module = main.LazyModule("colorsys")
+    barrier = threading.Barrier(8)
+    results, errors = [], []
+    
+    def touch():
+        barrier.wait()
+        try:
+            results.append(module.rgb_to_hsv(1.0, 0.0, 0.0))
+        except Exception as e:
+            errors.append(e)
+    
+    threads = [threading.Thread(target=touch) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert results == [(0.0, 1.0, 1.0)] * 8
+
+def test_lazy_import_returns_loaded_module():
+    assert main.lazy_import("json") is sys.modules["json"]
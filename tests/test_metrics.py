@@ -0,0 +1,19 @@
+# tests/test_metrics.py - Prometheus 文字格式輸出
+import os
+
+import main
+
+def test_labels_are_escaped():
+    assert main._format_labels(["route"], ['a"b\\c\nd']) == '{route="a\\"b\\\\c\\nd"}'
+
+def test_follower_reports_leader_subscriber_count(monkeypatch, client):
+    monkeypatch.setattr(main.snapshot_cache, "follower", True)
+    monkeypatch.setattr(main.shared_snapshot, "read", lambda: (None, {"bot_running": True, "subscriber_count": 42}))
+    assert "\ndefi_subscribers 42\n" in client.get("/metrics").get_data(as_text=True)
+
+def test_multi_worker_samples_carry_worker_label(monkeypatch, client):
+    monkeypatch.setattr(main, "WORKER_MODE", "multi")
+    body = client.get("/metrics").get_data(as_text=True)
+    worker = f'worker="{os.getpid()}"'
+    samples = [line for line in body.splitlines() if line and not line.startswith("#")]
+    assert samples and all(worker in line for line in samples)
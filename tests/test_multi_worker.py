@@ -0,0 +1,60 @@
+# tests/test_multi_worker.py - 多 worker 模式的 leader 選舉與 webhook 暫存
+import os
+import threading
+
+import pytest
+
+import main
+
+needs_fcntl = pytest.mark.skipif(main.fcntl is None, reason="fcntl 僅在 POSIX 平台可用")
+
+@needs_fcntl
+def test_only_one_leader_holds_the_lock(tmp_path):
+    path = str(tmp_path / "leader.lock")
+    first = main.LeaderElection(path, lambda: None)
+    second = main.LeaderElection(path, lambda: None)
+    assert first.try_acquire() is True
+    assert first.is_leader and first.elected_at is not None
+    assert second.try_acquire() is False
+    assert not second.is_leader
+    with open(path) as f:
+        assert f.read().strip() == str(os.getpid())
+    os.close(first._fd)  # 模擬 leader 程序結束
+    assert second.try_acquire() is True
+    os.close(second._fd)
+
+@needs_fcntl
+def test_waiting_worker_is_elected_after_leader_exits(tmp_path):
+    path = str(tmp_path / "leader.lock")
+    leader = main.LeaderElection(path, lambda: None)
+    assert leader.try_acquire()
+    elected = threading.Event()
+    follower = main.LeaderElection(path, elected.set, interval=0.01)
+    follower.start()
+    assert not elected.wait(0.1)
+    os.close(leader._fd)
+    assert elected.wait(5)
+    assert follower.is_leader
+    os.close(follower._fd)
+
+def test_spool_drains_in_update_id_order(tmp_path):
+    spool = main.WebhookSpool(str(tmp_path / "spool"))
+    for update_id in (12, 3, 7):
+        spool.put({"update_id": update_id, "message": {"text": f"/check {update_id}"}})
+    assert spool.spooled == 3
+    assert [data["update_id"] for data in spool.drain()] == [3, 7, 12]
+    assert os.listdir(spool.directory) == []
+    assert spool.drain() == []
+
+def test_spool_missing_directory_is_empty(tmp_path):
+    assert main.WebhookSpool(str(tmp_path / "missing")).drain() == []
+
+def test_spool_discards_unreadable_files(tmp_path):
+    spool = main.WebhookSpool(str(tmp_path / "spool"))
+    spool.put({"update_id": 5})
+    with open(os.path.join(spool.directory, "000000000001-0-0.json"), "w") as f:
+        f.write("{not json")
+    with open(os.path.join(spool.directory, ".partial.json.tmp"), "w") as f:
+        f.write("{")
+    assert spool.drain() == [{"update_id": 5}]
+    assert os.listdir(spool.directory) == [".partial.json.tmp"]
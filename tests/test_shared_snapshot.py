@@ -0,0 +1,63 @@
+# tests/test_shared_snapshot.py - 多 worker 共享快照檔案
+from dataclasses import dataclass
+
+import numpy as np
+import pytest
+
+import main
+
+@pytest.fixture
+def shared_file(tmp_path):
+    return main.SharedSnapshotFile(str(tmp_path / "snapshot.shared"))
+
+def test_round_trip(app_state, shared_file):
+    snapshot = app_state.refresh()
+    status = {"bot_running": True, "subscriber_count": 3, "leader_pid": 1}
+    shared_file.write(snapshot, status)
+    
+    restored, restored_status = main.SharedSnapshotFile(shared_file.path).read()
+    assert restored_status == status
+    assert restored.version == snapshot.version
+    assert restored.created_at == snapshot.created_at
+    assert restored.data == snapshot.data
+    assert restored.message == snapshot.message
+    assert restored.metrics == snapshot.metrics
+    assert restored.analytics == snapshot.analytics
+    assert restored.yields_json == snapshot.yields_json
+    table, original = restored.funding_table, snapshot.funding_table
+    assert table.index == original.index
+    assert list(table.names) == list(original.names)
+    np.testing.assert_array_equal(table.funding_apr, original.funding_apr)
+    np.testing.assert_array_equal(table.active, original.active)
+
+def test_other_magic_is_ignored(app_state, shared_file):
+    shared_file.write(app_state.refresh(), {})
+    with open(shared_file.path, "r+b") as f:
+        f.write(b"DFSNAP03")
+    assert main.SharedSnapshotFile(shared_file.path).read() == (None, None)
+
+def test_fingerprint_follows_field_list():
+    @dataclass
+    class Row:
+        name: str
+        value: float
+    
+    before = main.SnapshotCodec((Row,)).fingerprint
+    
+    @dataclass
+    class Row:  # noqa: F811 - 同名但欄位換序
+        value: float
+        name: str
+    
+    assert main.SnapshotCodec((Row,)).fingerprint != before
+
+def test_schema_change_is_ignored(app_state, shared_file, monkeypatch):
+    shared_file.write(app_state.refresh(), {})
+    monkeypatch.setattr(main.snapshot_codec, "fingerprint", b"\0" * 8)
+    assert main.SharedSnapshotFile(shared_file.path).read() == (None, None)
+
+def test_unknown_types_are_rejected():
+    with pytest.raises(TypeError):
+        main.snapshot_codec.encode(object())
+    with pytest.raises(ValueError):
+        main.snapshot_codec.decode({"t": "os.system", "v": ["true"]})
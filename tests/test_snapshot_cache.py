@@ -0,0 +1,84 @@
+# tests/test_snapshot_cache.py - 快照建立、沿用與條件式請求
+import datetime
+import json
+
+import main
+from conftest import hyperliquid_contexts
+
+def test_unchanged_upstreams_reuse_snapshot_data(app_state):
+    first = app_state.refresh()
+    second = app_state.refresh()
+    assert second.data is first.data
+    assert app_state.unchanged_refreshes == 1
+
+def test_analytics_only_refresh_bumps_version(app_state):
+    first = app_state.refresh()
+    second = app_state.refresh()
+    assert second.version == first.version + 1
+    assert second.yields_json != first.yields_json
+    updated_at = datetime.datetime.fromtimestamp(second.created_at).isoformat(timespec="seconds")
+    assert json.loads(second.yields_json)["snapshot_updated_at"] == updated_at
+
+def test_changed_upstream_rebuilds_data(app_state, upstream):
+    first = app_state.refresh()
+    upstream["hyperliquid"] = hyperliquid_contexts({"BTC": 0.0003})
+    second = app_state.refresh()
+    assert second.data is not first.data
+
+def test_yields_not_modified_until_analytics_change(app_state, client):
+    app_state.refresh()
+    first = client.get("/api/yields")
+    assert first.status_code == 200
+    headers = {"If-Modified-Since": first.headers["Last-Modified"]}
+    assert client.get("/api/yields", headers=headers).status_code == 304
+    assert client.get("/api/yields", headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+    
+    app_state.refresh()  # 上游未變、只有統計更新
+    after = client.get("/api/yields", headers=headers)
+    assert after.status_code == 200
+    assert after.headers["ETag"] != first.headers["ETag"]
+    assert client.get("/api/yields", headers={"If-None-Match": first.headers["ETag"]}).status_code == 200
+
+def test_dashboard_last_modified_advances_with_live_status(app_state, client):
+    app_state.refresh()
+    first = client.get("/")
+    headers = {"If-Modified-Since": first.headers["Last-Modified"]}
+    assert client.get("/", headers=headers).status_code == 304
+    main.subscribers.add(-1001)
+    try:
+        assert client.get("/", headers=headers).status_code == 200
+    finally:
+        main.subscribers.discard(-1001)
+
+def test_yields_payload_reports_staleness(app_state, client, monkeypatch):
+    snapshot = app_state.refresh()
+    body = client.get("/api/yields").get_json()
+    assert body["stale"] is False
+    assert body["snapshot_version"] == snapshot.version
+    assert "generated_at" in body and "snapshot_updated_at" in body
+    
+    monkeypatch.setattr(app_state, "ttl", -1)
+    monkeypatch.setattr(app_state, "_revalidate", lambda: None)
+    assert client.get("/api/yields").get_json()["stale"] is True
+
+def test_market_registry_change_forces_rebuild(app_state):
+    first = app_state.refresh()
+    main.market_registry.add(main.PendleMarket("fGHO", 1, "0xabc"))
+    second = app_state.refresh()
+    assert second.data is not first.data
+    assert [pool.name for pool in second.data.pools] == ["fGHO"]
+    
+    main.market_registry.add(main.PendleMarket("fGHO", 1, "0xabc", "Pendle PT"))
+    assert [pool.type for pool in app_state.refresh().data.pools] == ["Pendle PT"]
+
+def test_etag_differs_per_encoding(app_state, client):
+    app_state.refresh()
+    identity = client.get("/api/yields")
+    gzipped = client.get("/api/yields", headers={"Accept-Encoding": "gzip"})
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert gzipped.headers["ETag"] == identity.headers["ETag"][:-1] + '-gz"'
+    assert gzipped.headers["Vary"] == "Accept-Encoding"
+    
+    headers = {"Accept-Encoding": "gzip", "If-None-Match": gzipped.headers["ETag"]}
+    assert client.get("/api/yields", headers=headers).status_code == 304
+    assert client.get("/api/yields", headers={"If-None-Match": gzipped.headers["ETag"]}).status_code == 200
@@ -0,0 +1,97 @@
+# tests/test_upstream_guard.py - 上游斷路器、自適應逾時與 UpstreamGuard
+import pytest
+
+import main
+
+def open_breaker(cooldown=60):
+    breaker = main.CircuitBreaker("test", 10, failure_threshold=2, cooldown=cooldown)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    return breaker
+
+def test_opens_after_threshold_and_short_circuits():
+    breaker = open_breaker()
+    assert breaker.allow() is False
+    assert breaker.allow() is False
+    assert breaker.stats()["short_circuits"] == 2
+
+def test_half_open_probe_success_closes():
+    breaker = open_breaker(cooldown=0)
+    assert breaker.allow() == "probe"
+    assert breaker.state == "half_open"
+    assert breaker.allow() is False  # 探測進行中，其他請求仍被擋下
+    breaker.record_success(0.1, {"ok": True})
+    assert breaker.state == "closed" and breaker.failures == 0
+    assert breaker.allow() is True
+
+def test_half_open_probe_failure_reopens():
+    breaker = open_breaker(cooldown=0)
+    assert breaker.allow() == "probe"
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+def test_fallback_returns_last_good_within_max_age(monkeypatch):
+    breaker = main.CircuitBreaker("test", 10)
+    assert breaker.fallback() == (None, None)
+    breaker.record_success(0.1, {"rate": 1})
+    payload, age = breaker.fallback()
+    assert payload == {"rate": 1} and age >= 0
+    breaker.last_good_at -= main.BREAKER_STALE_MAX_AGE + 1
+    assert breaker.fallback() == (None, None)
+
+def test_adaptive_timeout_follows_latency_within_bounds():
+    breaker = main.CircuitBreaker("test", 10)
+    for _ in range(main.ADAPTIVE_TIMEOUT_MIN_SAMPLES - 1):
+        breaker.record_success(0.01, {})
+    assert breaker.timeout() == 10  # 樣本不足時使用來源設定值
+    breaker.record_success(0.01, {})
+    assert breaker.timeout() == main.ADAPTIVE_TIMEOUT_MIN
+    for _ in range(main.ADAPTIVE_TIMEOUT_WINDOW):
+        breaker.record_success(5.0, {})
+    assert breaker.timeout() == 10
+    breaker.latencies.clear()
+    for _ in range(main.ADAPTIVE_TIMEOUT_WINDOW):
+        breaker.record_success(1.0, {})
+    assert breaker.timeout() == pytest.approx(1.0 * main.ADAPTIVE_TIMEOUT_FACTOR)
+
+def test_guard_passes_timeout_and_records_results():
+    guard = main.UpstreamGuard()
+    timeouts = []
+    def fetcher(timeout):
+        timeouts.append(timeout)
+        return {"ok": True}
+    assert guard.call("defillama", fetcher) == {"ok": True}
+    assert timeouts == [main.SOURCE_TIMEOUTS.get("defillama", main.REQUEST_TIMEOUT)]
+    assert guard.breaker("defillama").fallback()[0] == {"ok": True}
+    assert guard.stats()["defillama"]["timeout"] == round(timeouts[0], 2)
+
+def test_guard_short_circuits_without_calling_fetcher():
+    guard = main.UpstreamGuard()
+    breaker = guard.breaker("unit")
+    for _ in range(breaker.failure_threshold):
+        assert guard.call("unit", lambda timeout: None) is None
+    assert breaker.state == "open"
+    calls = []
+    assert guard.call("unit", lambda timeout: calls.append(timeout)) is None
+    assert calls == []
+    assert breaker.short_circuits == 1
+
+def test_guard_counts_exception_as_failure():
+    guard = main.UpstreamGuard()
+    def fetcher(timeout):
+        raise RuntimeError("boom")
+    with pytest.raises(RuntimeError):
+        guard.call("unit", fetcher)
+    assert guard.breaker("unit").failures == 1
+
+def test_guard_probe_bypasses_allow():
+    guard = main.UpstreamGuard()
+    breaker = guard.breaker("unit")
+    breaker.cooldown = 0
+    for _ in range(breaker.failure_threshold):
+        guard.call("unit", lambda timeout: None)
+    assert breaker.allow() == "probe"
+    assert guard.call("unit", lambda timeout: {"ok": True}, probe=True) == {"ok": True}
+    assert breaker.state == "closed"